@@ -1,14 +1,41 @@
 from __future__ import annotations
 
 import os
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional
 
 from flask import Flask
 
 from .camera import Camera
-from .processing import FaceDetector
-from .recording import VideoRecorder
+from .discovery import DiscoveryCache
+from .health import DEFERRED, HealthTracker
+from .processing import (
+    FaceDetectionService,
+    FaceTracker,
+    FramePipeline,
+    MotionDetector,
+    create_face_detector,
+    parse_input_size,
+)
+from .rawcapture import RawRecorder
+from .recording import PreEventBuffer, VideoRecorder
+from .registry import (
+    DEFAULT_CAMERA_ID,
+    CameraContext,
+    CameraRegistry,
+    CameraSpec,
+    env_flag,
+    load_camera_specs,
+)
+from .snapshots import SnapshotWriter
+from .sources import source_factory
 from .state import AppState
+from .streaming import DEFAULT_RENDITIONS, FrameCache, RenditionLadder, parse_renditions
+from .tracing import FrameTracer
+
+if TYPE_CHECKING:
+    from .workers import WorkerPool
 
 
 def create_app() -> Flask:
@@ -23,34 +50,298 @@ def create_app() -> Flask:
         static_folder=str(static_dir),
     )
 
-    app.extensions["state"] = AppState()
+    health = HealthTracker()
+    app.extensions["health"] = health
+
+    face_options = _face_detector_options(models_dir)
+    face_detector = create_face_detector(**face_options)
+    app.extensions["face_detector"] = face_detector
+    face_details = lambda: {"load_seconds": face_detector.load_seconds, "error": face_detector.error}  # noqa: E731
+    if env_flag(os.environ, "FACE_WARMUP", "1"):
+        # Load and warm the model now so the first Face Only frame does not
+        # wait for it. Without a model the app still serves, minus Face Only.
+        health.start(
+            "face_model",
+            face_detector.warm_up,
+            required=False,
+            live=lambda: face_detector.ready,
+            details=face_details,
+        )
+    else:
+        health.add("face_model", required=False, state=DEFERRED, details=face_details)
+    face_service = FaceDetectionService(
+        face_detector,
+        max_batch_size=int(os.environ.get("FACE_BATCH_SIZE", "8")),
+        max_wait=float(os.environ.get("FACE_BATCH_MAX_WAIT_MS", "10")) / 1000.0,
+    )
+    app.extensions["face_service"] = face_service
+
+    cache_path = os.environ.get("CAMERA_DISCOVERY_CACHE", "").strip()
+    discovery_cache = DiscoveryCache(Path(cache_path) if cache_path else project_root / ".camera_cache.json")
+
+    # MULTIPROCESS=1 moves capture, face detection and JPEG encoding into
+    # separate processes that share frames through shared-memory rings.
+    pools = None
+    if env_flag(os.environ, "MULTIPROCESS", "0"):
+        # Only imported when used: pulls in multiprocessing and shared memory.
+        from .workers import start_detector_pool, start_encoder_pool
+
+        encode_workers = int(os.environ.get("MP_ENCODE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+        pools = health.run(
+            "worker_pools",
+            lambda: (
+                start_detector_pool(int(os.environ.get("MP_FACE_WORKERS", "1")), face_options),
+                start_encoder_pool(encode_workers),
+            ),
+        )
+        app.extensions["worker_pools"] = pools
+
+    from .routes import bp as main_bp, follow_frames
+
+    registry = CameraRegistry()
+    for spec in load_camera_specs(os.environ):
+        context = _build_camera_context(spec, face_service, discovery_cache, project_root, pools)
+        context.follower = follow_frames
+        registry.add(context)
+        _start_camera(health, context)
+    app.extensions["cameras"] = registry
+    app.config["BURST_FRAMES"] = int(os.environ.get("BURST_FRAMES", "10"))
+
+    app.register_blueprint(main_bp)
+    return app
+
 
-    camera_index = int(os.environ.get("CAMERA_INDEX", "0"))
-    camera_width = int(os.environ.get("CAMERA_WIDTH", "640"))
-    camera_height = int(os.environ.get("CAMERA_HEIGHT", "480"))
-    camera_auto_detect = os.environ.get("CAMERA_AUTO_DETECT", "1").strip().lower() not in {
-        "0",
-        "false",
-        "no",
-        "off",
+def _face_detector_options(models_dir: Path) -> dict:
+    # FACE_MODEL can point at an ONNX export of the default network or at a
+    # YuNet model (e.g. face_detection_yunet_2023mar_int8.onnx).
+    model = os.environ.get("FACE_MODEL", "").strip()
+    prototxt = os.environ.get("FACE_PROTOTXT", "").strip()
+    return {
+        "model_path": Path(model) if model else models_dir / "res10_300x300_ssd_iter_140000.caffemodel",
+        "prototxt_path": Path(prototxt) if prototxt else models_dir / "deploy.prototxt.txt",
+        "min_confidence": float(os.environ.get("FACE_MIN_CONFIDENCE", "0.5")),
+        "input_size": parse_input_size(os.environ.get("FACE_INPUT_SIZE", "")),
+        "backend": os.environ.get("FACE_DNN_BACKEND", "default").strip().lower(),
+        "target": os.environ.get("FACE_DNN_TARGET", "cpu").strip().lower(),
     }
-    camera_max_index = int(os.environ.get("CAMERA_MAX_INDEX", "5"))
 
-    app.extensions["camera"] = Camera(
-        device_index=camera_index,
-        width=camera_width,
-        height=camera_height,
-        auto_detect=camera_auto_detect,
-        max_index=camera_max_index,
+
+def _build_camera_context(
+    spec: CameraSpec,
+    face_service: FaceDetectionService,
+    discovery_cache: DiscoveryCache,
+    project_root: Path,
+    pools: Optional[tuple[WorkerPool, WorkerPool]] = None,
+) -> CameraContext:
+    prefix = "vid" if spec.cam_id == DEFAULT_CAMERA_ID else f"vid_{spec.cam_id}"
+    probe_timeout = float(os.environ.get("CAMERA_PROBE_TIMEOUT", "3.0"))
+    fourcc = os.environ.get("CAMERA_FOURCC", "MJPG").strip()
+    buffer_size = _optional_int(os.environ.get("CAMERA_BUFFER_SIZE", "1"))
+    # The page mirrors the picture with CSS, which lets plain frames go out
+    # as the camera encoded them.
+    mirror_on_client = env_flag(os.environ, "MIRROR_ON_CLIENT", "1")
+    tracer = _build_tracer(spec.cam_id)
+    encoder = None
+    if pools is not None:
+        from .workers import ProcessCamera, RingEncoder, RingFaceDetectionService
+
+        detector_pool, encoder_pool = pools
+        camera = ProcessCamera(
+            device_index=spec.device_index,
+            width=spec.width,
+            height=spec.height,
+            slots=int(os.environ.get("MP_RING_SLOTS", "8")),
+            source=spec.source,
+            discovery_cache_path=discovery_cache.path,
+            name=spec.cam_id,
+            auto_detect=spec.auto_detect,
+            max_index=spec.max_index,
+            probe_timeout=probe_timeout,
+            fourcc=fourcc,
+            buffer_size=buffer_size,
+        )
+        face_service = RingFaceDetectionService(
+            detector_pool,
+            camera,
+            timeout=float(os.environ.get("MP_FACE_TIMEOUT", "2")),
+        )
+        encoder = RingEncoder(encoder_pool, (spec.width, spec.height))
+    else:
+        camera = Camera(
+            device_index=spec.device_index,
+            width=spec.width,
+            height=spec.height,
+            auto_detect=spec.auto_detect,
+            max_index=spec.max_index,
+            probe_timeout=probe_timeout,
+            discovery_cache=discovery_cache,
+            source_factory=source_factory(spec.source, spec.width, spec.height),
+            fourcc=fourcc,
+            buffer_size=buffer_size,
+            passthrough=mirror_on_client and env_flag(os.environ, "CAMERA_MJPEG_PASSTHROUGH", "1"),
+            tracer=tracer,
+            name=spec.cam_id,
+        )
+    return CameraContext(
+        cam_id=spec.cam_id,
+        camera=camera,
+        state=AppState(),
+        recorder=_build_recorder(spec.cam_id, prefix, project_root),
+        snapshots=SnapshotWriter(
+            Path(os.environ.get("SNAPSHOT_DIR", "shots")),
+            name_prefix="shot" if spec.cam_id == DEFAULT_CAMERA_ID else f"shot_{spec.cam_id}",
+            image_format=os.environ.get("SNAPSHOT_FORMAT", "png"),
+            compression=_optional_int(os.environ.get("SNAPSHOT_COMPRESSION")),
+            workers=int(os.environ.get("SNAPSHOT_WORKERS", "2")),
+            timeout=float(os.environ.get("SNAPSHOT_TIMEOUT", "10")),
+        ),
+        face_tracker=FaceTracker(
+            face_service,
+            every_n_frames=int(os.environ.get("FACE_DETECT_EVERY_N", "5")),
+            max_detections_per_second=float(os.environ.get("FACE_DETECT_MAX_FPS", "0")),
+            smoothing=float(os.environ.get("FACE_SMOOTHING", "0.35")),
+            motion=_build_face_motion_gate(spec.cam_id),
+        ),
+        pipeline=FramePipeline((spec.width, spec.height), name=spec.cam_id, mirror=not mirror_on_client),
+        render_cache=FrameCache(max_entries=4),
+        frame_cache=FrameCache(max_entries=int(os.environ.get("STREAM_CACHE_ENTRIES", "32"))),
+        renditions=RenditionLadder(
+            parse_renditions(
+                os.environ.get("STREAM_RENDITIONS", DEFAULT_RENDITIONS),
+                (spec.width, spec.height),
+            ),
+            workers=int(os.environ.get("STREAM_ENCODE_WORKERS", "2")),
+        ),
+        continuous_recording=env_flag(os.environ, "RECORD_CONTINUOUS", "0"),
+        encoder=encoder,
+        motion=_build_motion_detector(spec.cam_id),
+        raw_recorder=RawRecorder(
+            Path(os.environ.get("RAW_DIR", "raw")),
+            max_bytes=int(float(os.environ.get("RAW_MAX_MB", "2048")) * 1024 * 1024),
+            max_frames=int(os.environ.get("RAW_MAX_FRAMES", "100000")),
+            name_prefix="raw" if spec.cam_id == DEFAULT_CAMERA_ID else f"raw_{spec.cam_id}",
+            transcode_format=os.environ.get("RAW_TRANSCODE", ""),
+            keep_raw=env_flag(os.environ, "RAW_KEEP", "1"),
+        ),
+        tracer=tracer,
     )
-    app.extensions["face_detector"] = FaceDetector(
-        prototxt_path=models_dir / "deploy.prototxt.txt",
-        model_path=models_dir / "res10_300x300_ssd_iter_140000.caffemodel",
-        min_confidence=0.5,
+
+
+def _start_camera(health: HealthTracker, context: CameraContext) -> None:
+    # The device (or source) is opened in the background, so neither start-up
+    # nor the first viewer waits for the probe. CAMERA_OPEN_AT_START=0 leaves
+    # it closed until someone watches.
+    camera = context.camera
+    name = f"camera:{context.cam_id}"
+    # Continuous recording and the pre-event buffer capture from start-up,
+    # with or without viewers.
+    unattended = context.records_unattended and context.state.snapshot().stream_on
+    if not env_flag(os.environ, "CAMERA_OPEN_AT_START", "1"):
+        health.add(name, state=DEFERRED, details=lambda: {"capturing": camera.is_capturing})
+        if unattended:
+            context.start_stream()
+        return
+
+    if not hasattr(camera, "open"):
+        # A ProcessCamera opens its device in the capture process, so it is
+        # ready once the first frame has come through the ring.
+        timeout = float(os.environ.get("CAMERA_OPEN_TIMEOUT", "10"))
+
+        def start_capture_process() -> None:
+            context.start_stream()
+            deadline = time.monotonic() + timeout
+            while camera.hub.wait_next(0, timeout=0.2) is None:
+                if not camera.is_capturing:
+                    raise RuntimeError("Capture process exited")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"No frame from the capture process within {timeout:g}s")
+
+        health.start(
+            name,
+            start_capture_process,
+            live=lambda: camera.is_capturing and camera.latest_ref() is not None,
+            details=lambda: {"capturing": camera.is_capturing, "receiving": camera.latest_ref() is not None},
+        )
+        return
+
+    def open_camera() -> None:
+        opened = camera.open()
+        if unattended:
+            # The capture thread keeps retrying a camera that is not there yet.
+            context.start_stream()
+        if not opened:
+            raise RuntimeError("Camera could not be opened")
+
+    health.start(
+        name,
+        open_camera,
+        live=lambda: camera.is_open or camera.is_capturing,
+        details=lambda: {"open": camera.is_open, "capturing": camera.is_capturing},
     )
-    app.extensions["recorder"] = VideoRecorder(output_dir=project_root, fps=20.0)
 
-    from .routes import bp as main_bp
 
-    app.register_blueprint(main_bp)
-    return app
+def _build_tracer(cam_id: str) -> Optional[FrameTracer]:
+    # TRACE_SAMPLE_EVERY=30 traces one frame in 30 through every stage.
+    sample_every = int(os.environ.get("TRACE_SAMPLE_EVERY", "0"))
+    if sample_every <= 0:
+        return None
+    return FrameTracer(
+        sample_every,
+        capacity=int(os.environ.get("TRACE_BUFFER", "64")),
+        name=cam_id,
+    )
+
+
+def _build_face_motion_gate(cam_id: str) -> Optional[MotionDetector]:
+    # Face detection pauses while the scene is static (FACE_MOTION_GATE=0
+    # detects at the full rate regardless).
+    if not env_flag(os.environ, "FACE_MOTION_GATE", "1"):
+        return None
+    return MotionDetector(
+        pixel_threshold=int(os.environ.get("MOTION_PIXEL_THRESHOLD", "15")),
+        min_changed_fraction=float(os.environ.get("MOTION_MIN_AREA", "0.002")),
+        name=cam_id,
+        stage="face_motion",
+    )
+
+
+def _build_motion_detector(cam_id: str) -> Optional[MotionDetector]:
+    # Motion-only recording needs the detector, which also turns on reuse of
+    # the last rendered frame while the scene is static.
+    if not (env_flag(os.environ, "MOTION_DETECT", "0") or env_flag(os.environ, "RECORD_MOTION_ONLY", "0")):
+        return None
+    return MotionDetector(
+        pixel_threshold=int(os.environ.get("MOTION_PIXEL_THRESHOLD", "15")),
+        min_changed_fraction=float(os.environ.get("MOTION_MIN_AREA", "0.002")),
+        name=cam_id,
+    )
+
+
+def _build_recorder(cam_id: str, prefix: str, project_root: Path) -> VideoRecorder:
+    prebuffer_seconds = float(os.environ.get("RECORD_PREBUFFER_SECONDS", "0"))
+    prebuffer = None
+    if prebuffer_seconds > 0:
+        prebuffer = PreEventBuffer(
+            seconds=prebuffer_seconds,
+            max_bytes=int(float(os.environ.get("RECORD_PREBUFFER_MAX_MB", "32")) * 1024 * 1024),
+        )
+    recordings_dir = os.environ.get("RECORDINGS_DIR", "").strip()
+    return VideoRecorder(
+        output_dir=project_root,
+        fps=20.0,
+        name_prefix=prefix,
+        prebuffer=prebuffer,
+        segment_seconds=float(os.environ.get("RECORD_SEGMENT_SECONDS", "0")),
+        segments_dir=Path(recordings_dir) if recordings_dir else None,
+        retention_seconds=float(os.environ.get("RECORD_RETENTION_HOURS", "0")) * 3600.0,
+        max_disk_bytes=int(float(os.environ.get("RECORD_MAX_DISK_MB", "0")) * 1024 * 1024),
+        motion_only=env_flag(os.environ, "RECORD_MOTION_ONLY", "0"),
+        motion_tail_seconds=float(os.environ.get("RECORD_MOTION_TAIL_SECONDS", "5")),
+        name=cam_id,
+    )
+
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    if value is None or not value.strip():
+        return None
+    return int(value)
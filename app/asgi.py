@@ -0,0 +1,431 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+
+from . import create_app
+from .hub import Frame
+from .metrics import (
+    STAGE_SECONDS,
+    STREAM_BYTES_SENT,
+    STREAM_CLIENT_FPS,
+    STREAM_FRAMES_SENT,
+    STREAM_FRAMES_SKIPPED,
+    STREAM_VIEWERS,
+)
+from .routes import (
+    STATIC_RESEND_SECONDS,
+    client_stream,
+    frame_trace,
+    placeholder_chunk,
+    render_display,
+    render_key,
+    stream_chunk,
+)
+from .state import StateSnapshot
+from .tiles import TileDeltaEncoder
+
+_VIDEO_FEED = re.compile(r"^/video_feed(?:/(?P<cam_id>[^/]+))?/?$")
+_TILE_FEED = re.compile(r"^/ws/video_feed(?:/(?P<cam_id>[^/]+))?/?$")
+_client_ids = itertools.count(1)
+
+
+class AsyncFrameProducer:
+    # One per camera. A dedicated thread follows the camera hub and hands each
+    # frame to the event loop, which wakes every waiting viewer coroutine; the
+    # blocking hub wait never occupies the encode pool. Each (frame, state,
+    # variant) is rendered and encoded once on the worker pool and shared
+    # through a future.
+    def __init__(
+        self,
+        context,
+        executor: ThreadPoolExecutor,
+        max_variants: int = 32,
+        tile_options: Optional[dict] = None,
+    ) -> None:
+        self._context = context
+        self._executor = executor
+        self._max_variants = max(1, int(max_variants))
+        self._tile_options = tile_options or {}
+        self._tiles: Optional[TileDeltaEncoder] = None
+        self._changed = asyncio.Event()
+        self._latest: Optional[Frame] = None
+        self._variants: OrderedDict[tuple, asyncio.Future] = OrderedDict()
+        self._viewers = 0
+        self._stop = Event()
+        self._thread: Optional[Thread] = None
+
+    @property
+    def viewers(self) -> int:
+        return self._viewers
+
+    def attach(self) -> None:
+        self._viewers += 1
+        if self._thread is None:
+            self._thread = Thread(
+                target=self._follow,
+                args=(asyncio.get_running_loop(),),
+                name=f"asgi-hub-{self._context.cam_id}",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def detach(self) -> None:
+        self._viewers = max(0, self._viewers - 1)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def wait_next(self, after_seq: int, timeout: float = 1.0) -> Optional[Frame]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._latest is None or self._latest.seq <= after_seq:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+        return self._latest
+
+    async def encoded(self, captured: Frame, s: StateSnapshot, recording: bool, size, quality: int) -> bytes:
+        key = (captured.seq, s.version, recording, size, quality)
+        future = self._variants.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._executor, stream_chunk, self._context, captured, s, recording, size, quality
+            )
+            self._variants[key] = future
+            while len(self._variants) > self._max_variants:
+                self._variants.popitem(last=False)
+        return await asyncio.shield(future)
+
+    async def tiles(self, captured: Frame, s: StateSnapshot, recording: bool) -> TileDeltaEncoder:
+        # The tile reference is advanced once per (frame, state) for all
+        # WebSocket viewers of this camera.
+        if self._tiles is None:
+            self._tiles = TileDeltaEncoder(
+                self._context.pipeline.output_size, name=self._context.cam_id, **self._tile_options
+            )
+        key = (captured.seq, s.version, recording, "tiles")
+        future = self._variants.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, self._update_tiles, captured, s, recording)
+            self._variants[key] = future
+            while len(self._variants) > self._max_variants:
+                self._variants.popitem(last=False)
+        await asyncio.shield(future)
+        return self._tiles
+
+    def _update_tiles(self, captured: Frame, s: StateSnapshot, recording: bool) -> None:
+        key = render_key(self._context, captured, s, recording)
+        self._tiles.update(key, render_display(self._context, captured, s, recording, key))
+
+    def _follow(self, loop: asyncio.AbstractEventLoop) -> None:
+        hub = self._context.camera.hub
+        last_seq = 0
+        while not self._stop.is_set():
+            captured = hub.wait_next(last_seq, timeout=0.5)
+            if captured is None:
+                continue
+            last_seq = captured.seq
+            if self._viewers == 0:
+                continue
+            try:
+                loop.call_soon_threadsafe(self._publish, captured)
+            except RuntimeError:
+                # The event loop is closed.
+                return
+
+    def _publish(self, captured: Frame) -> None:
+        self._latest = captured
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncStreamingApp:
+    # ASGI front end: /video_feed is served by coroutines so hundreds of
+    # viewers cost a few tasks instead of a thread each, and /ws/video_feed
+    # streams changed tiles over a WebSocket; every other path is handed to
+    # the Flask app through asgiref's WSGI adapter.
+    def __init__(
+        self,
+        flask_app: Flask,
+        *,
+        workers: int = 4,
+        tile_options: Optional[dict] = None,
+        keyframe_seconds: float = 10.0,
+    ) -> None:
+        try:
+            from asgiref.wsgi import WsgiToAsgi
+        except ImportError as exc:
+            raise RuntimeError("The ASGI mode needs asgiref: pip install asgiref uvicorn") from exc
+        self._flask_app = flask_app
+        self._wsgi = WsgiToAsgi(flask_app)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="asgi-stream")
+        self._producers: dict[str, AsyncFrameProducer] = {}
+        self._tile_options = tile_options or {}
+        self._keyframe_seconds = max(0.5, float(keyframe_seconds))
+        # Lets the page offer the tile transport.
+        flask_app.config["TILE_STREAM"] = True
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "websocket":
+            match = _TILE_FEED.match(scope["path"])
+            if match is None:
+                await receive()
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            await self._tile_feed(match.group("cam_id"), receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            match = _VIDEO_FEED.match(scope["path"])
+            if match is not None:
+                await self._video_feed(match.group("cam_id"), scope, receive, send)
+                return
+        await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                for producer in self._producers.values():
+                    producer.stop()
+                self._flask_app.extensions["cameras"].shutdown()
+                for pool in self._flask_app.extensions.get("worker_pools", ()):
+                    pool.shutdown()
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _producer(self, context) -> AsyncFrameProducer:
+        producer = self._producers.get(context.cam_id)
+        if producer is None:
+            producer = AsyncFrameProducer(context, self._executor, tile_options=self._tile_options)
+            self._producers[context.cam_id] = producer
+        return producer
+
+    async def _video_feed(self, cam_id: Optional[str], scope, receive, send) -> None:
+        registry = self._flask_app.extensions["cameras"]
+        try:
+            context = registry.get(cam_id)
+            args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+            client = client_stream(context, args)
+        except KeyError:
+            await _plain_response(send, 404, b"Not Found")
+            return
+        except HTTPException as exc:
+            await _plain_response(send, exc.code or 400, (exc.name or "").encode())
+            return
+
+        if context.state.snapshot().stream_on:
+            context.start_stream()
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"multipart/x-mixed-replace; boundary=frame")],
+            }
+        )
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        producer = self._producer(context)
+        producer.attach()
+        stream = asyncio.ensure_future(self._stream(context, producer, client, send))
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream, disconnect):
+                task.cancel()
+            producer.detach()
+
+    async def _stream(self, context, producer: AsyncFrameProducer, client, send) -> None:
+        cam_id = context.cam_id
+        client_id = f"a{next(_client_ids)}"
+        viewers = STREAM_VIEWERS.labels(cam_id)
+        client_fps = STREAM_CLIENT_FPS.labels(cam_id, client_id)
+        frames_sent = STREAM_FRAMES_SENT.labels(cam_id)
+        frames_skipped = STREAM_FRAMES_SKIPPED.labels(cam_id)
+        bytes_sent = STREAM_BYTES_SENT.labels(cam_id)
+        send_seconds = STAGE_SECONDS.labels(cam_id, "send")
+        last_seq = 0
+        last_chunk, last_sent_at = None, 0.0
+        viewers.inc()
+
+        async def emit(chunk: bytes) -> float:
+            sent_at = time.monotonic()
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            return time.monotonic() - sent_at
+
+        try:
+            while True:
+                s = context.state.snapshot()
+                if not s.stream_on:
+                    await emit(placeholder_chunk(client.size, client.quality, "Stream paused"))
+                    await asyncio.sleep(0.1)
+                    continue
+
+                delay = client.pacing_delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                captured = await producer.wait_next(last_seq, timeout=1.0)
+                if captured is None:
+                    await emit(placeholder_chunk(client.size, client.quality, "Camera not available"))
+                    continue
+                seq_gap = captured.seq - last_seq if last_seq else 1
+                client.frame_captured(seq_gap, captured.captured_at)
+                if seq_gap > 1:
+                    frames_skipped.inc(seq_gap - 1)
+                last_seq = captured.seq
+
+                chunk = await producer.encoded(
+                    captured, s, context.recorder.is_recording, client.size, client.quality
+                )
+                if chunk is last_chunk and time.monotonic() - last_sent_at < STATIC_RESEND_SECONDS:
+                    continue
+                last_chunk, last_sent_at = chunk, time.monotonic()
+                elapsed = await emit(chunk)
+                send_seconds.observe(elapsed)
+                trace = frame_trace(context, captured)
+                if trace is not None:
+                    ended = time.perf_counter()
+                    trace.add("yield", ended - elapsed, ended, client=client_id, bytes=len(chunk))
+                client.frame_sent(len(chunk), elapsed)
+                client_fps.set(client.fps)
+                frames_sent.inc()
+                bytes_sent.inc(len(chunk))
+        finally:
+            viewers.dec()
+            STREAM_CLIENT_FPS.remove(cam_id, client_id)
+
+    async def _tile_feed(self, cam_id: Optional[str], receive, send) -> None:
+        message = await receive()
+        if message["type"] != "websocket.connect":
+            return
+        try:
+            context = self._flask_app.extensions["cameras"].get(cam_id)
+        except KeyError:
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send({"type": "websocket.accept"})
+        if context.state.snapshot().stream_on:
+            context.start_stream()
+
+        producer = self._producer(context)
+        producer.attach()
+        stream = asyncio.ensure_future(self._tile_stream(context, producer, send))
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream, disconnect):
+                task.cancel()
+            producer.detach()
+
+    async def _tile_stream(self, context, producer: AsyncFrameProducer, send) -> None:
+        # Nothing is sent while the scene is still: bandwidth follows the
+        # amount of change, with a full keyframe every keyframe_seconds (or
+        # when most tiles changed anyway) to resynchronise.
+        cam_id = context.cam_id
+        loop = asyncio.get_running_loop()
+        viewers = STREAM_VIEWERS.labels(cam_id)
+        frames_sent = STREAM_FRAMES_SENT.labels(cam_id)
+        frames_skipped = STREAM_FRAMES_SKIPPED.labels(cam_id)
+        bytes_sent = STREAM_BYTES_SENT.labels(cam_id)
+        last_seq = 0
+        known = None
+        keyframe_at = 0.0
+        viewers.inc()
+        try:
+            while True:
+                s = context.state.snapshot()
+                if not s.stream_on:
+                    await asyncio.sleep(0.1)
+                    continue
+                captured = await producer.wait_next(last_seq, timeout=1.0)
+                if captured is None:
+                    continue
+                if last_seq and captured.seq - last_seq > 1:
+                    frames_skipped.inc(captured.seq - last_seq - 1)
+                last_seq = captured.seq
+
+                tiles = await producer.tiles(captured, s, context.recorder.is_recording)
+                now = time.monotonic()
+                message = None
+                if known is not None and now - keyframe_at < self._keyframe_seconds:
+                    known, message, count = await loop.run_in_executor(self._executor, tiles.delta, known)
+                    if message is None:
+                        continue
+                    if count * 2 > tiles.tile_count:
+                        message = None
+                if message is None:
+                    known, message = await loop.run_in_executor(self._executor, tiles.keyframe)
+                    keyframe_at = now
+                sent_at = time.perf_counter()
+                await send({"type": "websocket.send", "bytes": message})
+                trace = frame_trace(context, captured)
+                if trace is not None:
+                    trace.add("yield", sent_at, time.perf_counter(), transport="tiles", bytes=len(message))
+                frames_sent.inc()
+                bytes_sent.inc(len(message))
+        finally:
+            viewers.dec()
+
+
+async def _wait_disconnect(receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] in ("http.disconnect", "websocket.disconnect"):
+            return
+
+
+async def _plain_response(send, status: int, body: bytes) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(flask_app: Optional[Flask] = None) -> AsyncStreamingApp:
+    if flask_app is None:
+        flask_app = create_app()
+    return AsyncStreamingApp(
+        flask_app,
+        workers=int(os.environ.get("ASGI_STREAM_WORKERS", "4")),
+        tile_options={
+            "tile": int(os.environ.get("WS_TILE_SIZE", "64")),
+            "quality": int(os.environ.get("WS_TILE_QUALITY", "75")),
+            "pixel_threshold": int(os.environ.get("WS_TILE_PIXEL_THRESHOLD", "20")),
+            "min_changed_fraction": float(os.environ.get("WS_TILE_MIN_AREA", "0.005")),
+        },
+        keyframe_seconds=float(os.environ.get("WS_KEYFRAME_SECONDS", "10")),
+    )
@@ -1,13 +1,27 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from threading import Lock
+from threading import Event, Lock, Thread, current_thread
 from typing import Optional
 
-import sys
 import time
 
 import cv2
+import numpy as np
+
+from .discovery import (
+    DiscoveryCache,
+    ProbeResult,
+    backend_candidates,
+    capture_fourcc,
+    open_with_timeout,
+    probe_index,
+    probe_indices,
+)
+from .hub import FrameHub
+from .metrics import CAPTURE_FAILURES, CAPTURE_FPS, CAPTURE_FRAMES, CAPTURE_SECONDS
+from .sources import FrameSource, SourceFactory
+from .tracing import FrameTracer
 
 
 @dataclass(frozen=True)
@@ -27,21 +41,56 @@ class Camera:
         auto_detect: bool = True,
         max_index: int = 5,
         open_retry_seconds: float = 1.0,
+        probe_timeout: float = 3.0,
+        discovery_cache: Optional[DiscoveryCache] = None,
+        source_factory: Optional[SourceFactory] = None,
+        fourcc: Optional[str] = None,
+        buffer_size: Optional[int] = None,
+        passthrough: bool = False,
+        tracer: Optional[FrameTracer] = None,
+        name: str = "default",
     ) -> None:
         self._config = CameraConfig(device_index=device_index, width=width, height=height)
+        self._fourcc = fourcc or None
+        self._buffer_size = buffer_size
+        self._passthrough = passthrough
+        self._tracer = tracer
         self._auto_detect = auto_detect
         self._max_index = max(0, int(max_index))
         self._open_retry_seconds = max(0.1, float(open_retry_seconds))
+        self._probe_timeout = max(0.1, float(probe_timeout))
+        self._discovery_cache = discovery_cache
+        self._source_factory = source_factory
         self._lock = Lock()
-        self._cap: Optional[cv2.VideoCapture] = None
+        # Serializes open(): the start-up task and the capture thread may both
+        # try, and a device must not be probed twice at once.
+        self._open_lock = Lock()
+        self._cap: Optional[FrameSource] = None
         self._active_index: Optional[int] = None
         self._active_backend: Optional[int] = None
+        self._jpeg_mode = False
         self._last_open_failure_at: Optional[float] = None
+        self._hub = FrameHub()
+        self._capture_thread: Optional[Thread] = None
+        self._capture_stop: Optional[Event] = None
+        self._capture_seconds = CAPTURE_SECONDS.labels(name)
+        self._capture_frames = CAPTURE_FRAMES.labels(name)
+        self._capture_failures = CAPTURE_FAILURES.labels(name)
+        self._capture_fps = CAPTURE_FPS.labels(name)
 
     @property
     def config(self) -> CameraConfig:
         return self._config
 
+    @property
+    def hub(self) -> FrameHub:
+        return self._hub
+
+    @property
+    def is_capturing(self) -> bool:
+        with self._lock:
+            return self._capture_thread is not None and self._capture_thread.is_alive()
+
     @property
     def active_index(self) -> Optional[int]:
         with self._lock:
@@ -52,7 +101,22 @@ class Camera:
         with self._lock:
             return self._active_backend
 
-    def open(self) -> None:
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._cap is not None and self._cap.isOpened()
+
+    @property
+    def passthrough_active(self) -> bool:
+        with self._lock:
+            return self._jpeg_mode
+
+    def open(self) -> bool:
+        with self._open_lock:
+            self._open()
+        return self.is_open
+
+    def _open(self) -> None:
         with self._lock:
             if self._cap is not None and self._cap.isOpened():
                 return
@@ -60,19 +124,36 @@ class Camera:
                 if (time.monotonic() - self._last_open_failure_at) < self._open_retry_seconds:
                     return
 
+        if self._source_factory is not None:
+            self._open_source(self._source_factory)
+            return
+
         preferred_index = self._config.device_index
-        indices = [preferred_index]
-        if self._auto_detect:
-            indices.extend(i for i in range(self._max_index + 1) if i != preferred_index)
+        cache_key = str(preferred_index)
+        if self._discovery_cache is not None:
+            cached = self._discovery_cache.get(cache_key)
+            if cached is not None:
+                cap = open_with_timeout(cached.index, cached.backend, self._probe_timeout, **self._open_kwargs())
+                if cap is not None:
+                    self._set_active(cap, cached)
+                    return
+                self._discovery_cache.forget(cache_key)
 
-        for index in indices:
-            cap = self._try_open_index(index)
-            if cap is None:
-                continue
-            with self._lock:
-                self._cap = cap
-                self._active_index = index
-                self._last_open_failure_at = None
+        found = self._try_open_index(preferred_index)
+        if found is None and self._auto_detect:
+            others = [i for i in range(self._max_index + 1) if i != preferred_index]
+            opened = probe_indices(others, backend_candidates(), self._probe_timeout, **self._open_kwargs())
+            for index in sorted(opened):
+                if found is None:
+                    found = opened[index]
+                else:
+                    opened[index][1].release()
+
+        if found is not None:
+            result, cap = found
+            self._set_active(cap, result)
+            if self._discovery_cache is not None:
+                self._discovery_cache.put(cache_key, result)
             return
 
         with self._lock:
@@ -81,46 +162,58 @@ class Camera:
             self._active_backend = None
             self._last_open_failure_at = time.monotonic()
 
-    def _try_open_index(self, index: int) -> Optional[cv2.VideoCapture]:
-        for backend in self._backend_candidates():
-            cap: Optional[cv2.VideoCapture] = None
-            try:
-                cap = cv2.VideoCapture(index, backend)
-                if cap is None or not cap.isOpened():
-                    if cap is not None:
-                        cap.release()
-                    continue
-                cap.set(cv2.CAP_PROP_FRAME_WIDTH, self._config.width)
-                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self._config.height)
-                with self._lock:
-                    self._active_backend = backend
-                return cap
-            except Exception:
-                try:
-                    if cap is not None:
-                        cap.release()
-                except Exception:
-                    pass
-        return None
+    def _open_source(self, factory: SourceFactory) -> None:
+        try:
+            source: Optional[FrameSource] = factory()
+        except Exception:
+            source = None
+        if source is not None and not source.isOpened():
+            source.release()
+            source = None
+        with self._lock:
+            self._cap = source
+            self._active_index = None
+            self._active_backend = None
+            self._jpeg_mode = False
+            self._last_open_failure_at = None if source is not None else time.monotonic()
 
-    def _backend_candidates(self) -> list[int]:
-        def add(name: str, acc: list[int]) -> None:
-            value = getattr(cv2, name, None)
-            if value is None:
-                return
-            if value not in acc:
-                acc.append(value)
-
-        candidates: list[int] = []
-        if sys.platform.startswith("win"):
-            add("CAP_DSHOW", candidates)
-            add("CAP_MSMF", candidates)
-        elif sys.platform == "darwin":
-            add("CAP_AVFOUNDATION", candidates)
-        else:
-            add("CAP_V4L2", candidates)
-        add("CAP_ANY", candidates)
-        return candidates
+    def _set_active(self, cap: FrameSource, result: ProbeResult) -> None:
+        jpeg_mode = self._enable_passthrough(cap)
+        with self._lock:
+            self._cap = cap
+            self._active_index = result.index
+            self._active_backend = result.backend
+            self._jpeg_mode = jpeg_mode
+            self._last_open_failure_at = None
+
+    def _open_kwargs(self) -> dict:
+        # MJPG lets USB cameras deliver full frame rates at higher resolutions,
+        # and a one-frame driver buffer keeps the newest frame the one we read.
+        return {
+            "width": self._config.width,
+            "height": self._config.height,
+            "fourcc": self._fourcc,
+            "buffer_size": self._buffer_size,
+        }
+
+    def _try_open_index(self, index: int) -> Optional[tuple[ProbeResult, cv2.VideoCapture]]:
+        return probe_index(index, backend_candidates(), self._probe_timeout, **self._open_kwargs())
+
+    def _enable_passthrough(self, cap) -> bool:
+        # With RGB conversion off, retrieve() hands back the camera's JPEG
+        # bytes untouched. Only worth it when they are already the size the
+        # pipeline outputs.
+        if not self._passthrough or not hasattr(cap, "grab"):
+            return False
+        try:
+            if capture_fourcc(cap) != "MJPG":
+                return False
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            if size != (self._config.width, self._config.height):
+                return False
+            return bool(cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+        except Exception:
+            return False
 
     def release(self) -> None:
         with self._lock:
@@ -132,8 +225,17 @@ class Camera:
                 self._cap = None
                 self._active_index = None
                 self._active_backend = None
+                self._jpeg_mode = False
 
     def read(self) -> tuple[bool, Optional["cv2.Mat"]]:
+        ok, frame, jpeg = self._grab()
+        if jpeg is not None:
+            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return ok and frame is not None, frame
+
+    def _grab(self) -> tuple[bool, Optional["cv2.Mat"], Optional[bytes]]:
+        # (ok, pixels, jpeg): in passthrough mode a frame comes back as the
+        # camera's JPEG bytes and no pixels.
         with self._lock:
             cap = self._cap
         if cap is None or not cap.isOpened():
@@ -141,11 +243,84 @@ class Camera:
             with self._lock:
                 cap = self._cap
         if cap is None:
-            return False, None
-        success, frame = cap.read()
+            return False, None, None
+        with self._lock:
+            jpeg_mode = self._jpeg_mode
+        started = time.perf_counter()
+        if jpeg_mode:
+            success = cap.grab()
+            frame = cap.retrieve()[1] if success else None
+            success = success and frame is not None
+        else:
+            success, frame = cap.read()
+        self._capture_seconds.observe(time.perf_counter() - started)
         if not success:
+            self._capture_failures.inc()
             self.release()
             with self._lock:
                 self._last_open_failure_at = time.monotonic()
-            return False, None
-        return True, frame
+            return False, None, None
+        self._capture_frames.inc()
+        if jpeg_mode:
+            jpeg = _as_jpeg(frame)
+            if jpeg is not None:
+                return True, None, jpeg
+        return True, frame, None
+
+    def start_capture(self) -> None:
+        with self._lock:
+            if self._capture_thread is not None and self._capture_thread.is_alive():
+                return
+            stop_event = Event()
+            thread = Thread(
+                target=self._capture_loop,
+                args=(stop_event,),
+                name=f"camera-capture-{self._config.device_index}",
+                daemon=True,
+            )
+            self._capture_stop = stop_event
+            self._capture_thread = thread
+        thread.start()
+
+    def stop_capture(self) -> None:
+        with self._lock:
+            thread = self._capture_thread
+            stop_event = self._capture_stop
+            self._capture_thread = None
+            self._capture_stop = None
+        if stop_event is not None:
+            stop_event.set()
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout=2.0)
+        self._hub.reset()
+
+    def _capture_loop(self, stop_event: Event) -> None:
+        fps = 0.0
+        last_at: Optional[float] = None
+        while not stop_event.is_set():
+            started = time.perf_counter()
+            ok, frame, jpeg = self._grab()
+            if not ok or (frame is None and jpeg is None):
+                self._capture_fps.set(0.0)
+                last_at = None
+                stop_event.wait(0.1)
+                continue
+            published = self._hub.publish(frame, jpeg=jpeg)
+            trace = self._tracer.trace(published) if self._tracer is not None else None
+            if trace is not None:
+                trace.add("capture", started, time.perf_counter(), jpeg=jpeg is not None)
+            if last_at is not None and published.captured_at > last_at:
+                rate = 1.0 / (published.captured_at - last_at)
+                fps = rate if fps <= 0 else fps + (rate - fps) * 0.1
+                self._capture_fps.set(fps)
+            last_at = published.captured_at
+        self._capture_fps.set(0.0)
+
+
+def _as_jpeg(data) -> Optional[bytes]:
+    # Some backends decode regardless of CAP_PROP_CONVERT_RGB; only a buffer
+    # starting with the JPEG SOI marker is passed through.
+    buf = np.asarray(data).reshape(-1)
+    if buf.dtype != np.uint8 or buf.size < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    return buf.tobytes()
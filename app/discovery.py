@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Optional, Sequence
+
+import cv2
+
+
+@dataclass(frozen=True)
+class ProbeResult:
+    index: int
+    backend: int
+    backend_name: str
+
+
+def backend_candidates() -> list[tuple[str, int]]:
+    def add(name: str, acc: list[tuple[str, int]]) -> None:
+        value = getattr(cv2, name, None)
+        if value is None:
+            return
+        if any(v == value for _, v in acc):
+            return
+        acc.append((name, value))
+
+    candidates: list[tuple[str, int]] = []
+    if sys.platform.startswith("win"):
+        add("CAP_DSHOW", candidates)
+        add("CAP_MSMF", candidates)
+    elif sys.platform == "darwin":
+        add("CAP_AVFOUNDATION", candidates)
+    else:
+        add("CAP_V4L2", candidates)
+    add("CAP_ANY", candidates)
+    return candidates
+
+
+def open_capture(
+    index: int,
+    backend: int,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    *,
+    fourcc: Optional[str] = None,
+    buffer_size: Optional[int] = None,
+    read_frame: bool = False,
+) -> Optional[cv2.VideoCapture]:
+    cap: Optional[cv2.VideoCapture] = None
+    try:
+        cap = cv2.VideoCapture(index, backend)
+        if cap is None or not cap.isOpened():
+            _release(cap)
+            return None
+        # The pixel format has to be requested before the size: on V4L2 the
+        # sizes a camera offers depend on the format.
+        if fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if buffer_size is not None:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        if read_frame:
+            ok, _ = cap.read()
+            if not ok:
+                _release(cap)
+                return None
+        return cap
+    except Exception:
+        _release(cap)
+        return None
+
+
+def open_with_timeout(index: int, backend: int, timeout: float, **kwargs) -> Optional[cv2.VideoCapture]:
+    # cv2.VideoCapture cannot be cancelled, so a hung attempt is left to finish
+    # on its daemon thread and releases whatever it opens once abandoned.
+    lock = Lock()
+    done = Event()
+    state: dict[str, object] = {"abandoned": False}
+
+    def run() -> None:
+        cap = open_capture(index, backend, **kwargs)
+        with lock:
+            if state["abandoned"]:
+                _release(cap)
+                return
+            state["cap"] = cap
+        done.set()
+
+    Thread(target=run, name=f"camera-probe-{index}", daemon=True).start()
+    done.wait(timeout)
+    with lock:
+        if "cap" not in state:
+            state["abandoned"] = True
+            return None
+        return state["cap"]
+
+
+def probe_index(
+    index: int,
+    backends: Sequence[tuple[str, int]],
+    timeout: float,
+    **kwargs,
+) -> Optional[tuple[ProbeResult, cv2.VideoCapture]]:
+    for name, backend in backends:
+        cap = open_with_timeout(index, backend, timeout, **kwargs)
+        if cap is not None:
+            return ProbeResult(index=index, backend=backend, backend_name=name), cap
+    return None
+
+
+def probe_indices(
+    indices: Sequence[int],
+    backends: Sequence[tuple[str, int]],
+    timeout: float,
+    **kwargs,
+) -> dict[int, tuple[ProbeResult, cv2.VideoCapture]]:
+    found: dict[int, tuple[ProbeResult, cv2.VideoCapture]] = {}
+    lock = Lock()
+
+    def run(index: int) -> None:
+        result = probe_index(index, backends, timeout, **kwargs)
+        if result is not None:
+            with lock:
+                found[index] = result
+
+    threads = [Thread(target=run, args=(index,), name=f"camera-scan-{index}", daemon=True) for index in indices]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return found
+
+
+class DiscoveryCache:
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._lock = Lock()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def get(self, key: str) -> Optional[ProbeResult]:
+        with self._lock:
+            entry = self._read().get(key)
+        if not isinstance(entry, dict):
+            return None
+        try:
+            return ProbeResult(
+                index=int(entry["index"]),
+                backend=int(entry["backend"]),
+                backend_name=str(entry.get("backend_name", "")),
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def put(self, key: str, result: ProbeResult) -> None:
+        with self._lock:
+            devices = self._read()
+            devices[key] = asdict(result) | {"updated_at": time.time()}
+            self._write(devices)
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            devices = self._read()
+            if devices.pop(key, None) is not None:
+                self._write(devices)
+
+    def _read(self) -> dict:
+        try:
+            data = json.loads(self._path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        devices = data.get("devices") if isinstance(data, dict) else None
+        return devices if isinstance(devices, dict) else {}
+
+    def _write(self, devices: dict) -> None:
+        tmp = self._path.with_name(self._path.name + ".tmp")
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({"devices": devices}, indent=2), encoding="utf-8")
+            os.replace(tmp, self._path)
+        except OSError:
+            pass
+
+
+def capture_fourcc(cap: cv2.VideoCapture) -> str:
+    code = int(cap.get(cv2.CAP_PROP_FOURCC))
+    return "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00")
+
+
+def _release(cap: Optional[cv2.VideoCapture]) -> None:
+    try:
+        if cap is not None:
+            cap.release()
+    except Exception:
+        pass
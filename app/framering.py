@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+_HEADER = np.dtype([("seq", "<i8"), ("captured_at", "<f8")])
+_ALIGN = 64
+
+
+@dataclass(frozen=True)
+class RingSpec:
+    name: str
+    slots: int
+    shape: tuple[int, ...]
+
+
+class SharedFrameRing:
+    # Fixed-size uint8 frame slots in one shared-memory block, preceded by a
+    # (seq, captured_at) header per slot. There is a single writer per ring; it
+    # stamps the new seq into the header *before* overwriting the pixels, so a
+    # reader that finds the seq unchanged after using a slot knows the frame was
+    # not torn underneath it.
+    def __init__(self, shm: shared_memory.SharedMemory, spec: RingSpec, owner: bool) -> None:
+        self._shm = shm
+        self._spec = spec
+        self._owner = owner
+        header_bytes = spec.slots * _HEADER.itemsize
+        offset = (header_bytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        self._header = np.ndarray((spec.slots,), dtype=_HEADER, buffer=shm.buf)
+        self._frames = np.ndarray((spec.slots, *spec.shape), dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self._next_seq = int(self._header["seq"].max()) + 1
+
+    @staticmethod
+    def _nbytes(slots: int, shape: tuple[int, ...]) -> int:
+        header_bytes = slots * _HEADER.itemsize
+        offset = (header_bytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        return offset + slots * int(np.prod(shape))
+
+    @classmethod
+    def create(cls, slots: int, shape: tuple[int, ...]) -> SharedFrameRing:
+        slots = max(2, int(slots))
+        shape = tuple(int(v) for v in shape)
+        shm = shared_memory.SharedMemory(create=True, size=cls._nbytes(slots, shape))
+        ring = cls(shm, RingSpec(name=shm.name, slots=slots, shape=shape), owner=True)
+        ring._header[:] = (0, 0.0)
+        ring._next_seq = 1
+        return ring
+
+    @classmethod
+    def attach(cls, spec: RingSpec) -> SharedFrameRing:
+        # Readers are started by multiprocessing and share the creator's
+        # resource tracker, so only the creator's unlink removes the block.
+        return cls(shared_memory.SharedMemory(name=spec.name), spec, owner=False)
+
+    @property
+    def spec(self) -> RingSpec:
+        return self._spec
+
+    def view(self, slot: int) -> np.ndarray:
+        return self._frames[slot]
+
+    def seq_at(self, slot: int) -> int:
+        return int(self._header["seq"][slot])
+
+    def valid(self, slot: int, seq: int) -> bool:
+        return self.seq_at(slot) == seq
+
+    def copy(self, slot: int, seq: int) -> Optional[np.ndarray]:
+        # A private copy of the slot, or None if the writer reused it first.
+        if not self.valid(slot, seq):
+            return None
+        frame = self._frames[slot].copy()
+        return frame if self.valid(slot, seq) else None
+
+    def claim(self, captured_at: float) -> tuple[int, int, np.ndarray]:
+        seq = self._next_seq
+        self._next_seq += 1
+        slot = seq % self._spec.slots
+        self._header[slot] = (seq, captured_at)
+        return slot, seq, self._frames[slot]
+
+    def latest(self) -> Optional[tuple[int, int, float]]:
+        seqs = self._header["seq"]
+        slot = int(np.argmax(seqs))
+        seq = int(seqs[slot])
+        if seq <= 0:
+            return None
+        return slot, seq, float(self._header["captured_at"][slot])
+
+    def close(self) -> None:
+        self._header = None
+        self._frames = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Frames handed out as views are still alive; the mapping goes
+            # away with them.
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
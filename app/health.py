@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import time
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+DEFERRED = "deferred"
+
+
+class _Subsystem:
+    __slots__ = ("name", "required", "state", "seconds", "error", "live", "details")
+
+    def __init__(self, name: str, required: bool, live, details) -> None:
+        self.name = name
+        self.required = required
+        self.state = PENDING
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.live: Optional[Callable[[], bool]] = live
+        self.details: Optional[Callable[[], dict]] = details
+
+
+class HealthTracker:
+    # Start-up state of each subsystem and how long its initialization took.
+    # Slow initializations run as background tasks so the app serves (and
+    # answers /healthz) right away; /readyz turns 200 once every required
+    # subsystem is up. `live` lets a subsystem that failed at start-up (a
+    # camera plugged in later) count as ready again.
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._created_at = time.monotonic()
+        self._subsystems: dict[str, _Subsystem] = {}
+
+    def add(
+        self,
+        name: str,
+        *,
+        required: bool = True,
+        state: str = PENDING,
+        live: Optional[Callable[[], bool]] = None,
+        details: Optional[Callable[[], dict]] = None,
+    ) -> None:
+        with self._lock:
+            subsystem = _Subsystem(name, required, live, details)
+            subsystem.state = state
+            self._subsystems[name] = subsystem
+
+    def run(self, name: str, task: Callable[[], object], **kwargs) -> object:
+        # Synchronous: returns the task's result and re-raises its error.
+        self.add(name, **kwargs)
+        return self._run(name, task)
+
+    def start(self, name: str, task: Callable[[], object], **kwargs) -> Thread:
+        # In the background; the task fails by raising or by returning False.
+        self.add(name, **kwargs)
+        thread = Thread(target=self._run_quietly, args=(name, task), name=f"init-{name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _run_quietly(self, name: str, task: Callable[[], object]) -> None:
+        try:
+            self._run(name, task)
+        except Exception:
+            pass
+
+    def _run(self, name: str, task: Callable[[], object]) -> object:
+        with self._lock:
+            subsystem = self._subsystems[name]
+            subsystem.state = STARTING
+        started = time.perf_counter()
+        try:
+            result = task()
+        except Exception as exc:
+            self._finish(subsystem, started, str(exc) or type(exc).__name__)
+            raise
+        self._finish(subsystem, started, "failed" if result is False else None)
+        return result
+
+    def _finish(self, subsystem: _Subsystem, started: float, error: Optional[str]) -> None:
+        with self._lock:
+            subsystem.seconds = time.perf_counter() - started
+            subsystem.state = READY if error is None else FAILED
+            subsystem.error = error
+
+    def report(self) -> dict:
+        with self._lock:
+            subsystems = list(self._subsystems.values())
+        entries, ready = {}, True
+        for subsystem in subsystems:
+            entry = {
+                "state": subsystem.state,
+                "required": subsystem.required,
+                "init_seconds": subsystem.seconds,
+                "error": subsystem.error,
+            }
+            if subsystem.state == FAILED and subsystem.live is not None and subsystem.live():
+                entry["state"] = READY
+            if subsystem.details is not None:
+                entry.update(subsystem.details())
+            if subsystem.required and entry["state"] not in (READY, DEFERRED):
+                ready = False
+            entries[subsystem.name] = entry
+        return {
+            "ready": ready,
+            "uptime_seconds": time.monotonic() - self._created_at,
+            "subsystems": entries,
+        }
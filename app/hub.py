@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import time
+from threading import Condition, Lock
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+
+
+class Frame:
+    # A captured frame. Cameras that deliver JPEG publish the compressed bytes
+    # and pixels are decoded on first use of `image`, so viewers that can be
+    # served the camera's own JPEG never pay for a decode.
+    __slots__ = ("seq", "captured_at", "jpeg", "_image", "_preview", "_lock")
+
+    def __init__(self, seq: int, image: Any, captured_at: float, jpeg: Optional[bytes] = None) -> None:
+        self.seq = seq
+        self.captured_at = captured_at
+        self.jpeg = jpeg
+        self._image = image
+        self._preview: Any = None
+        self._lock = Lock()
+
+    @property
+    def image(self) -> Any:
+        if self._image is None and self.jpeg is not None:
+            with self._lock:
+                if self._image is None:
+                    self._image = cv2.imdecode(np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+    def preview(self) -> Any:
+        # Cheap small greyscale version for analysis (motion): JPEG can be
+        # decoded at 1/8 scale without touching most of the data. Decoded once
+        # per frame, however many viewers ask.
+        if self._preview is None and self._image is None and self.jpeg is not None:
+            with self._lock:
+                if self._preview is None:
+                    self._preview = cv2.imdecode(
+                        np.frombuffer(self.jpeg, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8
+                    )
+        if self._preview is not None:
+            return self._preview
+        return self.image
+
+
+class FrameHub:
+    def __init__(self) -> None:
+        self._cond = Condition()
+        self._seq = 0
+        self._latest: Optional[Frame] = None
+
+    @property
+    def latest(self) -> Optional[Frame]:
+        with self._cond:
+            return self._latest
+
+    def publish(self, image, captured_at: Optional[float] = None, *, jpeg: Optional[bytes] = None) -> Frame:
+        if captured_at is None:
+            captured_at = time.monotonic()
+        with self._cond:
+            self._seq += 1
+            frame = Frame(seq=self._seq, image=image, captured_at=captured_at, jpeg=jpeg)
+            self._latest = frame
+            self._cond.notify_all()
+            return frame
+
+    def wait_next(self, after_seq: int, timeout: Optional[float] = None) -> Optional[Frame]:
+        # Always hands out the newest frame: a slow viewer skips ahead instead of
+        # working through a backlog of stale frames.
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._latest is not None and self._latest.seq > after_seq,
+                timeout,
+            )
+            return self._latest if ready else None
+
+    def reset(self) -> None:
+        with self._cond:
+            self._latest = None
+            self._cond.notify_all()
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Iterator, Sequence
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self._lock = Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._new_child()
+                self._children[key] = child
+            return child
+
+    def remove(self, *values) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self) -> list[tuple[tuple[str, ...], object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in self._items():
+            yield from self._render_child(values, child)
+
+    def _render_child(self, values: tuple[str, ...], child) -> Iterator[str]:
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}{labels} {_format_value(child.value)}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, values: tuple[str, ...], child) -> Iterator[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, values)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._metrics: list[_Metric] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: list[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CAPTURE_SECONDS = REGISTRY.histogram(
+    "camera_capture_seconds", "Time spent in Camera.read per frame.", ["camera"]
+)
+CAPTURE_FRAMES = REGISTRY.counter("camera_frames_total", "Frames read from the device.", ["camera"])
+CAPTURE_FAILURES = REGISTRY.counter("camera_read_failures_total", "Failed device reads.", ["camera"])
+CAPTURE_FPS = REGISTRY.gauge("camera_capture_fps", "Recent capture rate.", ["camera"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds",
+    "Per-frame time spent in each streaming stage.",
+    ["camera", "stage"],
+)
+FACE_DETECT_SECONDS = REGISTRY.histogram(
+    "face_detection_seconds", "Duration of one face-detection forward pass (whole batch)."
+)
+FACE_BATCH_SIZE = REGISTRY.histogram(
+    "face_detection_batch_size", "Frames per face-detection batch.", buckets=BATCH_BUCKETS
+)
+STREAM_VIEWERS = REGISTRY.gauge("stream_active_viewers", "Open /video_feed connections.", ["camera"])
+STREAM_CLIENT_FPS = REGISTRY.gauge(
+    "stream_client_fps", "Frames per second delivered to each viewer.", ["camera", "client"]
+)
+STREAM_FRAMES_SENT = REGISTRY.counter("stream_frames_sent_total", "Frames sent to viewers.", ["camera"])
+STREAM_FRAMES_SKIPPED = REGISTRY.counter(
+    "stream_frames_skipped_total", "Captured frames a viewer skipped to stay current.", ["camera"]
+)
+STREAM_BYTES_SENT = REGISTRY.counter("stream_bytes_sent_total", "Bytes sent to viewers.", ["camera"])
+RECORDER_WRITE_SECONDS = REGISTRY.histogram(
+    "recorder_write_seconds", "Time spent in VideoWriter.write per frame.", ["camera"]
+)
+RECORDER_FRAMES_WRITTEN = REGISTRY.counter(
+    "recorder_frames_written_total", "Frames written to recordings.", ["camera"]
+)
+RECORDER_FRAMES_DROPPED = REGISTRY.counter(
+    "recorder_frames_dropped_total", "Frames the recorder dropped.", ["camera"]
+)
+RECORDER_FRAMES_DUPLICATED = REGISTRY.counter(
+    "recorder_frames_duplicated_total", "Output slots filled by repeating a frame.", ["camera"]
+)
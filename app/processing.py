@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from threading import Condition, Lock, Thread
+from typing import Callable, Mapping, Optional, Sequence
+
+import time
 
 import cv2
 import numpy as np
 
+from .metrics import FACE_BATCH_SIZE, FACE_DETECT_SECONDS, STAGE_SECONDS
+from .state import StateSnapshot
+from .tracing import FrameTrace
+
 
 def ensure_bgr(frame):
     if frame is None:
@@ -15,38 +23,294 @@ def ensure_bgr(frame):
     return frame
 
 
-def mirror(frame):
-    return cv2.flip(frame, 1)
+GREY_MATRIX = np.array([[0.114, 0.587, 0.299, 0.0]] * 3, dtype=np.float32)
+NEGATIVE_MATRIX = np.array(
+    [[-1.0, 0.0, 0.0, 255.0], [0.0, -1.0, 0.0, 255.0], [0.0, 0.0, -1.0, 255.0]],
+    dtype=np.float32,
+)
+
 
+def mirror(frame, out=None):
+    return cv2.flip(frame, 1, dst=out)
 
-def to_grey_bgr(frame):
-    grey = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    return cv2.cvtColor(grey, cv2.COLOR_GRAY2BGR)
 
+def to_grey_bgr(frame, out=None):
+    return cv2.transform(frame, GREY_MATRIX, dst=out)
 
-def negative(frame):
-    return cv2.bitwise_not(frame)
 
+def negative(frame, out=None):
+    return cv2.bitwise_not(frame, dst=out)
 
-def resize_with_padding(frame, target_size: tuple[int, int], pad_color: tuple[int, int, int] = (0, 0, 0)):
+
+def resize_with_padding(
+    frame,
+    target_size: tuple[int, int],
+    pad_color: tuple[int, int, int] = (0, 0, 0),
+    out=None,
+):
     target_w, target_h = target_size
     frame = ensure_bgr(frame)
+    if out is None:
+        canvas = np.empty((target_h, target_w, 3), dtype=np.uint8)
+    else:
+        canvas = out
+    canvas[:] = pad_color
+
     h, w = frame.shape[:2]
     if h == 0 or w == 0:
-        return np.full((target_h, target_w, 3), pad_color, dtype=np.uint8)
+        return canvas
 
     scale = min(target_w / w, target_h / h)
     new_w = max(1, int(w * scale))
     new_h = max(1, int(h * scale))
-    resized = cv2.resize(frame, (new_w, new_h))
-
-    canvas = np.full((target_h, target_w, 3), pad_color, dtype=np.uint8)
     x0 = (target_w - new_w) // 2
     y0 = (target_h - new_h) // 2
-    canvas[y0 : y0 + new_h, x0 : x0 + new_w] = resized
+    cv2.resize(frame, (new_w, new_h), dst=canvas[y0 : y0 + new_h, x0 : x0 + new_w])
     return canvas
 
 
+FilterFunc = Callable[..., "np.ndarray"]
+Box = tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class _Filter:
+    flag: str
+    func: Optional[FilterFunc] = None
+    matrix: Optional[np.ndarray] = None
+
+
+_FILTERS: list[_Filter] = []
+
+
+def register_filter(flag: str, func: Optional[FilterFunc] = None, *, matrix=None) -> None:
+    # `func(frame, out=None)` may write into `out`; a 3x3/3x4 colour `matrix`
+    # lets consecutive colour filters collapse into one cv2.transform pass.
+    if (func is None) == (matrix is None):
+        raise ValueError("register_filter needs exactly one of func or matrix")
+    if matrix is not None:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape == (3, 3):
+            matrix = np.hstack([matrix, np.zeros((3, 1), dtype=np.float32)])
+        if matrix.shape != (3, 4):
+            raise ValueError("Colour matrix must be 3x3 or 3x4")
+    _FILTERS.append(_Filter(flag=flag, func=func, matrix=matrix))
+
+
+def registered_flags() -> tuple[str, ...]:
+    return tuple(f.flag for f in _FILTERS)
+
+
+register_filter("grey_on", matrix=GREY_MATRIX)
+register_filter("negative_on", matrix=NEGATIVE_MATRIX)
+
+
+def _compose(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    a = np.vstack([first, [0.0, 0.0, 0.0, 1.0]])
+    b = np.vstack([second, [0.0, 0.0, 0.0, 1.0]])
+    return (b @ a)[:3].astype(np.float32)
+
+
+def _colour_step(matrix: np.ndarray) -> FilterFunc:
+    if np.array_equal(matrix, NEGATIVE_MATRIX):
+        return negative
+    return lambda frame, out=None: cv2.transform(frame, matrix, dst=out)
+
+
+def compile_filters(flags: Mapping[str, bool]) -> list[FilterFunc]:
+    steps: list[FilterFunc] = []
+    pending: Optional[np.ndarray] = None
+    for f in _FILTERS:
+        if not flags.get(f.flag):
+            continue
+        if f.matrix is not None:
+            pending = f.matrix if pending is None else _compose(pending, f.matrix)
+            continue
+        if pending is not None:
+            steps.append(_colour_step(pending))
+            pending = None
+        steps.append(f.func)
+    if pending is not None:
+        steps.append(_colour_step(pending))
+    return steps
+
+
+class FramePipeline:
+    def __init__(self, output_size: tuple[int, int], name: str = "default", *, mirror: bool = True) -> None:
+        w, h = output_size
+        self._output_size = (w, h)
+        self._mirror = mirror
+        self.lock = Lock()
+        self._plan_key: Optional[tuple[bool, ...]] = None
+        self._plan_snapshot: Optional[StateSnapshot] = None
+        self._steps: list[FilterFunc] = []
+        self._buffers = (
+            np.empty((h, w, 3), dtype=np.uint8),
+            np.empty((h, w, 3), dtype=np.uint8),
+        )
+        self._resize_seconds = STAGE_SECONDS.labels(name, "resize")
+        self._face_seconds = STAGE_SECONDS.labels(name, "face")
+        self._filter_seconds = STAGE_SECONDS.labels(name, "filter")
+
+    @property
+    def output_size(self) -> tuple[int, int]:
+        return self._output_size
+
+    @property
+    def mirrors(self) -> bool:
+        return self._mirror
+
+    def _plan(self, flags: Mapping[str, bool]) -> list[FilterFunc]:
+        # Snapshots are immutable, so seeing the same one again means nothing
+        # changed and the flags need not be re-read.
+        if flags is self._plan_snapshot:
+            return self._steps
+        self._plan_snapshot = flags if isinstance(flags, StateSnapshot) else None
+        key = tuple(bool(flags.get(flag)) for flag in registered_flags())
+        if key != self._plan_key:
+            self._steps = compile_filters(flags)
+            self._plan_key = key
+        return self._steps
+
+    # Callers hold `lock` while using the returned arrays: they are reused
+    # buffers that the next frame overwrites.
+    def process(self, frame, flags: Mapping[str, bool], face_detector=None, trace: Optional[FrameTrace] = None):
+        steps = self._plan(flags)
+        front, back = self._buffers
+        started = time.perf_counter()
+        frame = ensure_bgr(frame)
+        cv2.resize(frame, self._output_size, dst=front)
+        ended = time.perf_counter()
+        self._resize_seconds.observe(ended - started)
+        if trace is not None:
+            trace.add("resize", started, ended)
+
+        if flags.get("face_only_on") and face_detector is not None:
+            started = time.perf_counter()
+            try:
+                face = face_detector.crop_face(front)
+            except Exception:
+                face = front
+            if face is not front:
+                resize_with_padding(face, self._output_size, out=back)
+                front, back = back, front
+            ended = time.perf_counter()
+            self._face_seconds.observe(ended - started)
+            if trace is not None:
+                trace.add("crop_face", started, ended)
+
+        if steps:
+            started = time.perf_counter()
+            for step in steps:
+                result = step(front, out=back)
+                if result is not back:
+                    np.copyto(back, result)
+                front, back = back, front
+            ended = time.perf_counter()
+            self._filter_seconds.observe(ended - started)
+            if trace is not None:
+                trace.add("filters", started, ended, steps=len(steps))
+        return front
+
+    def display(self, processed, overlay: Optional[str] = None, out=None):
+        # A fresh array (or caller-owned `out`): encoded variants of this frame
+        # are produced from it after the pipeline lock has been released.
+        if self._mirror:
+            display = mirror(processed, out=out)
+            if overlay:
+                cv2.putText(display, overlay, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
+            return display
+        if out is None:
+            display = processed.copy()
+        else:
+            display = out
+            np.copyto(display, processed)
+        if overlay:
+            # The page mirrors the picture; draw the text mirrored so it reads
+            # the right way round there.
+            band = display[:40]
+            flipped = cv2.flip(band, 1)
+            cv2.putText(flipped, overlay, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 255), 2)
+            cv2.flip(flipped, 1, dst=band)
+        return display
+
+
+class MotionDetector:
+    # Cheap change detection on a tiny greyscale copy of each frame, compared
+    # against a slowly adapting background. While the scene is static,
+    # `changed_seq` stays at the last frame that changed, so callers can keep
+    # serving what they produced for that frame.
+    def __init__(
+        self,
+        size: tuple[int, int] = (64, 48),
+        pixel_threshold: int = 15,
+        min_changed_fraction: float = 0.002,
+        adapt_rate: float = 0.05,
+        name: str = "default",
+        stage: str = "motion",
+    ) -> None:
+        self._size = size
+        self._pixel_threshold = float(pixel_threshold)
+        self._min_changed_fraction = max(0.0, float(min_changed_fraction))
+        self._adapt_rate = min(1.0, max(0.0, float(adapt_rate)))
+        self._lock = Lock()
+        self._background: Optional[np.ndarray] = None
+        self._seq: Optional[int] = None
+        self._moving = True
+        self._changed_seq = 0
+        self._changed_fraction = 1.0
+        self._last_motion_at = time.monotonic()
+        self._seconds = STAGE_SECONDS.labels(name, stage)
+
+    @property
+    def moving(self) -> bool:
+        with self._lock:
+            return self._moving
+
+    @property
+    def changed_seq(self) -> int:
+        with self._lock:
+            return self._changed_seq
+
+    @property
+    def changed_fraction(self) -> float:
+        with self._lock:
+            return self._changed_fraction
+
+    @property
+    def last_motion_at(self) -> float:
+        with self._lock:
+            return self._last_motion_at
+
+    def update(self, seq: int, frame) -> bool:
+        with self._lock:
+            if seq == self._seq:
+                return self._moving
+            started = time.perf_counter()
+            # A bilinear step to 2x the target, then an area step: nearly as
+            # noise-robust as one INTER_AREA pass at a fraction of the cost.
+            w, h = self._size
+            small = cv2.resize(frame, (w * 2, h * 2), interpolation=cv2.INTER_LINEAR)
+            if small.ndim == 3:
+                small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            small = cv2.resize(small, self._size, interpolation=cv2.INTER_AREA).astype(np.float32)
+            if self._background is None or self._background.shape != small.shape:
+                self._background = small
+                fraction = 1.0
+            else:
+                diff = cv2.absdiff(small, self._background)
+                fraction = float(np.count_nonzero(diff > self._pixel_threshold)) / diff.size
+                cv2.accumulateWeighted(small, self._background, self._adapt_rate)
+            self._seq = seq
+            self._changed_fraction = fraction
+            self._moving = fraction >= self._min_changed_fraction
+            if self._moving:
+                self._changed_seq = seq
+                self._last_motion_at = time.monotonic()
+            self._seconds.observe(time.perf_counter() - started)
+            return self._moving
+
+
 def placeholder_frame(size: tuple[int, int], text: str):
     w, h = size
     frame = np.zeros((h, w, 3), dtype=np.uint8)
@@ -54,46 +318,360 @@ def placeholder_frame(size: tuple[int, int], text: str):
     return frame
 
 
+DNN_BACKENDS = {
+    "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+    "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+    "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+    "cuda": cv2.dnn.DNN_BACKEND_CUDA,
+}
+DNN_TARGETS = {
+    "cpu": cv2.dnn.DNN_TARGET_CPU,
+    "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+    "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+    "cuda": cv2.dnn.DNN_TARGET_CUDA,
+    "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16,
+}
+
+
+def parse_input_size(value: str, default: tuple[int, int] = (300, 300)) -> tuple[int, int]:
+    # "300" or "320x240".
+    value = value.strip().lower()
+    if not value:
+        return default
+    w, _, h = value.partition("x")
+    size = (int(w), int(h or w))
+    if size[0] <= 0 or size[1] <= 0:
+        raise ValueError(f"Invalid input size: {value}")
+    return size
+
+
 class FaceDetector:
-    def __init__(self, prototxt_path: Path, model_path: Path, min_confidence: float = 0.5) -> None:
+    # res10 SSD, from the Caffe files or an ONNX export of the same network.
+    def __init__(
+        self,
+        prototxt_path: Optional[Path],
+        model_path: Path,
+        min_confidence: float = 0.5,
+        *,
+        input_size: tuple[int, int] = (300, 300),
+        backend: str = "default",
+        target: str = "cpu",
+    ) -> None:
         self._prototxt_path = prototxt_path
         self._model_path = model_path
         self._min_confidence = min_confidence
+        self._input_size = (int(input_size[0]), int(input_size[1]))
+        self._backend = DNN_BACKENDS[backend]
+        self._target = DNN_TARGETS[target]
         self._net: Optional[cv2.dnn_Net] = None
+        self._load_seconds: Optional[float] = None
+        self._error: Optional[str] = None
+        self._lock = Lock()
+
+    @property
+    def input_size(self) -> tuple[int, int]:
+        return self._input_size
+
+    @property
+    def ready(self) -> bool:
+        return self._net is not None
+
+    @property
+    def load_seconds(self) -> Optional[float]:
+        return self._load_seconds
+
+    @property
+    def error(self) -> Optional[str]:
+        return self._error
+
+    def _create(self) -> cv2.dnn_Net:
+        # readNet picks the importer from the file extension (Caffe or ONNX).
+        config = str(self._prototxt_path) if self._model_path.suffix.lower() != ".onnx" else ""
+        net = cv2.dnn.readNet(str(self._model_path), config)
+        net.setPreferableBackend(self._backend)
+        net.setPreferableTarget(self._target)
+        return net
+
+    def _prime(self, net, blank: np.ndarray) -> None:
+        net.setInput(cv2.dnn.blobFromImage(blank, 1.0, self._input_size))
+        net.forward()
 
-    def _load(self) -> cv2.dnn_Net:
+    def _load(self):
+        # Subclasses only differ in `_create` and `_prime`.
         if self._net is None:
-            self._net = cv2.dnn.readNetFromCaffe(str(self._prototxt_path), str(self._model_path))
+            started = time.perf_counter()
+            try:
+                net = self._create()
+                # The first forward pass allocates buffers and picks kernels;
+                # pay for it here rather than on the first real frame.
+                w, h = self._input_size
+                self._prime(net, np.zeros((h, w, 3), dtype=np.uint8))
+            except Exception as exc:
+                self._error = str(exc)
+                raise
+            self._net = net
+            self._error = None
+            self._load_seconds = time.perf_counter() - started
         return self._net
 
-    def crop_face(self, frame):
-        net = self._load()
-        (h, w) = frame.shape[:2]
-        blob = cv2.dnn.blobFromImage(
-            cv2.resize(frame, (300, 300)),
+    def warm_up(self) -> bool:
+        try:
+            with self._lock:
+                self._load()
+        except Exception:
+            return False
+        return True
+
+    def detect(self, frame) -> Optional[Box]:
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames: Sequence) -> list[Optional[Box]]:
+        if not frames:
+            return []
+        with self._lock:
+            net = self._load()
+        blob = cv2.dnn.blobFromImages(
+            [cv2.resize(frame, self._input_size) for frame in frames],
             1.0,
-            (300, 300),
+            self._input_size,
             (104.0, 177.0, 123.0),
         )
-        net.setInput(blob)
-        detections = net.forward()
-
-        if detections.shape[2] == 0:
-            return frame
-
-        i = int(np.argmax(detections[0, 0, :, 2]))
-        confidence = float(detections[0, 0, i, 2])
-        if confidence < self._min_confidence:
-            return frame
-
-        box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-        start_x, start_y, end_x, end_y = box.astype("int")
-        start_x = max(0, start_x)
-        start_y = max(0, start_y)
-        end_x = min(w, end_x)
-        end_y = min(h, end_y)
-        roi = frame[start_y:end_y, start_x:end_x]
-        if roi.size == 0:
-            return frame
-        return roi
+        started = time.perf_counter()
+        with self._lock:
+            net.setInput(blob)
+            detections = net.forward()
+        FACE_DETECT_SECONDS.observe(time.perf_counter() - started)
+        FACE_BATCH_SIZE.observe(len(frames))
+
+        # Rows are (image_id, label, confidence, x0, y0, x1, y1) for the whole batch.
+        rows = detections.reshape(-1, 7)
+        boxes: list[Optional[Box]] = []
+        for image_id, frame in enumerate(frames):
+            mine = rows[rows[:, 0] == image_id]
+            if mine.shape[0] == 0:
+                boxes.append(None)
+                continue
+            i = int(np.argmax(mine[:, 2]))
+            if float(mine[i, 2]) < self._min_confidence:
+                boxes.append(None)
+                continue
+            (h, w) = frame.shape[:2]
+            box = mine[i, 3:7] * np.array([w, h, w, h])
+            start_x, start_y, end_x, end_y = (int(v) for v in box)
+            boxes.append((max(0, start_x), max(0, start_y), min(w, end_x), min(h, end_y)))
+        return boxes
+
+    def crop_face(self, frame):
+        return crop_box(frame, self.detect(frame))
+
+
+class YuNetFaceDetector(FaceDetector):
+    # OpenCV's YuNet ONNX model (fp32 or the int8-quantized export) through
+    # cv2.FaceDetectorYN. Same interface as FaceDetector; YuNet has no batch
+    # input, so a batch is run frame by frame.
+    def _create(self):
+        return cv2.FaceDetectorYN.create(
+            str(self._model_path),
+            "",
+            self._input_size,
+            self._min_confidence,
+            0.3,
+            50,
+            self._backend,
+            self._target,
+        )
+
+    def _prime(self, net, blank: np.ndarray) -> None:
+        net.detect(blank)
+
+    def detect_batch(self, frames: Sequence) -> list[Optional[Box]]:
+        if not frames:
+            return []
+        boxes: list[Optional[Box]] = []
+        started = time.perf_counter()
+        with self._lock:
+            net = self._load()
+            for frame in frames:
+                h, w = frame.shape[:2]
+                sx, sy = w / self._input_size[0], h / self._input_size[1]
+                _, faces = net.detect(cv2.resize(frame, self._input_size))
+                if faces is None or len(faces) == 0:
+                    boxes.append(None)
+                    continue
+                # Rows are (x, y, w, h, 5 landmarks, score).
+                x, y, bw, bh = faces[int(np.argmax(faces[:, -1])), :4]
+                boxes.append(
+                    (
+                        max(0, int(x * sx)),
+                        max(0, int(y * sy)),
+                        min(w, int((x + bw) * sx)),
+                        min(h, int((y + bh) * sy)),
+                    )
+                )
+        FACE_DETECT_SECONDS.observe(time.perf_counter() - started)
+        FACE_BATCH_SIZE.observe(len(frames))
+        return boxes
+
+
+def create_face_detector(
+    model_path: Path,
+    prototxt_path: Optional[Path] = None,
+    min_confidence: float = 0.5,
+    *,
+    input_size: tuple[int, int] = (300, 300),
+    backend: str = "default",
+    target: str = "cpu",
+) -> FaceDetector:
+    # YuNet models are recognised by name (face_detection_yunet_*.onnx, with
+    # or without the _int8 suffix); anything else is treated as res10 SSD.
+    model_path = Path(model_path)
+    cls = YuNetFaceDetector if "yunet" in model_path.name.lower() else FaceDetector
+    return cls(
+        prototxt_path,
+        model_path,
+        min_confidence,
+        input_size=input_size,
+        backend=backend,
+        target=target,
+    )
+
+
+def crop_box(frame, box: Optional[Box]):
+    if box is None:
+        return frame
+    h, w = frame.shape[:2]
+    start_x, start_y, end_x, end_y = box
+    roi = frame[max(0, start_y) : min(h, end_y), max(0, start_x) : min(w, end_x)]
+    if roi.size == 0:
+        return frame
+    return roi
+
+
+class FaceDetectionService:
+    def __init__(
+        self,
+        detector: FaceDetector,
+        *,
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+    ) -> None:
+        self._detector = detector
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait = max(0.0, float(max_wait))
+        self._cond = Condition()
+        self._pending: dict[object, tuple[object, Callable[[Optional[Box]], None]]] = {}
+        self._thread: Optional[Thread] = None
+
+    @property
+    def detector(self) -> FaceDetector:
+        return self._detector
+
+    def submit(self, source: object, frame, callback: Callable[[Optional[Box]], None]) -> None:
+        with self._cond:
+            # One slot per source: a newer frame replaces one still waiting.
+            self._pending[source] = (frame, callback)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="face-detection", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _take_batch(self) -> list[tuple[object, Callable[[Optional[Box]], None]]]:
+        with self._cond:
+            self._cond.wait_for(lambda: bool(self._pending))
+            deadline = time.monotonic() + self._max_wait
+            while len(self._pending) < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            for source in list(self._pending)[: self._max_batch_size]:
+                batch.append(self._pending.pop(source))
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            try:
+                boxes = self._detector.detect_batch([frame for frame, _ in batch])
+            except Exception:
+                boxes = [None] * len(batch)
+            for (_, callback), box in zip(batch, boxes):
+                try:
+                    callback(box)
+                except Exception:
+                    pass
+
+
+class FaceTracker:
+    def __init__(
+        self,
+        service: FaceDetectionService,
+        *,
+        every_n_frames: int = 5,
+        max_detections_per_second: float = 0.0,
+        smoothing: float = 0.35,
+        max_box_age: float = 1.5,
+        motion: Optional[MotionDetector] = None,
+    ) -> None:
+        self._service = service
+        # Detection is skipped while `motion` sees a static scene: the box
+        # found once the scene settled stays valid until something moves.
+        self._motion = motion
+        self._frames_seen = 0
+        self._settled = False
+        self._every_n_frames = max(1, int(every_n_frames))
+        self._min_interval = 1.0 / max_detections_per_second if max_detections_per_second > 0 else 0.0
+        self._smoothing = min(1.0, max(0.01, float(smoothing)))
+        self._max_box_age = max(0.1, float(max_box_age))
+        self._lock = Lock()
+        self._frames_since_submit = self._every_n_frames
+        self._last_submit_at = 0.0
+        self._target: Optional[Box] = None
+        self._target_at = 0.0
+        self._box: Optional[np.ndarray] = None
+
+    def crop_face(self, frame):
+        self._maybe_submit(frame)
+        return crop_box(frame, self._advance())
+
+    def _maybe_submit(self, frame) -> None:
+        self._frames_since_submit += 1
+        self._frames_seen += 1
+        now = time.monotonic()
+        static = self._motion is not None and not self._motion.update(self._frames_seen, frame)
+        if static and self._settled:
+            with self._lock:
+                if self._target is not None:
+                    self._target_at = now
+            return
+        if self._frames_since_submit < self._every_n_frames:
+            return
+        if (now - self._last_submit_at) < self._min_interval:
+            return
+        # One more detection once the scene has come to rest.
+        self._settled = static
+        self._frames_since_submit = 0
+        self._last_submit_at = now
+        self._service.submit(self, frame.copy(), self._on_detection)
+
+    def _on_detection(self, box: Optional[Box]) -> None:
+        if box is None:
+            return
+        with self._lock:
+            self._target = box
+            self._target_at = time.monotonic()
 
+    def _advance(self) -> Optional[Box]:
+        with self._lock:
+            target = self._target
+            target_at = self._target_at
+        if target is None or (time.monotonic() - target_at) > self._max_box_age:
+            self._box = None
+            return None
+        goal = np.asarray(target, dtype=np.float32)
+        if self._box is None:
+            self._box = goal
+        else:
+            self._box += (goal - self._box) * self._smoothing
+        return tuple(int(round(v)) for v in self._box)
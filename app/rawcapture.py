@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import datetime as _dt
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Event, Lock, Thread, current_thread
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .hub import FrameHub
+
+# One entry per frame: where its pixels start in the .raw file, when it was
+# captured and its shape. Unused (preallocated) entries have height 0.
+RAW_INDEX = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("captured_at", "<f8"),
+        ("height", "<u4"),
+        ("width", "<u4"),
+        ("channels", "<u4"),
+        ("reserved", "<u4"),
+    ]
+)
+
+_FORMATS = {"avi": "XVID", "mp4": "mp4v"}
+
+
+def index_path(raw_path: Path) -> Path:
+    return Path(raw_path).with_suffix(".idx")
+
+
+@dataclass(frozen=True)
+class RawStats:
+    frames_written: int = 0
+    frames_skipped: int = 0
+    frames_dropped: int = 0
+    bytes_written: int = 0
+
+
+class RawRecorder:
+    # Lossless capture of camera frames: a thread follows the camera hub and
+    # copies every frame into a preallocated memory-mapped file, so the only
+    # per-frame cost is a memcpy. Compression happens later, in `transcode`.
+    def __init__(
+        self,
+        output_dir: Path,
+        *,
+        max_bytes: int = 2 * 1024**3,
+        max_frames: int = 100_000,
+        name_prefix: str = "raw",
+        transcode_format: str = "",
+        keep_raw: bool = True,
+    ) -> None:
+        transcode_format = transcode_format.lower().lstrip(".")
+        if transcode_format and transcode_format not in _FORMATS:
+            raise ValueError(f"Unsupported transcode format: {transcode_format}")
+        self._output_dir = output_dir
+        self._max_bytes = max(1, int(max_bytes))
+        self._max_frames = max(1, int(max_frames))
+        self._name_prefix = name_prefix
+        self._transcode_format = transcode_format
+        self._keep_raw = keep_raw
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        self._stop_event = Event()
+        self._path: Optional[Path] = None
+        self._written = 0
+        self._skipped = 0
+        self._dropped = 0
+        self._bytes = 0
+        self._error: Optional[str] = None
+        self.last_output: Optional[Path] = None
+
+    @property
+    def is_recording(self) -> bool:
+        with self._lock:
+            return self._thread is not None
+
+    @property
+    def error(self) -> Optional[str]:
+        # Why the last capture failed to start, if it did.
+        with self._lock:
+            return self._error
+
+    @property
+    def stats(self) -> RawStats:
+        with self._lock:
+            return RawStats(self._written, self._skipped, self._dropped, self._bytes)
+
+    def start(self, hub: FrameHub) -> Path:
+        # Only cheap checks happen here; reserving the file (which can take a
+        # while for gigabytes) is done by the recording thread, and a failure
+        # there is reported through `error`.
+        with self._lock:
+            if self._thread is not None:
+                raise RuntimeError("Raw recorder already started")
+            self._error = None
+            try:
+                self._output_dir.mkdir(parents=True, exist_ok=True)
+                free = shutil.disk_usage(self._output_dir).free
+                if free < self._max_bytes:
+                    raise OSError(
+                        f"Not enough disk space in {self._output_dir}: "
+                        f"{free // 1024**2} MB free, {self._max_bytes // 1024**2} MB needed"
+                    )
+            except OSError as exc:
+                self._error = str(exc)
+                raise
+            now = _dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            path = self._output_dir / f"{self._name_prefix}_{now}.raw"
+            stop_event = Event()
+            self._written = self._skipped = self._dropped = self._bytes = 0
+            self._path = path
+            self._stop_event = stop_event
+            self._thread = Thread(
+                target=self._run,
+                args=(hub, path, stop_event),
+                name="raw-recorder",
+                daemon=True,
+            )
+            self._thread.start()
+            return path
+
+    def stop(self) -> Optional[Path]:
+        with self._lock:
+            thread, path = self._thread, self._path
+            self._stop_event.set()
+        if thread is None:
+            return None
+        thread.join(timeout=5.0)
+        # A thread still flushing keeps the recorder busy (is_recording) until
+        # it has trimmed its file; it clears itself when done.
+        with self._lock:
+            if self._thread is thread and not thread.is_alive():
+                self._thread = None
+        if self._transcode_format and path is not None:
+            # The file is only complete once the thread has trimmed it; a slow
+            # flush is waited for by the transcode thread, not by the caller.
+            Thread(target=self._transcode, args=(path, thread), name="raw-transcode", daemon=True).start()
+        return path
+
+    def _allocate(self, path: Path) -> tuple[np.memmap, np.memmap]:
+        with open(path, "wb") as f:
+            # Reserve the blocks up front where the OS allows it, so frames
+            # never wait on the filesystem growing the file.
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(f.fileno(), 0, self._max_bytes)
+            else:
+                f.truncate(self._max_bytes)
+        data = np.memmap(path, dtype=np.uint8, mode="r+", shape=(self._max_bytes,))
+        index = np.memmap(index_path(path), dtype=RAW_INDEX, mode="w+", shape=(self._max_frames,))
+        return data, index
+
+    def _run(self, hub: FrameHub, path: Path, stop_event: Event) -> None:
+        try:
+            data, index = self._allocate(path)
+        except OSError as exc:
+            path.unlink(missing_ok=True)
+            index_path(path).unlink(missing_ok=True)
+            self._finished(f"Raw capture failed: {exc}")
+            return
+        offset = 0
+        count = 0
+        last_seq = hub.latest.seq if hub.latest is not None else 0
+        error = None
+        try:
+            while not stop_event.is_set():
+                frame = hub.wait_next(last_seq, timeout=0.2)
+                if frame is None:
+                    continue
+                skipped = frame.seq - last_seq - 1 if last_seq else 0
+                last_seq = frame.seq
+                if frame.image is None:
+                    # A camera JPEG that failed to decode.
+                    with self._lock:
+                        self._dropped += 1
+                    continue
+                image = np.ascontiguousarray(frame.image)
+                nbytes = image.nbytes
+                if count >= self._max_frames or offset + nbytes > self._max_bytes:
+                    with self._lock:
+                        self._dropped += 1
+                    continue
+                data[offset : offset + nbytes] = image.reshape(-1)
+                h, w = image.shape[:2]
+                channels = image.shape[2] if image.ndim == 3 else 1
+                index[count] = (offset, frame.captured_at, h, w, channels, 0)
+                offset += nbytes
+                count += 1
+                with self._lock:
+                    self._written += 1
+                    self._skipped += max(0, skipped)
+                    self._bytes = offset
+        except Exception as exc:
+            error = f"Raw capture stopped: {exc}"
+        finally:
+            data.flush()
+            index.flush()
+            del data, index
+            # Give back the unused part of the preallocation.
+            os.truncate(path, offset)
+            os.truncate(index_path(path), count * RAW_INDEX.itemsize)
+            self._finished(error)
+
+    def _finished(self, error: Optional[str]) -> None:
+        with self._lock:
+            if error is not None:
+                self._error = error
+            if self._thread is current_thread():
+                self._thread = None
+
+    def _transcode(self, path: Path, recorder: Thread) -> None:
+        recorder.join()
+        if not path.exists():
+            return
+        try:
+            output = transcode(path, path.with_suffix(f".{self._transcode_format}"))
+        except Exception:
+            return
+        self.last_output = output
+        if not self._keep_raw:
+            path.unlink(missing_ok=True)
+            index_path(path).unlink(missing_ok=True)
+
+
+class RawVideo:
+    # Read-only, zero-copy access to a raw capture.
+    def __init__(self, path: Path) -> None:
+        self._path = Path(path)
+        index = np.fromfile(index_path(self._path), dtype=RAW_INDEX)
+        self._index = index[index["height"] > 0]
+        size = self._path.stat().st_size
+        self._data = np.memmap(self._path, dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._index["captured_at"]
+
+    @property
+    def fps(self) -> float:
+        ts = self.timestamps
+        if len(ts) < 2 or ts[-1] <= ts[0]:
+            return 0.0
+        return float((len(ts) - 1) / (ts[-1] - ts[0]))
+
+    def frame(self, i: int) -> np.ndarray:
+        entry = self._index[i]
+        h, w, c = int(entry["height"]), int(entry["width"]), int(entry["channels"])
+        start = int(entry["offset"])
+        pixels = self._data[start : start + h * w * c]
+        return pixels.reshape((h, w, c) if c > 1 else (h, w))
+
+
+def transcode(
+    raw_path: Path,
+    output_path: Optional[Path] = None,
+    *,
+    fourcc: Optional[str] = None,
+    fps: Optional[float] = None,
+) -> Path:
+    raw_path = Path(raw_path)
+    output_path = Path(output_path) if output_path is not None else raw_path.with_suffix(".avi")
+    fourcc = fourcc or _FORMATS.get(output_path.suffix.lstrip(".").lower(), "XVID")
+    video = RawVideo(raw_path)
+    if not len(video):
+        raise ValueError(f"{raw_path}: no frames")
+    first = video.frame(0)
+    size = (first.shape[1], first.shape[0])
+    writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*fourcc), fps or video.fps or 20.0, size)
+    if not writer.isOpened():
+        raise RuntimeError(f"Failed to open VideoWriter for {output_path}")
+    try:
+        for i in range(len(video)):
+            frame = video.frame(i)
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            if frame.shape[1::-1] != size:
+                frame = cv2.resize(frame, size)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return output_path
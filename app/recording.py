@@ -1,88 +1,441 @@
 from __future__ import annotations
 
 import datetime as _dt
+import glob
+import queue
+import re
 import time
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
 from threading import Event, Lock, Thread
 from typing import Optional
 
 import cv2
+import numpy as np
+
+from .metrics import (
+    RECORDER_FRAMES_DROPPED,
+    RECORDER_FRAMES_DUPLICATED,
+    RECORDER_FRAMES_WRITTEN,
+    RECORDER_WRITE_SECONDS,
+)
+from .tracing import FrameTrace
+
+
+@dataclass(frozen=True)
+class RecorderStats:
+    frames_written: int = 0
+    frames_dropped: int = 0
+    frames_duplicated: int = 0
+
+
+class _FramePacer:
+    # Maps timestamped input frames onto fixed 1/fps output slots: the newest
+    # frame in a slot wins, extra frames are dropped and empty slots repeat the
+    # previous frame, so the output length follows the capture clock.
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._origin: Optional[float] = None
+        self._slot = 0
+        self._current = None
+        self._last = None
+        self.dropped = 0
+        self.duplicated = 0
+
+    def push(self, captured_at: float, frame) -> list:
+        if self._origin is None:
+            self._origin = captured_at
+        out = self.close_until(captured_at)
+        if captured_at < self._origin + self._slot * self._interval:
+            self.dropped += 1
+            return out
+        if self._current is not None:
+            self.dropped += 1
+        self._current = frame
+        return out
+
+    def close_until(self, now: float) -> list:
+        out = []
+        if self._origin is None:
+            return out
+        while self._origin + (self._slot + 1) * self._interval <= now:
+            frame = self._current
+            if frame is None:
+                frame = self._last
+                if frame is not None:
+                    self.duplicated += 1
+            if frame is not None:
+                out.append(frame)
+                self._last = frame
+            self._current = None
+            self._slot += 1
+        return out
+
+    def reset(self) -> list:
+        # End of a run of frames: emit the pending one and forget the clock so
+        # the gap before the next frame is not filled with duplicates.
+        out = [self._current] if self._current is not None else []
+        self._origin = None
+        self._slot = 0
+        self._current = None
+        self._last = None
+        return out
+
+
+class PreEventBuffer:
+    def __init__(self, seconds: float, max_bytes: int = 32 * 1024 * 1024, jpeg_quality: int = 80) -> None:
+        self._seconds = max(0.0, float(seconds))
+        self._max_bytes = max(1, int(max_bytes))
+        self._jpeg_quality = int(jpeg_quality)
+        self._lock = Lock()
+        self._frames: deque[tuple[float, bytes]] = deque()
+        self._bytes = 0
+        self._pending: queue.Queue = queue.Queue(maxsize=4)
+        self._thread: Optional[Thread] = None
+
+    @property
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def offer(self, captured_at: float, frame) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="video-prebuffer", daemon=True)
+                self._thread.start()
+        try:
+            self._pending.put_nowait((captured_at, frame))
+        except queue.Full:
+            pass
+
+    def drain(self) -> list[tuple[float, bytes]]:
+        with self._lock:
+            frames = list(self._frames)
+            self._frames.clear()
+            self._bytes = 0
+            return frames
+
+    def _run(self) -> None:
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self._jpeg_quality]
+        while True:
+            captured_at, frame = self._pending.get()
+            ok, buffer = cv2.imencode(".jpg", frame, params)
+            if not ok:
+                continue
+            data = buffer.tobytes()
+            with self._lock:
+                self._frames.append((captured_at, data))
+                self._bytes += len(data)
+                oldest_allowed = captured_at - self._seconds
+                while self._frames and (
+                    self._frames[0][0] < oldest_allowed or self._bytes > self._max_bytes
+                ):
+                    _, dropped = self._frames.popleft()
+                    self._bytes -= len(dropped)
+
+
+def prune_segments(
+    directory: Path,
+    prefix: str,
+    *,
+    max_age_seconds: float = 0.0,
+    max_total_bytes: int = 0,
+    keep: Optional[Path] = None,
+) -> list[Path]:
+    # Only <prefix>_<timestamp>.avi as named by VideoRecorder: other cameras
+    # share the directory and their prefix may start with this one.
+    name = re.compile(re.escape(prefix) + r"_\d{8}_\d{6}_\d{6}\.avi")
+    entries = []
+    for path in directory.glob(f"{glob.escape(prefix)}_*.avi"):
+        if not name.fullmatch(path.name) or (keep is not None and path == keep):
+            continue
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+
+    removed = []
+    now = time.time()
+    total = sum(size for _, size, _ in entries)
+    if keep is not None:
+        try:
+            total += keep.stat().st_size
+        except OSError:
+            pass
+    for mtime, size, path in entries:
+        too_old = max_age_seconds > 0 and (now - mtime) > max_age_seconds
+        over_budget = max_total_bytes > 0 and total > max_total_bytes
+        if not (too_old or over_budget):
+            continue
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+    return removed
 
 
 class VideoRecorder:
-    def __init__(self, output_dir: Path, fps: float = 20.0, fourcc: str = "XVID") -> None:
+    def __init__(
+        self,
+        output_dir: Path,
+        fps: float = 20.0,
+        fourcc: str = "XVID",
+        name_prefix: str = "vid",
+        queue_size: int = 64,
+        latency_slack: float = 0.25,
+        prebuffer: Optional[PreEventBuffer] = None,
+        segment_seconds: float = 0.0,
+        segments_dir: Optional[Path] = None,
+        retention_seconds: float = 0.0,
+        max_disk_bytes: int = 0,
+        motion_only: bool = False,
+        motion_tail_seconds: float = 5.0,
+        name: str = "default",
+    ) -> None:
         self._output_dir = output_dir
+        self._motion_only = motion_only
+        self._motion_tail = max(0.0, float(motion_tail_seconds))
+        self._last_motion_at = 0.0
+        self._prebuffer = prebuffer
+        self._segment_seconds = max(0.0, float(segment_seconds))
+        self._segments_dir = segments_dir if segments_dir is not None else output_dir / "recordings"
+        self._retention_seconds = max(0.0, float(retention_seconds))
+        self._max_disk_bytes = max(0, int(max_disk_bytes))
+        self._name_prefix = name_prefix
         self._fps = fps
         self._fourcc = fourcc
+        self._queue_size = max(1, int(queue_size))
+        self._latency_slack = max(0.0, float(latency_slack))
         self._lock = Lock()
         self._stop_event = Event()
         self._thread: Optional[Thread] = None
-        self._writer: Optional[cv2.VideoWriter] = None
-        self._latest_frame = None
+        self._frames: Optional[queue.Queue] = None
+        self._stop_at: Optional[float] = None
         self._is_recording = False
+        self._written = 0
+        self._dropped = 0
+        self._duplicated = 0
+        self._write_seconds = RECORDER_WRITE_SECONDS.labels(name)
+        self._written_total = RECORDER_FRAMES_WRITTEN.labels(name)
+        self._dropped_total = RECORDER_FRAMES_DROPPED.labels(name)
+        self._duplicated_total = RECORDER_FRAMES_DUPLICATED.labels(name)
 
     @property
     def is_recording(self) -> bool:
         with self._lock:
             return self._is_recording
 
-    def update_frame(self, frame) -> None:
+    @property
+    def accepts_frames(self) -> bool:
+        with self._lock:
+            return self._is_recording or self._prebuffer is not None
+
+    @property
+    def stats(self) -> RecorderStats:
         with self._lock:
-            self._latest_frame = frame
+            return RecorderStats(
+                frames_written=self._written,
+                frames_dropped=self._dropped,
+                frames_duplicated=self._duplicated,
+            )
+
+    def submit(
+        self,
+        frame,
+        captured_at: Optional[float] = None,
+        motion: Optional[bool] = None,
+        trace: Optional[FrameTrace] = None,
+    ) -> bool:
+        if captured_at is None:
+            captured_at = time.monotonic()
+        with self._lock:
+            frames = self._frames if self._is_recording else None
+            if motion:
+                self._last_motion_at = max(self._last_motion_at, captured_at)
+            gated = frames is not None and self._gated_locked(captured_at)
+        if gated:
+            return False
+        if frames is None:
+            if self._prebuffer is not None:
+                self._prebuffer.offer(captured_at, frame)
+            return False
+        try:
+            frames.put_nowait((captured_at, frame, trace))
+            return True
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            self._dropped_total.inc()
+            return False
+
+    def _gated_locked(self, now: float) -> bool:
+        # Motion-only recording: nothing is written once the post-motion tail
+        # has run out.
+        return self._motion_only and now - self._last_motion_at > self._motion_tail
 
     def start(self, frame_size: tuple[int, int]) -> Path:
         with self._lock:
             if self._is_recording:
                 raise RuntimeError("Recorder already started")
 
-            now = _dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            path = self._output_dir / f"vid_{now}.avi"
-
-            fourcc = cv2.VideoWriter_fourcc(*self._fourcc)
-            writer = cv2.VideoWriter(str(path), fourcc, self._fps, frame_size)
-            if not writer.isOpened():
-                raise RuntimeError("Failed to open VideoWriter")
+            path, writer = self._open_writer(frame_size)
+            preroll = self._prebuffer.drain() if self._prebuffer is not None else []
 
-            self._writer = writer
-            self._stop_event.clear()
+            frames: queue.Queue = queue.Queue(maxsize=self._queue_size)
+            stop_event = Event()
+            self._frames = frames
+            self._stop_event = stop_event
+            self._stop_at = None
+            self._written = 0
+            self._dropped = 0
+            self._duplicated = 0
+            self._last_motion_at = time.monotonic()
             self._is_recording = True
-            self._thread = Thread(target=self._run, name="video-recorder", daemon=True)
+            self._thread = Thread(
+                target=self._run,
+                args=(path, writer, frame_size, frames, stop_event, preroll),
+                name="video-recorder",
+                daemon=True,
+            )
             self._thread.start()
             return path
 
+    def _open_writer(self, frame_size: tuple[int, int]) -> tuple[Path, cv2.VideoWriter]:
+        now = _dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        if self._segment_seconds > 0:
+            self._segments_dir.mkdir(parents=True, exist_ok=True)
+            path = self._segments_dir / f"{self._name_prefix}_{now}.avi"
+        else:
+            path = self._output_dir / f"{self._name_prefix}_{now}.avi"
+
+        fourcc = cv2.VideoWriter_fourcc(*self._fourcc)
+        writer = cv2.VideoWriter(str(path), fourcc, self._fps, frame_size)
+        if not writer.isOpened():
+            raise RuntimeError("Failed to open VideoWriter")
+        return path, writer
+
     def stop(self) -> None:
         thread = None
         with self._lock:
             if not self._is_recording:
                 return
             self._is_recording = False
+            self._stop_at = time.monotonic()
             self._stop_event.set()
             thread = self._thread
+            self._thread = None
+            self._frames = None
 
         if thread is not None:
-            thread.join(timeout=2.0)
+            thread.join(timeout=5.0)
 
-        with self._lock:
-            try:
-                if self._writer is not None:
-                    self._writer.release()
-            finally:
-                self._writer = None
-                self._thread = None
-                self._latest_frame = None
-
-    def _run(self) -> None:
+    def _run(
+        self,
+        path: Path,
+        writer,
+        frame_size: tuple[int, int],
+        frames: queue.Queue,
+        stop_event: Event,
+        preroll: list[tuple[float, bytes]],
+    ) -> None:
         interval = 1.0 / self._fps if self._fps > 0 else 0.05
-        while not self._stop_event.is_set():
-            writer = None
-            frame = None
-            with self._lock:
-                writer = self._writer
-                frame = self._latest_frame
-            if writer is not None and frame is not None:
+        pacer = _FramePacer(interval)
+        segment = _Segment(path, writer)
+        try:
+            for captured_at, data in preroll:
+                frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None and frame.shape[1::-1] == tuple(frame_size):
+                    self._write(segment, frame_size, pacer, pacer.push(captured_at, (frame, None)))
+
+            while True:
                 try:
-                    writer.write(frame)
-                except Exception:
-                    pass
-            time.sleep(interval)
+                    captured_at, frame, trace = frames.get(timeout=interval)
+                except queue.Empty:
+                    if stop_event.is_set():
+                        break
+                    now = time.monotonic() - self._latency_slack
+                    with self._lock:
+                        gated = self._gated_locked(now)
+                    if gated:
+                        self._write(segment, frame_size, pacer, pacer.reset())
+                        continue
+                    # Frames arrive after processing, so leave late ones a
+                    # little time before their slot is closed.
+                    self._write(segment, frame_size, pacer, pacer.close_until(now))
+                    continue
+                self._write(segment, frame_size, pacer, pacer.push(captured_at, (frame, trace)))
+
+            with self._lock:
+                stop_at = self._stop_at
+            if stop_at is not None:
+                self._write(segment, frame_size, pacer, pacer.close_until(stop_at))
+        finally:
+            if segment.writer is not None:
+                segment.writer.release()
+
+    def _write(self, segment: _Segment, frame_size: tuple[int, int], pacer: _FramePacer, frames: list) -> None:
+        written = lost = 0
+        frames_per_segment = int(round(self._segment_seconds * self._fps))
+        # Paced entries are (frame, trace) pairs.
+        for frame, trace in frames:
+            if segment.writer is None or (frames_per_segment > 0 and segment.frames >= frames_per_segment):
+                if not self._roll(segment, frame_size):
+                    lost += 1
+                    continue
+            started = time.perf_counter()
+            try:
+                segment.writer.write(frame)
+                segment.frames += 1
+                written += 1
+            except Exception:
+                pass
+            ended = time.perf_counter()
+            self._write_seconds.observe(ended - started)
+            if trace is not None:
+                trace.add("recorder_write", started, ended)
+        with self._lock:
+            new_duplicates = pacer.duplicated - self._duplicated
+            self._written += written
+            self._duplicated = pacer.duplicated
+            self._dropped += pacer.dropped + lost
+        if written:
+            self._written_total.inc(written)
+        if pacer.dropped + lost:
+            self._dropped_total.inc(pacer.dropped + lost)
+        if new_duplicates > 0:
+            self._duplicated_total.inc(new_duplicates)
+        pacer.dropped = 0
+
+    def _roll(self, segment: _Segment, frame_size: tuple[int, int]) -> bool:
+        if segment.writer is not None:
+            segment.writer.release()
+            segment.writer = None
+        segment.frames = 0
+        try:
+            segment.path, segment.writer = self._open_writer(frame_size)
+        except Exception:
+            # Frames are dropped and the next one tries again.
+            return False
+        if self._retention_seconds > 0 or self._max_disk_bytes > 0:
+            prune_segments(
+                self._segments_dir,
+                self._name_prefix,
+                max_age_seconds=self._retention_seconds,
+                max_total_bytes=self._max_disk_bytes,
+                keep=segment.path,
+            )
+        return True
+
+
+class _Segment:
+    __slots__ = ("path", "writer", "frames")
 
+    def __init__(self, path: Path, writer) -> None:
+        self.path = path
+        self.writer = writer
+        self.frames = 0
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Iterator, Mapping, Optional
+
+from .camera import Camera
+from .processing import FaceTracker, FramePipeline, MotionDetector
+from .rawcapture import RawRecorder
+from .recording import VideoRecorder
+from .snapshots import SnapshotWriter
+from .state import AppState
+from .streaming import FrameCache, RenditionLadder
+from .tracing import FrameTracer
+
+DEFAULT_CAMERA_ID = "default"
+
+_FALSEY = {"0", "false", "no", "off"}
+
+
+def env_flag(environ: Mapping[str, str], name: str, default: str) -> bool:
+    return environ.get(name, default).strip().lower() not in _FALSEY
+
+
+@dataclass(frozen=True)
+class CameraSpec:
+    cam_id: str
+    device_index: int = 0
+    width: int = 640
+    height: int = 480
+    auto_detect: bool = False
+    max_index: int = 5
+    source: str = ""
+
+
+@dataclass
+class CameraContext:
+    cam_id: str
+    camera: Camera
+    state: AppState
+    recorder: VideoRecorder
+    snapshots: SnapshotWriter
+    face_tracker: FaceTracker
+    pipeline: FramePipeline
+    render_cache: FrameCache
+    frame_cache: FrameCache
+    renditions: RenditionLadder
+    continuous_recording: bool = False
+    encoder: Optional[Any] = None
+    motion: Optional[MotionDetector] = None
+    raw_recorder: Optional[RawRecorder] = None
+    tracer: Optional[FrameTracer] = None
+    # Runs on its own thread while the stream is on and hands captured frames
+    # to the recorder and snapshots, so they do not depend on a viewer.
+    follower: Optional[Callable[["CameraContext", Event], None]] = None
+    _follower_lock: Lock = field(default_factory=Lock, init=False, repr=False)
+    _follower_thread: Optional[Thread] = field(default=None, init=False, repr=False)
+    _follower_stop: Optional[Event] = field(default=None, init=False, repr=False)
+
+    @property
+    def records_unattended(self) -> bool:
+        # Continuous recording and the pre-event buffer need frames from start-up.
+        return self.continuous_recording or self.recorder.accepts_frames
+
+    def start_stream(self) -> None:
+        self.camera.start_capture()
+        self._start_follower()
+        if self.continuous_recording and not self.recorder.is_recording:
+            cfg = self.camera.config
+            try:
+                self.recorder.start((cfg.width, cfg.height))
+            except Exception:
+                pass
+
+    def _start_follower(self) -> None:
+        if self.follower is None:
+            return
+        with self._follower_lock:
+            if self._follower_thread is not None and self._follower_thread.is_alive():
+                return
+            stop_event = Event()
+            self._follower_stop = stop_event
+            self._follower_thread = Thread(
+                target=self.follower,
+                args=(self, stop_event),
+                name=f"frame-follower-{self.cam_id}",
+                daemon=True,
+            )
+            self._follower_thread.start()
+
+    def _stop_follower(self) -> None:
+        with self._follower_lock:
+            thread, stop_event = self._follower_thread, self._follower_stop
+            self._follower_thread = self._follower_stop = None
+        if stop_event is not None:
+            stop_event.set()
+        if thread is not None:
+            thread.join(timeout=2.0)
+
+    def shutdown(self) -> None:
+        self._stop_follower()
+        self.recorder.stop()
+        if self.raw_recorder is not None:
+            self.raw_recorder.stop()
+        self.snapshots.shutdown()
+        self.renditions.shutdown()
+        self.camera.stop_capture()
+        self.camera.release()
+
+
+class CameraRegistry:
+    def __init__(self) -> None:
+        self._contexts: dict[str, CameraContext] = {}
+
+    def add(self, context: CameraContext) -> None:
+        if context.cam_id in self._contexts:
+            raise ValueError(f"Duplicate camera id: {context.cam_id}")
+        self._contexts[context.cam_id] = context
+
+    def get(self, cam_id: Optional[str] = None) -> CameraContext:
+        if cam_id is None:
+            cam_id = self.default_id
+        return self._contexts[cam_id]
+
+    @property
+    def default_id(self) -> str:
+        return next(iter(self._contexts))
+
+    def ids(self) -> list[str]:
+        return list(self._contexts)
+
+    def __iter__(self) -> Iterator[CameraContext]:
+        return iter(list(self._contexts.values()))
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    def shutdown(self) -> None:
+        for context in self:
+            context.shutdown()
+
+
+def load_camera_specs(environ: Mapping[str, str] = os.environ) -> list[CameraSpec]:
+    width = int(environ.get("CAMERA_WIDTH", "640"))
+    height = int(environ.get("CAMERA_HEIGHT", "480"))
+    max_index = int(environ.get("CAMERA_MAX_INDEX", "5"))
+
+    config_path = environ.get("CAMERA_CONFIG", "").strip()
+    if config_path:
+        return _specs_from_file(Path(config_path), width, height, max_index)
+
+    # CAMERAS="front=0,back=2" runs one capture worker per listed device;
+    # a non-numeric value is a frame source, e.g. "sim=synthetic:1280x720@30".
+    cameras = environ.get("CAMERAS", "").strip()
+    if cameras:
+        specs = []
+        for item in cameras.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            cam_id, sep, index = item.partition("=")
+            if not sep:
+                cam_id, index = item, item
+            index = index.strip()
+            specs.append(
+                CameraSpec(
+                    cam_id=cam_id.strip(),
+                    device_index=int(index) if index.isdigit() else 0,
+                    width=width,
+                    height=height,
+                    max_index=max_index,
+                    source="" if index.isdigit() else index,
+                )
+            )
+        _check_unique(specs)
+        return specs
+
+    return [
+        CameraSpec(
+            cam_id=DEFAULT_CAMERA_ID,
+            device_index=int(environ.get("CAMERA_INDEX", "0")),
+            width=width,
+            height=height,
+            auto_detect=env_flag(environ, "CAMERA_AUTO_DETECT", "1"),
+            max_index=max_index,
+            source=environ.get("CAMERA_SOURCE", "").strip(),
+        )
+    ]
+
+
+def _specs_from_file(path: Path, width: int, height: int, max_index: int) -> list[CameraSpec]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        data = data.get("cameras", [])
+    if not isinstance(data, list) or not data:
+        raise ValueError(f"{path}: expected a non-empty list of cameras")
+
+    specs = []
+    for i, entry in enumerate(data):
+        specs.append(
+            CameraSpec(
+                cam_id=str(entry.get("id", i)),
+                device_index=int(entry.get("index", i)),
+                width=int(entry.get("width", width)),
+                height=int(entry.get("height", height)),
+                auto_detect=bool(entry.get("auto_detect", False)),
+                max_index=int(entry.get("max_index", max_index)),
+                source=str(entry.get("source", "")),
+            )
+        )
+    _check_unique(specs)
+    return specs
+
+
+def _check_unique(specs: list[CameraSpec]) -> None:
+    seen = set()
+    for spec in specs:
+        if not spec.cam_id:
+            raise ValueError("Camera id must not be empty")
+        if spec.cam_id in seen:
+            raise ValueError(f"Duplicate camera id: {spec.cam_id}")
+        seen.add(spec.cam_id)
@@ -1,47 +1,102 @@
 from __future__ import annotations
 
-import datetime as _dt
+import itertools
+import json
 import time
-from pathlib import Path
+from functools import lru_cache
+from typing import Optional
 
 import cv2
-from flask import Blueprint, Response, current_app, redirect, render_template, request, url_for
-
-from .processing import (
-    mirror,
-    negative,
-    placeholder_frame,
-    resize_with_padding,
-    to_grey_bgr,
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    url_for,
 )
 
-bp = Blueprint("main", __name__)
+from .metrics import (
+    REGISTRY,
+    STAGE_SECONDS,
+    STREAM_BYTES_SENT,
+    STREAM_CLIENT_FPS,
+    STREAM_FRAMES_SENT,
+    STREAM_FRAMES_SKIPPED,
+    STREAM_VIEWERS,
+)
+from .processing import placeholder_frame
+from .state import FLAGS, StaleStateError, StateSnapshot
+from .streaming import ClientStream, scaled_size
+from .tracing import FrameTrace
 
+bp = Blueprint("main", __name__)
 
-@bp.get("/")
-def index():
-    state = current_app.extensions["state"]
-    recorder = current_app.extensions["recorder"]
-    view_state = state.snapshot() | {"recording_on": recorder.is_recording}
-    return render_template("index.html", state=view_state)
+_client_ids = itertools.count(1)
+
+# While the scene is static the same encoded frame is re-sent only this often,
+# to keep proxies and the browser from treating the stream as stalled.
+STATIC_RESEND_SECONDS = 1.0
+
+# Idle state-event streams send a comment this often so proxies keep them open.
+STATE_KEEPALIVE_SECONDS = 15.0
+
+
+def _camera_context(cam_id):
+    registry = current_app.extensions["cameras"]
+    try:
+        return registry.get(cam_id)
+    except KeyError:
+        abort(404)
+
+
+def _index_url(context) -> str:
+    if context.cam_id == current_app.extensions["cameras"].default_id:
+        return url_for("main.index")
+    return url_for("main.index", cam_id=context.cam_id)
+
+
+@bp.get("/", defaults={"cam_id": None})
+@bp.get("/camera/<cam_id>")
+def index(cam_id):
+    context = _camera_context(cam_id)
+    view_state = context.state.snapshot().to_dict() | {
+        "recording_on": context.recorder.is_recording,
+        "raw_on": context.raw_recorder is not None and context.raw_recorder.is_recording,
+        "raw_error": context.raw_recorder.error if context.raw_recorder is not None else None,
+        "mirror_on_client": not context.pipeline.mirrors,
+    }
+    return render_template(
+        "index.html",
+        state=view_state,
+        snapshot_jobs=context.snapshots.recent(),
+        burst_frames=current_app.config["BURST_FRAMES"],
+        cam_id=context.cam_id,
+        camera_ids=current_app.extensions["cameras"].ids(),
+        tile_stream=current_app.config.get("TILE_STREAM", False),
+        transport=request.args.get("transport", ""),
+    )
 
 
-@bp.post("/actions")
-def actions():
-    state = current_app.extensions["state"]
-    camera = current_app.extensions["camera"]
-    recorder = current_app.extensions["recorder"]
+@bp.post("/actions", defaults={"cam_id": None})
+@bp.post("/actions/<cam_id>")
+def actions(cam_id):
+    context = _camera_context(cam_id)
+    state = context.state
+    camera = context.camera
+    recorder = context.recorder
 
     if "stop" in request.form:
-        stream_on = state.toggle_stream()
-        if stream_on:
-            camera.open()
-        else:
-            recorder.stop()
-            camera.release()
+        _apply_state(context, toggle=("stream_on",))
 
     if "click" in request.form:
-        state.request_capture()
+        _request_snapshots(context, 1)
+
+    if "burst" in request.form:
+        _request_snapshots(context, current_app.config["BURST_FRAMES"])
 
     if "grey" in request.form:
         state.toggle_grey()
@@ -53,109 +108,429 @@ def actions():
         state.toggle_face_only()
 
     if "rec" in request.form:
-        if not state.snapshot()["stream_on"]:
-            state.toggle_stream()
-            camera.open()
+        _apply_state(context, {"stream_on": True})
         if recorder.is_recording:
             recorder.stop()
         else:
-            camera.open()
+            camera.start_capture()
             cfg = camera.config
             try:
                 recorder.start((cfg.width, cfg.height))
             except Exception:
                 pass
 
-    return redirect(url_for("main.index"))
+    if "raw" in request.form and context.raw_recorder is not None:
+        raw_recorder = context.raw_recorder
+        if raw_recorder.is_recording:
+            raw_recorder.stop()
+        else:
+            _apply_state(context, {"stream_on": True})
+            context.start_stream()
+            try:
+                raw_recorder.start(camera.hub)
+            except OSError as exc:
+                return Response(str(exc), status=507, mimetype="text/plain")
+
+    return redirect(_index_url(context))
+
+
+def _apply_state(context, values=None, toggle=(), expected_version=None) -> StateSnapshot:
+    before, after = context.state.apply(values, toggle, expected_version)
+    if after.stream_on and not before.stream_on:
+        context.start_stream()
+    elif before.stream_on and not after.stream_on:
+        context.recorder.stop()
+        if context.raw_recorder is not None:
+            context.raw_recorder.stop()
+        context.camera.stop_capture()
+        context.camera.release()
+    return after
+
+
+def _request_snapshots(context, count: int):
+    # Frames come from the capture thread, so the camera has to be running;
+    # a paused stream has none to give.
+    job = context.snapshots.request(count)
+    if context.state.snapshot().stream_on:
+        context.start_stream()
+    else:
+        context.snapshots.cancel(job, "Stream is paused")
+    return job
+
+
+@bp.get("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+@bp.get("/healthz")
+def healthz():
+    # Liveness: answers as soon as the app serves, with each subsystem's
+    # start-up state.
+    return jsonify(current_app.extensions["health"].report())
+
+
+@bp.get("/readyz")
+def readyz():
+    report = current_app.extensions["health"].report()
+    return jsonify(report), 200 if report["ready"] else 503
+
+
+@bp.get("/debug/traces")
+def traces():
+    # Sampled frames (TRACE_SAMPLE_EVERY) in Chrome trace-event format, for
+    # chrome://tracing or ui.perfetto.dev.
+    registry = current_app.extensions["cameras"]
+    events = []
+    for pid, cam_id in enumerate(registry.ids(), start=1):
+        tracer = registry.get(cam_id).tracer
+        if tracer is not None:
+            events.extend(tracer.chrome_events(pid))
+    return Response(
+        json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}),
+        mimetype="application/json",
+        headers={"Content-Disposition": "attachment; filename=frame-traces.json"},
+    )
 
 
-@bp.get("/video_feed")
-def video_feed():
-    camera = current_app.extensions["camera"]
-    state = current_app.extensions["state"]
-    face_detector = current_app.extensions["face_detector"]
-    recorder = current_app.extensions["recorder"]
+@bp.post("/api/cameras/<cam_id>/snapshots")
+def create_snapshot(cam_id):
+    context = _camera_context(cam_id)
+    payload = request.get_json(silent=True) or request.form
+    try:
+        count = int(payload.get("count", 1))
+    except (TypeError, ValueError):
+        abort(400)
+    if count < 1:
+        abort(400)
+    job = _request_snapshots(context, count)
+    url = url_for("main.snapshot_status", cam_id=context.cam_id, job_id=job.job_id)
+    return jsonify(job.to_dict() | {"url": url}), 202, {"Location": url}
+
+
+@bp.get("/api/cameras/<cam_id>/snapshots/<job_id>")
+def snapshot_status(cam_id, job_id):
+    context = _camera_context(cam_id)
+    job = context.snapshots.job(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@bp.get("/api/state", defaults={"cam_id": None})
+@bp.get("/api/cameras/<cam_id>/state")
+def get_state(cam_id):
+    context = _camera_context(cam_id)
+    return jsonify(context.state.snapshot().to_dict())
+
+
+@bp.route("/api/state", methods=["POST", "PATCH"], defaults={"cam_id": None})
+@bp.route("/api/cameras/<cam_id>/state", methods=["POST", "PATCH"])
+def update_state(cam_id):
+    # {"grey_on": true, "toggle": ["negative_on"]}: flags to set and flags to
+    # flip, applied as one change. An optional "version" (as returned by GET)
+    # makes it conditional: 409 with the current state if it has moved on.
+    context = _camera_context(cam_id)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        abort(400)
+    values = {flag: on for flag, on in payload.items() if flag not in ("toggle", "version")}
+    toggle = payload.get("toggle", [])
+    if isinstance(toggle, str):
+        toggle = [toggle]
+    version = payload.get("version")
+    if (
+        not isinstance(toggle, list)
+        or not all(isinstance(flag, str) for flag in toggle)
+        or not set(values).union(toggle) <= set(FLAGS)
+        or not all(isinstance(on, bool) for on in values.values())
+        or (version is not None and (isinstance(version, bool) or not isinstance(version, int)))
+    ):
+        abort(400)
+    try:
+        snapshot = _apply_state(context, values, toggle, version)
+    except StaleStateError as exc:
+        return jsonify(exc.current.to_dict()), 409
+    return jsonify(snapshot.to_dict())
+
+
+@bp.get("/api/state/events", defaults={"cam_id": None})
+@bp.get("/api/cameras/<cam_id>/state/events")
+def state_events(cam_id):
+    context = _camera_context(cam_id)
+
+    def generate():
+        # The first event is the current state, so a (re)connecting page
+        # always catches up.
+        version = -1
+        while True:
+            snapshot = context.state.wait_changed(version, STATE_KEEPALIVE_SECONDS)
+            if snapshot is None:
+                yield ": keepalive\n\n"
+                continue
+            version = snapshot.version
+            yield f"id: {version}\nevent: state\ndata: {json.dumps(snapshot.to_dict())}\n\n"
 
-    cfg = camera.config
-    target_size = (cfg.width, cfg.height)
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@bp.get("/video_feed", defaults={"cam_id": None})
+@bp.get("/video_feed/<cam_id>")
+def video_feed(cam_id):
+    context = _camera_context(cam_id)
+    client = client_stream(context, request.args)
+    if context.state.snapshot().stream_on:
+        context.start_stream()
 
     return Response(
-        _generate_mjpeg(camera, state, face_detector, recorder, target_size),
+        _generate_mjpeg(context, client),
         mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 
-def _generate_mjpeg(camera, state, face_detector, recorder, target_size: tuple[int, int]):
-    target_w, target_h = target_size
-    shots_dir = Path("shots")
-    shots_dir.mkdir(parents=True, exist_ok=True)
+def client_stream(context, args) -> ClientStream:
+    full_size = context.pipeline.output_size
+    try:
+        quality = int(args["quality"]) if "quality" in args else None
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError("quality")
+        size = _parse_size(args.get("size"), full_size, context.renditions)
+        max_fps = float(args["fps"]) if "fps" in args else 0.0
+        if not 0 <= max_fps < float("inf"):
+            raise ValueError("fps")
+    except ValueError:
+        abort(400)
+    return ClientStream(
+        full_size,
+        quality=quality,
+        size=size,
+        max_fps=max_fps,
+        sizes=context.renditions.sizes,
+    )
 
-    while True:
-        s = state.snapshot()
-        if not s["stream_on"]:
-            frame = placeholder_frame(target_size, "Stream paused")
-            yield _encode_mjpeg_frame(frame)
-            time.sleep(0.1)
-            continue
 
-        ok, frame = camera.read()
-        if not ok or frame is None:
-            frame = placeholder_frame(target_size, "Camera not available")
-            yield _encode_mjpeg_frame(frame)
-            time.sleep(0.1)
-            continue
+def _parse_size(value, full_size: tuple[int, int], renditions):
+    # A rendition name ("half"), "640x360" for an exact size, or "0.5" for a
+    # fraction of the camera size. Never larger than the camera frame.
+    if not value:
+        return None
+    rendition = renditions.get(value)
+    if rendition is not None:
+        return rendition.size
+    if "x" in value:
+        w, h = (int(v) for v in value.lower().split("x", 1))
+        if not (0 < w <= full_size[0] and 0 < h <= full_size[1]):
+            raise ValueError("size")
+        return (w, h)
+    scale = float(value)
+    if not 0 < scale <= 1:
+        raise ValueError("size")
+    return scaled_size(full_size, scale)
+
+
+def _generate_mjpeg(context, client: ClientStream):
+    camera = context.camera
+    state = context.state
+    recorder = context.recorder
+    cam_id = context.cam_id
+    client_id = next(_client_ids)
+    viewers = STREAM_VIEWERS.labels(cam_id)
+    client_fps = STREAM_CLIENT_FPS.labels(cam_id, client_id)
+    frames_sent = STREAM_FRAMES_SENT.labels(cam_id)
+    frames_skipped = STREAM_FRAMES_SKIPPED.labels(cam_id)
+    bytes_sent = STREAM_BYTES_SENT.labels(cam_id)
+    send_seconds = STAGE_SECONDS.labels(cam_id, "send")
+    last_seq = 0
+    last_chunk, last_sent_at = None, 0.0
+    viewers.inc()
+
+    try:
+        while True:
+            s = state.snapshot()
+            if not s.stream_on:
+                yield placeholder_chunk(client.size, client.quality, "Stream paused")
+                time.sleep(0.1)
+                continue
+
+            delay = client.pacing_delay()
+            if delay > 0:
+                time.sleep(delay)
+
+            captured = camera.hub.wait_next(last_seq, timeout=1.0)
+            if captured is None:
+                yield placeholder_chunk(client.size, client.quality, "Camera not available")
+                continue
+            seq_gap = captured.seq - last_seq if last_seq else 1
+            client.frame_captured(seq_gap, captured.captured_at)
+            if seq_gap > 1:
+                frames_skipped.inc(seq_gap - 1)
+            last_seq = captured.seq
+
+            chunk = stream_chunk(context, captured, s, recorder.is_recording, client.size, client.quality)
+            if chunk is last_chunk and time.monotonic() - last_sent_at < STATIC_RESEND_SECONDS:
+                # Unchanged scene: the viewer already shows this frame.
+                continue
+            last_chunk, last_sent_at = chunk, time.monotonic()
+
+            sent_at = time.monotonic()
+            yield chunk
+            elapsed = time.monotonic() - sent_at
+            send_seconds.observe(elapsed)
+            trace = frame_trace(context, captured)
+            if trace is not None:
+                ended = time.perf_counter()
+                trace.add("yield", ended - elapsed, ended, client=client_id, bytes=len(chunk))
+            client.frame_sent(len(chunk), elapsed)
+            client_fps.set(client.fps)
+            frames_sent.inc()
+            bytes_sent.inc(len(chunk))
+    finally:
+        viewers.dec()
+        STREAM_CLIENT_FPS.remove(cam_id, client_id)
+
+
+def stream_chunk(context, captured, s, recording: bool, size: tuple[int, int], quality: int) -> bytes:
+    # Rendered once per (frame, state) and encoded once per variant, however
+    # many viewers (threaded or asyncio) ask for it.
+    key = render_key(context, captured, s, recording)
+    context.renditions.watch(size, quality)
+    if _can_pass_through(context, captured, s, size):
+        return context.frame_cache.get_or_create(key + ("camera",), lambda: mjpeg_part(captured.jpeg))
+    return context.frame_cache.get_or_create(
+        key + (size, quality),
+        lambda: _encode_variant(
+            context,
+            render_display(context, captured, s, recording, key),
+            size,
+            quality,
+            frame_trace(context, captured),
+        ),
+    )
 
-        try:
-            frame = cv2.resize(frame, (target_w, target_h))
-        except Exception:
-            frame = placeholder_frame(target_size, "Resize failed")
 
-        if s["face_only_on"]:
-            try:
-                face = face_detector.crop_face(frame)
-                frame = resize_with_padding(face, target_size)
-            except Exception:
-                frame = resize_with_padding(frame, target_size)
+def frame_trace(context, captured) -> Optional[FrameTrace]:
+    return context.tracer.trace(captured) if context.tracer is not None else None
 
-        if s["grey_on"]:
-            frame = to_grey_bgr(frame)
 
-        if s["negative_on"]:
-            frame = negative(frame)
+def render_key(context, captured, s, recording: bool) -> tuple:
+    render_seq = captured.seq
+    motion = context.motion
+    if motion is not None and not motion.update(captured.seq, captured.preview()):
+        # Static scene: keep serving what was produced for the last frame that
+        # changed. A snapshot still wants fresh frames.
+        if not context.snapshots.wants_frames:
+            render_seq = motion.changed_seq
+    return (render_seq, s.version, recording)
 
-        if state.consume_capture_request():
-            now = _dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            path = shots_dir / f"shot_{now}.png"
-            try:
-                cv2.imwrite(str(path), frame)
-            except Exception:
-                pass
 
-        if recorder.is_recording:
-            recorder.update_frame(frame)
-
-        display = frame.copy()
-        if recorder.is_recording:
-            cv2.putText(
-                display,
-                "Recording...",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                1.0,
-                (0, 0, 255),
-                2,
+def render_display(context, captured, s, recording: bool, key: tuple):
+    def render():
+        display = _render_frame(context, captured, s, recording)
+        trace = frame_trace(context, captured)
+        # Every variant someone is watching is encoded in parallel right away;
+        # viewers then find theirs in the frame cache.
+        context.renditions.prefetch(
+            lambda sz, q: context.frame_cache.get_or_create(
+                key + (sz, q),
+                lambda: _encode_variant(context, display, sz, q, trace),
             )
+        )
+        return display
+
+    return context.render_cache.get_or_create(key, render)
+
+
+def follow_frames(context, stop_event) -> None:
+    # Feeds the recorder (and its pre-event buffer) and pending snapshots
+    # every captured frame, watched or not. Rendering goes through the render
+    # cache, so a frame a viewer already rendered is not processed again.
+    hub = context.camera.hub
+    last_seq = 0
+    while not stop_event.is_set():
+        captured = hub.wait_next(last_seq, timeout=0.2)
+        if captured is None:
+            continue
+        last_seq = captured.seq
+        if not (context.recorder.accepts_frames or context.snapshots.wants_frames):
+            continue
+        s = context.state.snapshot()
+        if not s.stream_on:
+            continue
+        recording = context.recorder.is_recording
+        render_display(context, captured, s, recording, render_key(context, captured, s, recording))
+
+
+def _can_pass_through(context, captured, s, size) -> bool:
+    # A plain full-size view is exactly the camera's own JPEG (mirroring is
+    # left to the page), so it is forwarded without decoding. Filters, an
+    # overlay, snapshots or recording need pixels and take the render path.
+    if captured.jpeg is None or context.pipeline.mirrors:
+        return False
+    if tuple(size) != context.pipeline.output_size:
+        return False
+    if any(on for flag, on in s.items() if flag != "stream_on"):
+        return False
+    return not (context.recorder.accepts_frames or context.snapshots.wants_frames)
+
+
+def _render_frame(context, captured, s, recording):
+    pipeline = context.pipeline
+    recorder = context.recorder
+    trace = frame_trace(context, captured)
+    with pipeline.lock:
+        try:
+            started = time.perf_counter()
+            image = captured.image
+            if trace is not None and captured.jpeg is not None:
+                trace.add("decode", started, time.perf_counter())
+            processed = pipeline.process(image, s, context.face_tracker, trace)
+        except Exception:
+            return placeholder_frame(pipeline.output_size, "Processing failed")
+
+        if context.snapshots.wants_frames:
+            context.snapshots.offer(processed)
+
+        if recorder.accepts_frames:
+            moving = context.motion.moving if context.motion is not None else None
+            recorder.submit(processed.copy(), captured.captured_at, motion=moving, trace=trace)
+
+        target = context.encoder.target() if context.encoder is not None else None
+        return pipeline.display(processed, overlay="Recording..." if recording else None, out=target)
 
-        display = mirror(display)
-        yield _encode_mjpeg_frame(display)
-        time.sleep(0.01)
 
+def _encode_variant(context, display, size: tuple[int, int], quality: int, trace=None) -> bytes:
+    started = time.perf_counter()
+    chunk = context.encoder.encode(display, size, quality) if context.encoder is not None else None
+    if chunk is None:
+        if display.shape[1::-1] != tuple(size):
+            display = cv2.resize(display, size, interpolation=cv2.INTER_AREA)
+        chunk = encode_mjpeg_frame(display, quality)
+    ended = time.perf_counter()
+    STAGE_SECONDS.labels(context.cam_id, "encode").observe(ended - started)
+    if trace is not None:
+        trace.add("encode", started, ended, size=f"{size[0]}x{size[1]}", quality=quality, bytes=len(chunk))
+    return chunk
 
-def _encode_mjpeg_frame(frame):
-    ret, buffer = cv2.imencode(".jpg", frame)
+
+def encode_mjpeg_frame(frame, quality: Optional[int] = None):
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)] if quality is not None else []
+    ret, buffer = cv2.imencode(".jpg", frame, params)
     if not ret:
         return b""
-    jpg = buffer.tobytes()
+    return mjpeg_part(buffer.tobytes())
+
+
+@lru_cache(maxsize=32)
+def placeholder_chunk(size: tuple[int, int], quality: int, text: str) -> bytes:
+    # Sent several times a second to every waiting viewer; encoded once.
+    return encode_mjpeg_frame(placeholder_frame(size, text), quality)
+
+
+def mjpeg_part(jpg: bytes) -> bytes:
     return (
         b"--frame\r\n"
         b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n"
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import datetime as _dt
+import itertools
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+import cv2
+
+_FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION, 3),
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, 95),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, 90),
+}
+
+
+@dataclass
+class SnapshotJob:
+    job_id: str
+    requested: int
+    captured: int = 0
+    written: int = 0
+    failed: int = 0
+    paths: list[str] = field(default_factory=list)
+    frames: list = field(default_factory=list, repr=False)
+    deadline: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "failed"
+        if self.captured < self.requested:
+            return "capturing"
+        if self.written + self.failed < self.requested:
+            return "writing"
+        return "failed" if self.failed == self.requested else "done"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.job_id,
+            "status": self.status,
+            "requested": self.requested,
+            "captured": self.captured,
+            "written": self.written,
+            "failed": self.failed,
+            "paths": list(self.paths),
+            "error": self.error,
+        }
+
+
+class SnapshotWriter:
+    def __init__(
+        self,
+        output_dir: Path,
+        *,
+        name_prefix: str = "shot",
+        image_format: str = "png",
+        compression: Optional[int] = None,
+        workers: int = 2,
+        max_burst: int = 120,
+        max_jobs: int = 32,
+        timeout: float = 10.0,
+    ) -> None:
+        image_format = image_format.lower().lstrip(".")
+        if image_format == "jpeg":
+            image_format = "jpg"
+        if image_format not in _FORMATS:
+            raise ValueError(f"Unsupported snapshot format: {image_format}")
+        ext, flag, default_level = _FORMATS[image_format]
+        self._output_dir = output_dir
+        self._name_prefix = name_prefix
+        self._ext = ext
+        self._params = [int(flag), int(default_level if compression is None else compression)]
+        self._max_burst = max(1, int(max_burst))
+        self._max_jobs = max(1, int(max_jobs))
+        self._timeout = max(0.1, float(timeout))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="snapshot")
+        self._lock = Lock()
+        self._ids = itertools.count(1)
+        self._jobs: OrderedDict[str, SnapshotJob] = OrderedDict()
+        self._capturing: list[SnapshotJob] = []
+
+    @property
+    def wants_frames(self) -> bool:
+        with self._lock:
+            self._expire_locked()
+            return bool(self._capturing)
+
+    def request(self, count: int = 1) -> SnapshotJob:
+        count = min(self._max_burst, max(1, int(count)))
+        with self._lock:
+            job = SnapshotJob(
+                job_id=str(next(self._ids)),
+                requested=count,
+                deadline=time.monotonic() + self._timeout,
+            )
+            self._jobs[job.job_id] = job
+            self._capturing.append(job)
+            self._evict_locked()
+            return job
+
+    def cancel(self, job: SnapshotJob, reason: str) -> None:
+        with self._lock:
+            self._fail_locked(job, reason)
+
+    def job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def recent(self, limit: int = 5) -> list[dict]:
+        with self._lock:
+            self._expire_locked()
+            jobs = list(self._jobs.values())[-limit:]
+            return [job.to_dict() for job in reversed(jobs)]
+
+    def offer(self, frame) -> None:
+        # Called once per rendered frame; only copies while a job is capturing,
+        # all encoding and disk I/O happens on the worker pool.
+        with self._lock:
+            if not self._capturing:
+                return
+            copy = frame.copy()
+            finished = []
+            for job in self._capturing:
+                job.frames.append(copy)
+                job.captured += 1
+                if job.captured >= job.requested:
+                    finished.append(job)
+            for job in finished:
+                self._capturing.remove(job)
+
+        for job in finished:
+            self._write_job(job)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def _write_job(self, job: SnapshotJob) -> None:
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        now = _dt.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        frames, job.frames = job.frames, []
+        for i, frame in enumerate(frames):
+            if len(frames) == 1:
+                name = f"{self._name_prefix}_{now}{self._ext}"
+            else:
+                name = f"{self._name_prefix}_{now}_{i:03d}{self._ext}"
+            self._executor.submit(self._write_one, job, self._output_dir / name, frame)
+
+    def _write_one(self, job: SnapshotJob, path: Path, frame) -> None:
+        try:
+            ok = cv2.imwrite(str(path), frame, self._params)
+        except Exception:
+            ok = False
+        with self._lock:
+            if ok:
+                job.written += 1
+                job.paths.append(str(path))
+            else:
+                job.failed += 1
+
+    def _expire_locked(self) -> None:
+        # A job that gets no frames (camera gone, stream stopped) fails
+        # instead of capturing forever.
+        now = time.monotonic()
+        for job in [job for job in self._capturing if now >= job.deadline]:
+            self._fail_locked(job, f"Timed out after {job.captured} of {job.requested} frames")
+
+    def _fail_locked(self, job: SnapshotJob, reason: str) -> None:
+        if job in self._capturing:
+            self._capturing.remove(job)
+            job.frames = []
+            job.error = reason
+
+    def _evict_locked(self) -> None:
+        while len(self._jobs) > self._max_jobs:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest in self._capturing or oldest.status == "writing":
+                break
+            del self._jobs[oldest_id]
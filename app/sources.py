@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+from typing import Callable, Optional, Protocol
+
+import cv2
+import numpy as np
+
+from .rawcapture import RawVideo
+
+
+class FrameSource(Protocol):
+    # The subset of cv2.VideoCapture that Camera relies on, so a device
+    # capture and the sources below are interchangeable.
+    def isOpened(self) -> bool: ...
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]: ...
+
+    def release(self) -> None: ...
+
+
+class _Pacer:
+    def __init__(self, fps: float, realtime: bool) -> None:
+        self._interval = 1.0 / fps if fps > 0 else 0.0
+        self._realtime = realtime and self._interval > 0
+        self._next_at: Optional[float] = None
+
+    def wait(self) -> None:
+        if not self._realtime:
+            return
+        now = time.monotonic()
+        if self._next_at is None or now - self._next_at > self._interval:
+            # First frame, or we fell behind: restart the schedule instead of
+            # bursting to catch up.
+            self._next_at = now
+        elif self._next_at > now:
+            time.sleep(self._next_at - now)
+        self._next_at += self._interval
+
+
+class SyntheticSource:
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0, *, realtime: bool = True) -> None:
+        self._width = max(16, int(width))
+        self._height = max(16, int(height))
+        self._pacer = _Pacer(fps, realtime)
+        self._opened = True
+        self._index = 0
+        ramp = np.linspace(0, 255, self._width, dtype=np.float32)
+        base = np.empty((self._height, self._width, 3), dtype=np.uint8)
+        base[..., 0] = ramp.astype(np.uint8)
+        base[..., 1] = np.linspace(0, 255, self._height, dtype=np.float32)[:, None].astype(np.uint8)
+        base[..., 2] = 128
+        self._background = base
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        if not self._opened:
+            return False, None
+        self._pacer.wait()
+        frame = self._background.copy()
+        size = max(8, min(self._width, self._height) // 4)
+        span_x = max(1, self._width - size)
+        span_y = max(1, self._height - size)
+        x = (self._index * 7) % (2 * span_x)
+        y = (self._index * 5) % (2 * span_y)
+        x = x if x < span_x else 2 * span_x - x
+        y = y if y < span_y else 2 * span_y - y
+        cv2.rectangle(frame, (x, y), (x + size, y + size), (255, 255, 255), -1)
+        cv2.putText(
+            frame,
+            str(self._index),
+            (10, self._height - 12),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (0, 0, 0),
+            2,
+        )
+        self._index += 1
+        return True, frame
+
+    def release(self) -> None:
+        self._opened = False
+
+
+class VideoFileSource:
+    def __init__(
+        self,
+        path: Path,
+        *,
+        fps: Optional[float] = None,
+        loop: bool = True,
+        realtime: bool = True,
+    ) -> None:
+        self._path = Path(path)
+        self._loop = loop
+        self._cap = cv2.VideoCapture(str(self._path))
+        file_fps = self._cap.get(cv2.CAP_PROP_FPS) if self._cap.isOpened() else 0.0
+        self._pacer = _Pacer(fps or file_fps or 30.0, realtime)
+
+    def isOpened(self) -> bool:
+        return self._cap.isOpened()
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        self._pacer.wait()
+        ok, frame = self._cap.read()
+        if not ok and self._loop and self._cap.isOpened():
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self._cap.read()
+        if not ok:
+            return False, None
+        return True, frame
+
+    def release(self) -> None:
+        self._cap.release()
+
+
+class RawFileSource:
+    # Plays back a raw capture (see app.rawcapture). Without an explicit fps
+    # the recorded capture timestamps are replayed as they were.
+    def __init__(
+        self,
+        path: Path,
+        *,
+        fps: Optional[float] = None,
+        loop: bool = True,
+        realtime: bool = True,
+    ) -> None:
+        self._video = RawVideo(Path(path))
+        self._loop = loop
+        self._realtime = realtime
+        self._pacer = _Pacer(fps, realtime) if fps else None
+        self._opened = len(self._video) > 0
+        self._index = 0
+        self._origin: Optional[float] = None
+
+    def isOpened(self) -> bool:
+        return self._opened
+
+    def read(self) -> tuple[bool, Optional[np.ndarray]]:
+        if not self._opened:
+            return False, None
+        if self._index >= len(self._video):
+            if not self._loop:
+                return False, None
+            self._index = 0
+            self._origin = None
+        if self._pacer is not None:
+            self._pacer.wait()
+        elif self._realtime:
+            timestamps = self._video.timestamps
+            now = time.monotonic()
+            if self._origin is None:
+                self._origin = now
+            due = self._origin + float(timestamps[self._index] - timestamps[0])
+            if due > now:
+                time.sleep(due - now)
+        # Camera owns and may modify what it reads; the capture itself stays
+        # read-only.
+        frame = self._video.frame(self._index).copy()
+        self._index += 1
+        return True, frame
+
+    def release(self) -> None:
+        self._opened = False
+
+
+SourceFactory = Callable[[], FrameSource]
+
+
+def source_factory(spec: str, width: int = 640, height: int = 480) -> Optional[SourceFactory]:
+    # "synthetic", "synthetic:1280x720@30", "file:clip.mp4", "file:clip.mp4@15"
+    # or "raw:capture.raw"; an empty spec means "use the camera device".
+    spec = spec.strip()
+    if not spec:
+        return None
+    kind, _, arg = spec.partition(":")
+    kind = kind.strip().lower()
+
+    if kind == "synthetic":
+        size, _, fps = arg.partition("@")
+        w, h = width, height
+        if size:
+            w, h = (int(v) for v in size.lower().split("x", 1))
+        rate = float(fps) if fps else 30.0
+        return lambda: SyntheticSource(w, h, rate)
+
+    if kind == "file":
+        path, _, fps = arg.rpartition("@") if "@" in arg else (arg, "", "")
+        rate = float(fps) if fps else None
+        return lambda: VideoFileSource(Path(path), fps=rate)
+
+    if kind == "raw":
+        path, _, fps = arg.rpartition("@") if "@" in arg else (arg, "", "")
+        rate = float(fps) if fps else None
+        return lambda: RawFileSource(Path(path), fps=rate)
+
+    raise ValueError(f"Unknown frame source: {spec!r}")
@@ -1,54 +1,98 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
-from threading import Lock
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, replace
+from threading import Condition
+from typing import Iterator, Optional
 
+FLAGS = ("stream_on", "grey_on", "negative_on", "face_only_on")
 
-@dataclass
-class AppState:
+
+class StaleStateError(RuntimeError):
+    def __init__(self, current: StateSnapshot) -> None:
+        super().__init__(f"State is at version {current.version}")
+        self.current = current
+
+
+@dataclass(frozen=True)
+class StateSnapshot(Mapping):
+    # Immutable; every change produces a new snapshot with a higher version,
+    # so readers can tell "anything changed?" from one integer.
+    version: int = 0
     stream_on: bool = True
     grey_on: bool = False
     negative_on: bool = False
     face_only_on: bool = False
-    _capture_requested: bool = False
-    _lock: Lock = field(default_factory=Lock, repr=False)
-
-    def snapshot(self) -> dict[str, bool]:
-        with self._lock:
-            return {
-                "stream_on": self.stream_on,
-                "grey_on": self.grey_on,
-                "negative_on": self.negative_on,
-                "face_only_on": self.face_only_on,
-            }
+
+    def __getitem__(self, key: str) -> bool:
+        if key not in FLAGS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(FLAGS)
+
+    def __len__(self) -> int:
+        return len(FLAGS)
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, **self}
+
+
+class AppState:
+    def __init__(self, **initial: bool) -> None:
+        self._cond = Condition()
+        self._snapshot = StateSnapshot(**initial)
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    def snapshot(self) -> StateSnapshot:
+        # No lock: the snapshot is immutable and replaced as a whole.
+        return self._snapshot
+
+    def apply(
+        self,
+        values: Optional[Mapping[str, bool]] = None,
+        toggle: Iterable[str] = (),
+        expected_version: Optional[int] = None,
+    ) -> tuple[StateSnapshot, StateSnapshot]:
+        # Sets and flips several flags atomically; returns (before, after).
+        # With `expected_version` the change only applies on top of that
+        # version, otherwise StaleStateError carries the current state.
+        values = dict(values or {})
+        toggle = list(toggle)
+        unknown = (set(values) | set(toggle)) - set(FLAGS)
+        if unknown:
+            raise ValueError(f"Unknown state flags: {', '.join(sorted(unknown))}")
+        with self._cond:
+            before = self._snapshot
+            if expected_version is not None and expected_version != before.version:
+                raise StaleStateError(before)
+            changes = {flag: not before[flag] for flag in toggle}
+            changes.update({flag: bool(on) for flag, on in values.items()})
+            changes = {flag: on for flag, on in changes.items() if on != before[flag]}
+            if not changes:
+                return before, before
+            self._snapshot = replace(before, version=before.version + 1, **changes)
+            self._cond.notify_all()
+            return before, self._snapshot
+
+    def wait_changed(self, after_version: int, timeout: Optional[float] = None) -> Optional[StateSnapshot]:
+        with self._cond:
+            if self._cond.wait_for(lambda: self._snapshot.version > after_version, timeout):
+                return self._snapshot
+            return None
 
     def toggle_stream(self) -> bool:
-        with self._lock:
-            self.stream_on = not self.stream_on
-            return self.stream_on
+        return self.apply(toggle=("stream_on",))[1].stream_on
 
     def toggle_grey(self) -> bool:
-        with self._lock:
-            self.grey_on = not self.grey_on
-            return self.grey_on
+        return self.apply(toggle=("grey_on",))[1].grey_on
 
     def toggle_negative(self) -> bool:
-        with self._lock:
-            self.negative_on = not self.negative_on
-            return self.negative_on
+        return self.apply(toggle=("negative_on",))[1].negative_on
 
     def toggle_face_only(self) -> bool:
-        with self._lock:
-            self.face_only_on = not self.face_only_on
-            return self.face_only_on
-
-    def request_capture(self) -> None:
-        with self._lock:
-            self._capture_requested = True
-
-    def consume_capture_request(self) -> bool:
-        with self._lock:
-            requested = self._capture_requested
-            self._capture_requested = False
-            return requested
-
+        return self.apply(toggle=("face_only_on",))[1].face_only_on
@@ -0,0 +1,273 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Event, Lock
+from typing import Any, Callable, Hashable, Optional
+
+QUALITY_LADDER = (95, 80, 65, 50, 35)
+SCALE_LADDER = (1.0, 0.75, 0.5, 0.35)
+DEFAULT_RENDITIONS = "full=1.0,half=0.5,thumb=0.25"
+
+
+class _Entry:
+    __slots__ = ("ready", "value")
+
+    def __init__(self) -> None:
+        self.ready = Event()
+        self.value: Any = None
+
+
+class FrameCache:
+    def __init__(self, max_entries: int = 16) -> None:
+        self._max_entries = max(1, int(max_entries))
+        self._lock = Lock()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get_or_create(self, key: Hashable, produce: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = _Entry()
+                self._entries[key] = entry
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+
+        if not owner:
+            entry.ready.wait()
+            if entry.value is not None:
+                return entry.value
+            return produce()
+
+        try:
+            entry.value = produce()
+            return entry.value
+        except Exception:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry.ready.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def scaled_size(size: tuple[int, int], scale: float) -> tuple[int, int]:
+    w, h = size
+    # Even dimensions keep JPEG chroma subsampling happy.
+    return (max(2, int(w * scale) // 2 * 2), max(2, int(h * scale) // 2 * 2))
+
+
+@dataclass(frozen=True)
+class Rendition:
+    name: str
+    size: tuple[int, int]
+
+
+def parse_renditions(value: str, full_size: tuple[int, int]) -> list[Rendition]:
+    # "full=1.0,half=0.5,thumb=320x180": a fraction of the camera size or an
+    # exact size per name, largest first.
+    renditions = {}
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, spec = item.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Invalid rendition: {item!r}")
+        if "x" in spec:
+            w, h = (int(v) for v in spec.lower().split("x", 1))
+            size = (w, h)
+        else:
+            scale = float(spec)
+            if not 0 < scale <= 1:
+                raise ValueError(f"Invalid rendition scale: {item!r}")
+            size = scaled_size(full_size, scale)
+        renditions[name.strip()] = Rendition(name.strip(), size)
+    if not renditions:
+        renditions["full"] = Rendition("full", full_size)
+    return sorted(renditions.values(), key=lambda r: r.size[0] * r.size[1], reverse=True)
+
+
+class RenditionLadder:
+    # The output sizes viewers can pick from. Every configured rendition, at a
+    # ladder quality, that a viewer asked for recently is encoded for each new
+    # frame in parallel on a small pool (resize and imencode release the GIL);
+    # variants nobody has asked for within `idle_seconds` are not computed at
+    # all. Ad-hoc sizes and qualities are encoded on the asking viewer's own
+    # path, so they never add work for everyone else.
+    def __init__(self, renditions: list[Rendition], *, workers: int = 2, idle_seconds: float = 2.0) -> None:
+        self._renditions = list(renditions)
+        self._by_name = {r.name: r for r in self._renditions}
+        self._sizes = frozenset(r.size for r in self._renditions)
+        self._idle_seconds = max(0.1, float(idle_seconds))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="rendition")
+        self._lock = Lock()
+        self._watched: dict[tuple[tuple[int, int], int], float] = {}
+
+    @property
+    def renditions(self) -> list[Rendition]:
+        return list(self._renditions)
+
+    @property
+    def sizes(self) -> list[tuple[int, int]]:
+        return [r.size for r in self._renditions]
+
+    def get(self, name: str) -> Optional[Rendition]:
+        return self._by_name.get(name)
+
+    def watch(self, size: tuple[int, int], quality: int) -> None:
+        if size not in self._sizes or quality not in QUALITY_LADDER:
+            return
+        with self._lock:
+            self._watched[(size, quality)] = time.monotonic()
+
+    def active(self) -> list[tuple[tuple[int, int], int]]:
+        cutoff = time.monotonic() - self._idle_seconds
+        with self._lock:
+            for variant in [v for v, at in self._watched.items() if at < cutoff]:
+                del self._watched[variant]
+            return list(self._watched)
+
+    def prefetch(self, encode: Callable[[tuple[int, int], int], Any]) -> None:
+        for size, quality in self.active():
+            self._executor.submit(encode, size, quality)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class ClientStream:
+    # Per-viewer send accounting. The generator reports how long each yield
+    # took to drain; when sends eat most of the frame budget the viewer steps
+    # down the quality/size ladder, and climbs back once the link has headroom.
+    def __init__(
+        self,
+        full_size: tuple[int, int],
+        *,
+        quality: Optional[int] = None,
+        size: Optional[tuple[int, int]] = None,
+        max_fps: float = 0.0,
+        sizes: Optional[list[tuple[int, int]]] = None,
+        degrade_fraction: float = 0.8,
+        recover_fraction: float = 0.3,
+        degrade_cooldown: float = 1.0,
+        recover_cooldown: float = 3.0,
+    ) -> None:
+        self._min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self._degrade_fraction = degrade_fraction
+        self._recover_fraction = recover_fraction
+        self._degrade_cooldown = degrade_cooldown
+        self._recover_cooldown = recover_cooldown
+        self._sizes = sizes or [scaled_size(full_size, s) for s in SCALE_LADDER]
+        self._levels = self._build_levels(quality, size)
+        self._level = 0
+        self._changed_at = time.monotonic()
+        self._last_sent_at: Optional[float] = None
+        self._last_captured_at: Optional[float] = None
+        self._frame_interval = 0.0
+        self._send_seconds = 0.0
+        self._throughput = 0.0
+        self._fps = 0.0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+    def _build_levels(
+        self,
+        quality: Optional[int],
+        size: Optional[tuple[int, int]],
+    ) -> list[tuple[int, tuple[int, int]]]:
+        qualities = (quality,) if quality is not None else QUALITY_LADDER
+        if size is not None:
+            return [(q, size) for q in qualities]
+        sizes = self._sizes
+        if len(sizes) == 1:
+            return [(q, sizes[0]) for q in qualities]
+        if quality is not None:
+            return [(quality, sz) for sz in sizes]
+        # Trade quality first, then resolution, keeping a usable floor.
+        levels = [(q, sizes[0]) for q in qualities[:-1]]
+        levels += [(qualities[-2], sz) for sz in sizes[1:]]
+        levels.append((qualities[-1], sizes[-1]))
+        return levels
+
+    @property
+    def quality(self) -> int:
+        return self._levels[self._level][0]
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._levels[self._level][1]
+
+    @property
+    def send_seconds(self) -> float:
+        return self._send_seconds
+
+    @property
+    def throughput(self) -> float:
+        return self._throughput
+
+    @property
+    def fps(self) -> float:
+        return self._fps
+
+    def frame_captured(self, seq_gap: int, captured_at: float) -> None:
+        if seq_gap > 1:
+            self.frames_skipped += seq_gap - 1
+        if self._last_captured_at is not None:
+            interval = captured_at - self._last_captured_at
+            if interval > 0:
+                self._frame_interval = _ewma(self._frame_interval, interval / max(1, seq_gap))
+        self._last_captured_at = captured_at
+
+    def frame_sent(self, nbytes: int, seconds: float) -> None:
+        now = time.monotonic()
+        if self._last_sent_at is not None and now > self._last_sent_at:
+            self._fps = _ewma(self._fps, 1.0 / (now - self._last_sent_at))
+        self.frames_sent += 1
+        self.bytes_sent += nbytes
+        self._last_sent_at = now
+        self._send_seconds = _ewma(self._send_seconds, seconds)
+        if seconds > 0:
+            self._throughput = _ewma(self._throughput, nbytes / seconds)
+        self._adapt()
+
+    def pacing_delay(self) -> float:
+        if self._min_interval <= 0 or self._last_sent_at is None:
+            return 0.0
+        return max(0.0, self._min_interval - (time.monotonic() - self._last_sent_at))
+
+    def _adapt(self) -> None:
+        budget = max(self._frame_interval, self._min_interval)
+        if budget <= 0 or len(self._levels) == 1:
+            return
+        now = time.monotonic()
+        since_change = now - self._changed_at
+        load = self._send_seconds / budget
+        if load > self._degrade_fraction and since_change >= self._degrade_cooldown:
+            if self._level < len(self._levels) - 1:
+                self._level += 1
+                self._changed_at = now
+        elif load < self._recover_fraction and since_change >= self._recover_cooldown:
+            if self._level > 0:
+                self._level -= 1
+                self._changed_at = now
+
+
+def _ewma(current: float, sample: float, alpha: float = 0.2) -> float:
+    if current <= 0:
+        return sample
+    return current + (sample - current) * alpha
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import struct
+import time
+from threading import Lock
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .metrics import STAGE_SECONDS
+
+# Binary WebSocket messages, little-endian:
+#   keyframe: b"K" u16 width, u16 height, JPEG of the whole frame
+#   delta:    b"D" u16 count, then per tile u16 x, u16 y, u32 length, JPEG
+_KEYFRAME = struct.Struct("<cHH")
+_DELTA = struct.Struct("<cH")
+_TILE = struct.Struct("<HHI")
+
+
+def pack_keyframe(size: tuple[int, int], jpeg: bytes) -> bytes:
+    return _KEYFRAME.pack(b"K", size[0], size[1]) + jpeg
+
+
+def pack_delta(tiles: list[tuple[int, int, bytes]]) -> bytes:
+    parts = [_DELTA.pack(b"D", len(tiles))]
+    for x, y, jpeg in tiles:
+        parts.append(_TILE.pack(x, y, len(jpeg)))
+        parts.append(jpeg)
+    return b"".join(parts)
+
+
+class TileDeltaEncoder:
+    # Keeps a reference image: what a viewer that has applied every update
+    # currently shows. A tile is replaced in the reference (and gets a new
+    # version) once enough of its pixels drift from it, so slow changes are
+    # caught too and the error a viewer sees stays below the threshold. Each
+    # tile version is encoded once and shared by every viewer; a viewer only
+    # tracks which versions it already has.
+    def __init__(
+        self,
+        size: tuple[int, int],
+        *,
+        tile: int = 64,
+        pixel_threshold: int = 20,
+        min_changed_fraction: float = 0.005,
+        quality: int = 75,
+        name: str = "default",
+    ) -> None:
+        w, h = size
+        self._size = (w, h)
+        self._tile = max(8, int(tile))
+        self._cols = (w + self._tile - 1) // self._tile
+        self._rows = (h + self._tile - 1) // self._tile
+        self._pixel_threshold = int(pixel_threshold)
+        self._min_changed = int(round(max(0.0, float(min_changed_fraction)) * 255))
+        self._params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+        self._lock = Lock()
+        self._key: Optional[tuple] = None
+        self._reference: Optional[np.ndarray] = None
+        self._versions = np.zeros((self._rows, self._cols), dtype=np.int64)
+        self._next_version = 1
+        self._encoded: dict[tuple[int, int], tuple[int, bytes]] = {}
+        self._keyframe: Optional[tuple[int, bytes]] = None
+        self._seconds = STAGE_SECONDS.labels(name, "tiles")
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._size
+
+    @property
+    def tile_count(self) -> int:
+        return self._rows * self._cols
+
+    def update(self, key: tuple, display: np.ndarray) -> None:
+        with self._lock:
+            if key == self._key:
+                return
+            self._key = key
+            started = time.perf_counter()
+            self._update_locked(display)
+            self._seconds.observe(time.perf_counter() - started)
+
+    def _update_locked(self, display: np.ndarray) -> None:
+        if display.shape[1::-1] != self._size:
+            display = cv2.resize(display, self._size, interpolation=cv2.INTER_AREA)
+        if self._reference is None:
+            self._reference = display.copy()
+            self._versions[:] = self._bump()
+            return
+        diff = cv2.cvtColor(cv2.absdiff(display, self._reference), cv2.COLOR_BGR2GRAY)
+        _, mask = cv2.threshold(diff, self._pixel_threshold, 255, cv2.THRESH_BINARY)
+        # Padded to whole tiles, area-averaging the mask down to one pixel per
+        # tile gives the changed fraction of every tile in one call.
+        t = self._tile
+        h, w = mask.shape
+        mask = cv2.copyMakeBorder(mask, 0, self._rows * t - h, 0, self._cols * t - w, cv2.BORDER_CONSTANT, value=0)
+        fractions = cv2.resize(mask, (self._cols, self._rows), interpolation=cv2.INTER_AREA)
+        changed = np.argwhere(fractions > self._min_changed)
+        if not len(changed):
+            return
+        version = self._bump()
+        for row, col in changed:
+            y, x = row * t, col * t
+            self._reference[y : y + t, x : x + t] = display[y : y + t, x : x + t]
+            self._versions[row, col] = version
+
+    def keyframe(self) -> tuple[np.ndarray, bytes]:
+        with self._lock:
+            version = int(self._versions.max())
+            if self._keyframe is None or self._keyframe[0] != version:
+                self._keyframe = (version, self._encode(self._reference))
+            return self._versions.copy(), pack_keyframe(self._size, self._keyframe[1])
+
+    def delta(self, known: np.ndarray) -> tuple[np.ndarray, Optional[bytes], int]:
+        # Returns the versions the viewer will have, the message (None if
+        # nothing changed) and how many tiles it carries.
+        with self._lock:
+            stale = np.argwhere(self._versions != known)
+            if not len(stale):
+                return known, None, 0
+            t = self._tile
+            tiles = []
+            for row, col in stale:
+                version = int(self._versions[row, col])
+                cached = self._encoded.get((row, col))
+                if cached is None or cached[0] != version:
+                    y, x = row * t, col * t
+                    cached = (version, self._encode(self._reference[y : y + t, x : x + t]))
+                    self._encoded[(row, col)] = cached
+                tiles.append((int(col) * t, int(row) * t, cached[1]))
+            return self._versions.copy(), pack_delta(tiles), len(tiles)
+
+    def _bump(self) -> int:
+        version = self._next_version
+        self._next_version += 1
+        return version
+
+    def _encode(self, image: np.ndarray) -> bytes:
+        ok, buffer = cv2.imencode(".jpg", image, self._params)
+        return buffer.tobytes() if ok else b""
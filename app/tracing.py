@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from threading import Lock, current_thread
+from typing import Any, Optional
+
+# Frames are stamped with time.monotonic(), stage timings use
+# time.perf_counter(); traces are kept on the perf_counter clock.
+_MONOTONIC_TO_PERF = time.perf_counter() - time.monotonic()
+
+
+class FrameTrace:
+    __slots__ = ("seq", "captured_at", "_spans", "_max_spans", "_lock")
+
+    def __init__(self, seq: int, captured_at: float, max_spans: int) -> None:
+        self.seq = seq
+        self.captured_at = captured_at + _MONOTONIC_TO_PERF
+        self._spans: list[tuple[str, float, float, str, dict]] = []
+        self._max_spans = max_spans
+        self._lock = Lock()
+
+    def add(self, name: str, started: float, ended: float, **args: Any) -> None:
+        # `started` / `ended` are time.perf_counter() values.
+        with self._lock:
+            if len(self._spans) < self._max_spans:
+                self._spans.append((name, started, ended, current_thread().name, args))
+
+    def spans(self) -> list[tuple[str, float, float, str, dict]]:
+        with self._lock:
+            return list(self._spans)
+
+
+class FrameTracer:
+    # Keeps the last `capacity` sampled frames. Whether a frame is sampled
+    # depends only on its sequence number, so every stage agrees without the
+    # decision being passed along with the frame.
+    def __init__(self, sample_every: int, *, capacity: int = 64, max_spans: int = 128, name: str = "default") -> None:
+        self._every = max(1, int(sample_every))
+        self._capacity = max(1, int(capacity))
+        self._max_spans = max(1, int(max_spans))
+        self._name = name
+        self._lock = Lock()
+        self._traces: OrderedDict[int, FrameTrace] = OrderedDict()
+        self._evicted_seq = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def trace(self, frame) -> Optional[FrameTrace]:
+        if frame.seq % self._every:
+            return None
+        with self._lock:
+            trace = self._traces.get(frame.seq)
+            if trace is None and frame.seq > self._evicted_seq:
+                trace = FrameTrace(frame.seq, frame.captured_at, self._max_spans)
+                self._traces[frame.seq] = trace
+                while len(self._traces) > self._capacity:
+                    self._evicted_seq = max(self._evicted_seq, self._traces.popitem(last=False)[0])
+            return trace
+
+    def traces(self) -> list[FrameTrace]:
+        with self._lock:
+            return list(self._traces.values())
+
+    def chrome_events(self, pid: int) -> list[dict]:
+        # Chrome trace-event format: one process per camera, one row per frame.
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"camera {self._name}"}}]
+        for trace in self.traces():
+            spans = trace.spans()
+            started = min([trace.captured_at] + [span[1] for span in spans])
+            ended = max([trace.captured_at] + [span[2] for span in spans])
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": trace.seq, "args": {"name": f"frame {trace.seq}"}}
+            )
+            events.append(_complete("frame", started, ended, pid, trace.seq, {"seq": trace.seq}))
+            for name, span_started, span_ended, thread, args in spans:
+                events.append(_complete(name, span_started, span_ended, pid, trace.seq, args | {"thread": thread}))
+        return events
+
+
+def _complete(name: str, started: float, ended: float, pid: int, tid: int, args: dict) -> dict:
+    return {
+        "name": name,
+        "ph": "X",
+        "ts": round(started * 1e6, 1),
+        "dur": round(max(0.0, ended - started) * 1e6, 1),
+        "pid": pid,
+        "tid": tid,
+        "args": args,
+    }
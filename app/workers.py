@@ -0,0 +1,434 @@
+from __future__ import annotations
+
+import itertools
+import multiprocessing as mp
+import queue
+import time
+import weakref
+from concurrent.futures import Future
+from pathlib import Path
+from threading import Event, Lock, Thread, current_thread
+from typing import Any, Callable, Optional
+
+import cv2
+import numpy as np
+
+from .camera import CameraConfig
+from .framering import RingSpec, SharedFrameRing
+from .hub import FrameHub
+from .metrics import CAPTURE_FPS, CAPTURE_FRAMES
+from .processing import Box, ensure_bgr
+
+# Spawned (not forked) children: the parent already runs OpenCV and worker
+# threads, which fork does not carry over safely, and it is the only start
+# method on Windows.
+_MP = mp.get_context("spawn")
+
+
+def _serve(requests, results, handle: Callable[[Any], Any]) -> None:
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        req_id, payload = item
+        try:
+            results.put((req_id, True, handle(payload)))
+        except Exception as exc:
+            results.put((req_id, False, repr(exc)))
+
+
+class _Rings:
+    # Worker-side cache of attached rings, keyed by shared-memory name.
+    def __init__(self) -> None:
+        self._rings: dict[str, SharedFrameRing] = {}
+
+    def get(self, spec: RingSpec) -> SharedFrameRing:
+        ring = self._rings.get(spec.name)
+        if ring is None:
+            ring = SharedFrameRing.attach(spec)
+            self._rings[spec.name] = ring
+        return ring
+
+
+def _detector_worker(requests, results, options: dict) -> None:
+    from .processing import create_face_detector
+
+    detector = create_face_detector(**options)
+    detector.warm_up()
+    rings = _Rings()
+
+    def handle(payload):
+        spec, slot, seq = payload
+        ring = rings.get(spec)
+        if not ring.valid(slot, seq):
+            return None
+        frame = ring.view(slot)
+        box = detector.detect(frame)
+        if box is None or not ring.valid(slot, seq):
+            return None
+        h, w = frame.shape[:2]
+        x0, y0, x1, y1 = box
+        return (x0 / w, y0 / h, x1 / w, y1 / h)
+
+    _serve(requests, results, handle)
+
+
+def _encoder_worker(requests, results) -> None:
+    from .routes import encode_mjpeg_frame
+
+    rings = _Rings()
+
+    def handle(payload):
+        spec, slot, seq, size, quality = payload
+        ring = rings.get(spec)
+        if not ring.valid(slot, seq):
+            return None
+        frame = ring.view(slot)
+        if frame.shape[1::-1] != tuple(size):
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        chunk = encode_mjpeg_frame(frame, quality)
+        return chunk if ring.valid(slot, seq) else None
+
+    _serve(requests, results, handle)
+
+
+def _capture_worker(
+    spec: RingSpec,
+    camera_kwargs: dict,
+    source: str,
+    discovery_cache_path: Optional[str],
+    events,
+    stop,
+) -> None:
+    from .camera import Camera
+    from .discovery import DiscoveryCache
+    from .sources import source_factory
+
+    ring = SharedFrameRing.attach(spec)
+    h, w = spec.shape[:2]
+    camera = Camera(
+        source_factory=source_factory(source, w, h),
+        discovery_cache=DiscoveryCache(Path(discovery_cache_path)) if discovery_cache_path else None,
+        **camera_kwargs,
+    )
+    try:
+        while not stop.is_set():
+            ok, frame = camera.read()
+            if not ok or frame is None:
+                stop.wait(0.1)
+                continue
+            frame = ensure_bgr(frame)
+            captured_at = time.monotonic()
+            slot, seq, target = ring.claim(captured_at)
+            if frame.shape[:2] != (h, w):
+                cv2.resize(frame, (w, h), dst=target)
+            else:
+                np.copyto(target, frame)
+            events.put((slot, seq, captured_at))
+    finally:
+        camera.release()
+        ring.close()
+
+
+class WorkerPool:
+    def __init__(self, target: Callable, workers: int, *, name: str, args: tuple = ()) -> None:
+        self._requests = _MP.Queue()
+        self._results = _MP.Queue()
+        self._lock = Lock()
+        self._ids = itertools.count(1)
+        self._futures: dict[int, Future] = {}
+        self._processes = [
+            _MP.Process(
+                target=target,
+                args=(self._requests, self._results, *args),
+                name=f"{name}-{i}",
+                daemon=True,
+            )
+            for i in range(max(1, int(workers)))
+        ]
+        for process in self._processes:
+            process.start()
+        self._collector = Thread(target=self._collect, name=f"{name}-results", daemon=True)
+        self._collector.start()
+
+    def submit(self, payload) -> Future:
+        future: Future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._futures[req_id] = future
+        self._requests.put((req_id, payload))
+        return future
+
+    def forget(self, future: Future) -> None:
+        with self._lock:
+            for req_id, pending in list(self._futures.items()):
+                if pending is future:
+                    del self._futures[req_id]
+
+    def shutdown(self) -> None:
+        for _ in self._processes:
+            self._requests.put(None)
+        for process in self._processes:
+            process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=1.0)
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                item = self._results.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            req_id, ok, value = item
+            with self._lock:
+                future = self._futures.pop(req_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+
+def start_detector_pool(workers: int, options: dict) -> WorkerPool:
+    # options are create_face_detector keyword arguments.
+    return WorkerPool(_detector_worker, workers, name="face-worker", args=(options,))
+
+
+def start_encoder_pool(workers: int) -> WorkerPool:
+    return WorkerPool(_encoder_worker, workers, name="encode-worker")
+
+
+class ProcessCamera:
+    # Drop-in for Camera when capture runs in its own process: frames arrive
+    # in a shared-memory ring and are published to the hub as views, so nothing
+    # is pickled or copied on the way in. A frame stays valid until the ring
+    # wraps, i.e. for `slots` capture intervals.
+    def __init__(
+        self,
+        device_index: int = 0,
+        width: int = 640,
+        height: int = 480,
+        *,
+        slots: int = 8,
+        source: str = "",
+        discovery_cache_path: Optional[Path] = None,
+        name: str = "default",
+        **camera_kwargs,
+    ) -> None:
+        self._config = CameraConfig(device_index=device_index, width=width, height=height)
+        self._source = source
+        self._discovery_cache_path = str(discovery_cache_path) if discovery_cache_path else None
+        self._camera_kwargs = dict(camera_kwargs, device_index=device_index, width=width, height=height, name=name)
+        self._ring = SharedFrameRing.create(slots, (height, width, 3))
+        weakref.finalize(self, self._ring.close)
+        self._lock = Lock()
+        self._hub = FrameHub()
+        self._process: Optional[mp.process.BaseProcess] = None
+        self._stop: Optional[Any] = None
+        self._receiver: Optional[Thread] = None
+        self._receiver_stop: Optional[Event] = None
+        self._latest_ref: Optional[tuple[int, int]] = None
+        self._capture_frames = CAPTURE_FRAMES.labels(name)
+        self._capture_fps = CAPTURE_FPS.labels(name)
+
+    @property
+    def config(self) -> CameraConfig:
+        return self._config
+
+    @property
+    def hub(self) -> FrameHub:
+        return self._hub
+
+    @property
+    def ring_spec(self) -> RingSpec:
+        return self._ring.spec
+
+    @property
+    def is_capturing(self) -> bool:
+        with self._lock:
+            return self._process is not None and self._process.is_alive()
+
+    @property
+    def active_index(self) -> Optional[int]:
+        return None
+
+    @property
+    def active_backend(self) -> Optional[int]:
+        return None
+
+    def latest_ref(self) -> Optional[tuple[int, int]]:
+        with self._lock:
+            return self._latest_ref
+
+    def start_capture(self) -> None:
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            events = _MP.Queue()
+            stop = _MP.Event()
+            process = _MP.Process(
+                target=_capture_worker,
+                args=(
+                    self._ring.spec,
+                    self._camera_kwargs,
+                    self._source,
+                    self._discovery_cache_path,
+                    events,
+                    stop,
+                ),
+                name=f"camera-capture-{self._config.device_index}",
+                daemon=True,
+            )
+            receiver_stop = Event()
+            receiver = Thread(
+                target=self._receive,
+                args=(events, receiver_stop),
+                name=f"camera-receiver-{self._config.device_index}",
+                daemon=True,
+            )
+            self._process, self._stop = process, stop
+            self._receiver, self._receiver_stop = receiver, receiver_stop
+            # Started under the lock: an unstarted process reports not alive,
+            # which would let a concurrent caller spawn a second one.
+            process.start()
+        receiver.start()
+
+    def stop_capture(self) -> None:
+        with self._lock:
+            process, stop = self._process, self._stop
+            receiver, receiver_stop = self._receiver, self._receiver_stop
+            self._process = self._stop = self._receiver = self._receiver_stop = None
+            self._latest_ref = None
+        if stop is not None:
+            stop.set()
+        if receiver_stop is not None:
+            receiver_stop.set()
+        if process is not None:
+            process.join(timeout=3.0)
+            if process.is_alive():
+                process.terminate()
+        if receiver is not None and receiver is not current_thread():
+            receiver.join(timeout=2.0)
+        self._hub.reset()
+
+    def release(self) -> None:
+        # The capture process owns the device and releases it when stopped.
+        pass
+
+    def _receive(self, events, stop_event: Event) -> None:
+        fps = 0.0
+        last: Optional[tuple[int, float]] = None
+        while not stop_event.is_set():
+            try:
+                item = events.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return
+            while True:
+                # Only the newest frame matters; older ones are skipped.
+                try:
+                    item = events.get_nowait()
+                except queue.Empty:
+                    break
+            slot, seq, captured_at = item
+            # In-process consumers hold frames well past the next capture, so
+            # they get a copy rather than a view the writer will overwrite.
+            frame = self._ring.copy(slot, seq)
+            if frame is None:
+                continue
+            with self._lock:
+                self._latest_ref = (slot, seq)
+            self._hub.publish(frame, captured_at)
+            self._capture_frames.inc(seq - last[0] if last is not None else 1)
+            if last is not None and captured_at > last[1]:
+                rate = (seq - last[0]) / (captured_at - last[1])
+                fps = rate if fps <= 0 else fps + (rate - fps) * 0.1
+                self._capture_fps.set(fps)
+            last = (seq, captured_at)
+        self._capture_fps.set(0.0)
+
+
+class RingFaceDetectionService:
+    # FaceTracker-compatible service backed by detector processes. The
+    # detector reads the newest captured frame straight from the ring and
+    # returns a normalized box, which is scaled to the frame that asked.
+    def __init__(self, pool: WorkerPool, camera: ProcessCamera, *, timeout: float = 2.0) -> None:
+        self._pool = pool
+        self._camera = camera
+        self._timeout = timeout
+        self._lock = Lock()
+        self._inflight: dict[int, tuple[Future, float]] = {}
+
+    def submit(self, source: object, frame, callback: Callable[[Optional[Box]], None]) -> None:
+        ref = self._camera.latest_ref()
+        if ref is None:
+            return
+        key = id(source)
+        now = time.monotonic()
+        with self._lock:
+            # One outstanding request per source, like the threaded service.
+            # A request past its deadline (worker died, result lost) is
+            # dropped so detection carries on with a new one.
+            pending = self._inflight.get(key)
+            if pending is not None:
+                if now < pending[1]:
+                    return
+                self._pool.forget(pending[0])
+            future = self._pool.submit((self._camera.ring_spec, *ref))
+            self._inflight[key] = (future, now + self._timeout)
+        h, w = frame.shape[:2]
+        future.add_done_callback(lambda f: self._done(key, f, w, h, callback))
+
+    def _done(self, key: int, future: Future, w: int, h: int, callback) -> None:
+        with self._lock:
+            pending = self._inflight.get(key)
+            if pending is not None and pending[0] is future:
+                del self._inflight[key]
+        try:
+            box = future.result()
+        except Exception:
+            return
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        try:
+            callback((int(x0 * w), int(y0 * h), int(x1 * w), int(y1 * h)))
+        except Exception:
+            pass
+
+
+class RingEncoder:
+    # The renderer mirrors each display frame straight into a ring slot
+    # (`target`), and JPEG variants of it are encoded by worker processes that
+    # read that slot. Keep `slots` well above the render cache size so a cached
+    # display frame is not overwritten while it can still be requested.
+    def __init__(self, pool: WorkerPool, size: tuple[int, int], *, slots: int = 16, timeout: float = 1.0) -> None:
+        w, h = size
+        self._pool = pool
+        self._ring = SharedFrameRing.create(slots, (h, w, 3))
+        weakref.finalize(self, self._ring.close)
+        self._timeout = timeout
+        self._lock = Lock()
+        self._views = [self._ring.view(i) for i in range(slots)]
+
+    def target(self) -> np.ndarray:
+        with self._lock:
+            slot, _, _ = self._ring.claim(time.monotonic())
+            return self._views[slot]
+
+    def encode(self, display, size: tuple[int, int], quality: int) -> Optional[bytes]:
+        slot = next((i for i, view in enumerate(self._views) if view is display), None)
+        if slot is None:
+            return None
+        future = self._pool.submit((self._ring.spec, slot, self._ring.seq_at(slot), size, quality))
+        try:
+            return future.result(timeout=self._timeout)
+        except Exception:
+            self._pool.forget(future)
+            return None
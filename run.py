@@ -1,6 +1,8 @@
 from app import create_app
 
-app = create_app()
+# With MULTIPROCESS=1 the worker processes are spawned and re-import this
+# module as __mp_main__; only the parent process builds the app.
+app = create_app() if __name__ != "__mp_main__" else None
 
 if __name__ == "__main__":
     # Avoid Flask reloader: it can open the camera twice.
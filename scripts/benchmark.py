@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import cv2  # noqa: E402
+
+from app.processing import FaceDetector, FramePipeline, MotionDetector, create_face_detector  # noqa: E402
+from app.recording import VideoRecorder  # noqa: E402
+from app.routes import encode_mjpeg_frame  # noqa: E402
+from app.sources import FrameSource, SyntheticSource, VideoFileSource  # noqa: E402
+
+PERCENTILES = (50, 90, 95, 99)
+FILTER_SETS = {
+    "plain": {},
+    "grey": {"grey_on": True},
+    "negative": {"negative_on": True},
+    "grey+negative": {"grey_on": True, "negative_on": True},
+}
+
+
+def summarize(samples: list[float], frames: Optional[int] = None) -> dict:
+    arr = np.asarray(samples, dtype=np.float64)
+    total = float(arr.sum())
+    count = frames if frames is not None else len(samples)
+    result = {
+        "samples": len(samples),
+        "fps": count / total if total > 0 else 0.0,
+        "mean_ms": float(arr.mean() * 1000.0) if len(arr) else 0.0,
+    }
+    for p in PERCENTILES:
+        result[f"p{p}_ms"] = float(np.percentile(arr, p) * 1000.0) if len(arr) else 0.0
+    return result
+
+
+def timed(func: Callable[[], object], iterations: int, warmup: int) -> list[float]:
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def read_frames(source: FrameSource, count: int) -> tuple[list, list[float]]:
+    frames, samples = [], []
+    for _ in range(count):
+        started = time.perf_counter()
+        ok, frame = source.read()
+        samples.append(time.perf_counter() - started)
+        if not ok or frame is None:
+            raise RuntimeError("Frame source stopped producing frames")
+        frames.append(frame)
+    return frames, samples
+
+
+def bench_stages(frames: list, args, detector: Optional[FaceDetector]) -> dict:
+    size = (args.width, args.height)
+    pipeline = FramePipeline(size, name="benchmark")
+    cycle = _cycler(frames)
+    results = {}
+
+    for label, flags in FILTER_SETS.items():
+        results[f"process[{label}]"] = summarize(
+            timed(lambda: pipeline.process(next(cycle), flags), args.iterations, args.warmup)
+        )
+
+    motion = MotionDetector(name="benchmark")
+    seqs = itertools.count(1)
+    results["motion"] = summarize(
+        timed(lambda: motion.update(next(seqs), next(cycle)), args.iterations, args.warmup)
+    )
+
+    processed = pipeline.process(frames[0], {}).copy()
+    results["display"] = summarize(
+        timed(lambda: pipeline.display(processed, "REC"), args.iterations, args.warmup)
+    )
+    display = pipeline.display(processed)
+    for quality in args.qualities:
+        results[f"encode[q{quality}]"] = summarize(
+            timed(lambda: encode_mjpeg_frame(display, quality), args.iterations, args.warmup)
+        )
+
+    if detector is not None:
+        results["face_detect"] = summarize(
+            timed(lambda: detector.crop_face(next(cycle)), args.iterations, args.warmup)
+        )
+        for batch in (2, 4, 8):
+            batch_frames = [next(cycle) for _ in range(batch)]
+            samples = timed(lambda: detector.detect_batch(batch_frames), max(1, args.iterations // batch), 1)
+            results[f"face_detect_batch[{batch}]"] = summarize(samples, frames=len(samples) * batch)
+    return results
+
+
+def bench_end_to_end(source: FrameSource, args, detector: Optional[FaceDetector]) -> dict:
+    # One frame through the same stages a viewer triggers: capture, process,
+    # mirror + overlay, JPEG encode.
+    pipeline = FramePipeline((args.width, args.height), name="benchmark")
+    flags = dict(FILTER_SETS[args.e2e_filters])
+    if detector is not None:
+        flags["face_only_on"] = True
+
+    def one() -> None:
+        ok, frame = source.read()
+        if not ok:
+            raise RuntimeError("Frame source stopped producing frames")
+        with pipeline.lock:
+            processed = pipeline.process(frame, flags, detector)
+            display = pipeline.display(processed)
+        encode_mjpeg_frame(display, args.qualities[0])
+
+    return summarize(timed(one, args.iterations, args.warmup))
+
+
+def bench_recorder(frames: list, args) -> dict:
+    # Feed the real recorder a backlog timestamped at the target fps and time
+    # how long its encoder thread needs to drain it.
+    count = args.iterations
+    fps = args.record_fps
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = VideoRecorder(Path(tmp), fps=fps, fourcc=args.fourcc, queue_size=count + 1, name="benchmark")
+        size = (frames[0].shape[1], frames[0].shape[0])
+        origin = time.monotonic() - count / fps
+        started = time.perf_counter()
+        recorder.start(size)
+        for i in range(count):
+            recorder.submit(frames[i % len(frames)], origin + i / fps)
+        recorder.stop()
+        elapsed = time.perf_counter() - started
+        stats = recorder.stats
+        written = sum(f.stat().st_size for f in Path(tmp).glob("*.avi"))
+    return {
+        "frames": stats.frames_written,
+        "dropped": stats.frames_dropped,
+        "fps": stats.frames_written / elapsed if elapsed > 0 else 0.0,
+        "mean_ms": elapsed / max(1, stats.frames_written) * 1000.0,
+        "bytes": written,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, stats in current["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or not before.get("fps"):
+            continue
+        change = (stats["fps"] - before["fps"]) / before["fps"]
+        marker = ""
+        if change < -tolerance:
+            marker = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:28s} {before['fps']:10.1f} -> {stats['fps']:10.1f} fps ({change:+.1%}){marker}")
+    return regressions
+
+
+def _cycler(frames: list):
+    while True:
+        yield from frames
+
+
+def _open_source(args) -> FrameSource:
+    if args.source == "synthetic":
+        return SyntheticSource(args.width, args.height, args.fps, realtime=False)
+    path = Path(args.source.partition(":")[2] if args.source.startswith("file:") else args.source)
+    return VideoFileSource(path, realtime=False)
+
+
+def _load_detector(args) -> Optional[FaceDetector]:
+    prototxt = PROJECT_ROOT / "models" / "deploy.prototxt.txt"
+    model = PROJECT_ROOT / "models" / "res10_300x300_ssd_iter_140000.caffemodel"
+    if args.skip_face or not model.exists():
+        return None
+    detector = create_face_detector(model, prototxt)
+    return detector if detector.warm_up() else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the frame pipeline stages.")
+    parser.add_argument(
+        "--source",
+        default="synthetic",
+        help='"synthetic" (default) or a video file path / "file:path" to replay',
+    )
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=30.0, help="Synthetic source frame rate")
+    parser.add_argument("--iterations", type=int, default=300, help="Timed runs per stage (default: 300)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--qualities", type=int, nargs="+", default=[80, 50], help="JPEG qualities to encode at")
+    parser.add_argument("--e2e-filters", choices=sorted(FILTER_SETS), default="grey")
+    parser.add_argument("--record-fps", type=float, default=20.0)
+    parser.add_argument("--fourcc", default="XVID")
+    parser.add_argument("--skip-face", action="store_true", help="Do not benchmark the face detector")
+    parser.add_argument("--skip-recorder", action="store_true")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON (use this to save a baseline)")
+    parser.add_argument("--baseline", type=Path, help="Compare against a previously saved JSON result")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.20,
+        help="Allowed fps drop against the baseline before failing (default: 0.20)",
+    )
+    args = parser.parse_args()
+
+    source = _open_source(args)
+    if not source.isOpened():
+        print(f"Could not open frame source: {args.source}")
+        return 2
+    try:
+        frames, capture_samples = read_frames(source, max(args.iterations, 30))
+        detector = _load_detector(args)
+        if detector is None and not args.skip_face:
+            print("Face model not found in models/, skipping face detection stages")
+
+        stages = {"capture": summarize(capture_samples)}
+        stages.update(bench_stages(frames, args, detector))
+        stages["end_to_end"] = bench_end_to_end(source, args, detector)
+        if not args.skip_recorder:
+            stages["recorder"] = bench_recorder(frames, args)
+    finally:
+        source.release()
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "threads": cv2.getNumThreads(),
+        },
+        "config": {
+            "source": args.source,
+            "size": [args.width, args.height],
+            "iterations": args.iterations,
+            "qualities": args.qualities,
+            "e2e_filters": args.e2e_filters,
+            "face": detector is not None,
+        },
+        "stages": stages,
+    }
+
+    print(f"{'stage':28s} {'fps':>10s} {'mean ms':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, stats in stages.items():
+        print(
+            f"{name:28s} {stats['fps']:10.1f} {stats['mean_ms']:9.2f}"
+            + "".join(
+                f" {stats[key]:9.2f}" if key in stats else f" {'-':>9s}"
+                for key in ("p50_ms", "p95_ms", "p99_ms")
+            )
+        )
+
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        print(f"\nAgainst baseline {args.baseline}:")
+        if compare(result, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import cv2  # noqa: E402
+
+from app.processing import DNN_BACKENDS, DNN_TARGETS, create_face_detector, parse_input_size  # noqa: E402
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+DEFAULT_MODEL = PROJECT_ROOT / "models" / "res10_300x300_ssd_iter_140000.caffemodel"
+DEFAULT_PROTOTXT = PROJECT_ROOT / "models" / "deploy.prototxt.txt"
+
+
+def iou(a, b) -> float:
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def load_images(directory: Path) -> tuple[list[tuple[str, np.ndarray]], Optional[dict]]:
+    # Ground truth is optional: boxes.json maps a file name to a list of
+    # [x0, y0, x1, y1] face boxes ([] for images without a face).
+    images = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        image = cv2.imread(str(path))
+        if image is not None:
+            images.append((path.name, image))
+    truth_path = directory / "boxes.json"
+    truth = json.loads(truth_path.read_text(encoding="utf-8")) if truth_path.exists() else None
+    return images, truth
+
+
+def run_config(detector, images, repeat: int) -> tuple[dict, list]:
+    latencies, boxes = [], []
+    for _, image in images:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            box = detector.detect(image)
+            samples.append(time.perf_counter() - started)
+        latencies.append(float(np.median(samples)))
+        boxes.append(box)
+    arr = np.asarray(latencies)
+    timing = {
+        "fps": float(1.0 / arr.mean()) if arr.mean() > 0 else 0.0,
+        "mean_ms": float(arr.mean() * 1000.0),
+        "p50_ms": float(np.percentile(arr, 50) * 1000.0),
+        "p95_ms": float(np.percentile(arr, 95) * 1000.0),
+    }
+    return timing, boxes
+
+
+def score(images, boxes, truth: dict, iou_threshold: float) -> dict:
+    # Each detector reports at most one face per image, so recall is "the
+    # image's face (any of them) was found".
+    with_face = hits = false_positives = 0
+    ious = []
+    for (name, _), box in zip(images, boxes):
+        expected = [tuple(b) for b in truth.get(name) or []]
+        if expected:
+            with_face += 1
+        if box is None:
+            continue
+        best = max((iou(box, b) for b in expected), default=0.0)
+        if best >= iou_threshold:
+            hits += 1
+            ious.append(best)
+        else:
+            false_positives += 1
+    return {
+        "recall": hits / with_face if with_face else 0.0,
+        "false_positives": false_positives,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Face detector accuracy vs latency over a set of images.")
+    parser.add_argument(
+        "--images",
+        type=Path,
+        default=PROJECT_ROOT / "benchmarks" / "faces",
+        help="Directory of test images, optionally with boxes.json (default: benchmarks/faces)",
+    )
+    parser.add_argument(
+        "--model",
+        type=Path,
+        action="append",
+        help="Model file; repeat to compare (default: the res10 Caffe model in models/)",
+    )
+    parser.add_argument("--prototxt", type=Path, default=DEFAULT_PROTOTXT, help="Prototxt for Caffe models")
+    parser.add_argument(
+        "--input-sizes",
+        nargs="+",
+        default=["160", "224", "300", "400"],
+        help='Input sizes to try, "300" or "320x240" (default: 160 224 300 400)',
+    )
+    parser.add_argument("--backend", choices=sorted(DNN_BACKENDS), default="default")
+    parser.add_argument("--target", choices=sorted(DNN_TARGETS), default="cpu")
+    parser.add_argument("--min-confidence", type=float, default=0.5)
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU counted as a hit (default: 0.5)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per image (median is kept)")
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    if not args.images.is_dir():
+        print(f"Image directory not found: {args.images}")
+        return 2
+    images, truth = load_images(args.images)
+    if not images:
+        print(f"No images in {args.images}")
+        return 2
+
+    configs = []
+    for model in args.model or [DEFAULT_MODEL]:
+        for size in args.input_sizes:
+            configs.append((model, parse_input_size(size)))
+
+    results = []
+    reference_boxes = None
+    for model, size in configs:
+        detector = create_face_detector(
+            model,
+            args.prototxt,
+            args.min_confidence,
+            input_size=size,
+            backend=args.backend,
+            target=args.target,
+        )
+        if not detector.warm_up():
+            print(f"SKIP: {model.name} {size[0]}x{size[1]}: {detector.error}")
+            continue
+        timing, boxes = run_config(detector, images, max(1, args.repeat))
+        if truth is None and reference_boxes is None:
+            # Without ground truth the first configuration is the reference
+            # the others are scored against.
+            reference_boxes = boxes
+            print(f"No boxes.json: scoring against {model.name} {size[0]}x{size[1]}")
+        expected = truth if truth is not None else {
+            name: [list(box)] if box is not None else [] for (name, _), box in zip(images, reference_boxes)
+        }
+        results.append(
+            {
+                "model": model.name,
+                "input_size": list(size),
+                "load_ms": (detector.load_seconds or 0.0) * 1000.0,
+                **timing,
+                **score(images, boxes, expected, args.iou),
+            }
+        )
+
+    print(
+        f"\n{'model':44s} {'input':>9s} {'recall':>7s} {'fp':>4s} {'iou':>6s}"
+        f" {'fps':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'load ms':>8s}"
+    )
+    for r in results:
+        print(
+            f"{r['model']:44s} {r['input_size'][0]:>4d}x{r['input_size'][1]:<4d} {r['recall']:7.3f}"
+            f" {r['false_positives']:4d} {r['mean_iou']:6.3f} {r['fps']:8.1f} {r['p50_ms']:8.2f}"
+            f" {r['p95_ms']:8.2f} {r['load_ms']:8.1f}"
+        )
+
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "images": len(images),
+            "ground_truth": truth is not None,
+            "backend": args.backend,
+            "target": args.target,
+            "results": results,
+        }
+        args.output.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        print(f"\nResults written to {args.output}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,66 +2,61 @@ from __future__ import annotations
 
 import argparse
 import sys
+from pathlib import Path
 
-import cv2
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
 
-
-def backend_candidates() -> list[tuple[str, int]]:
-    def add(name: str, acc: list[tuple[str, int]]) -> None:
-        value = getattr(cv2, name, None)
-        if value is None:
-            return
-        if any(v == value for _, v in acc):
-            return
-        acc.append((name, value))
-
-    candidates: list[tuple[str, int]] = []
-    if sys.platform.startswith("win"):
-        add("CAP_DSHOW", candidates)
-        add("CAP_MSMF", candidates)
-    elif sys.platform == "darwin":
-        add("CAP_AVFOUNDATION", candidates)
-    else:
-        add("CAP_V4L2", candidates)
-    add("CAP_ANY", candidates)
-    return candidates
+from app.discovery import DiscoveryCache, backend_candidates, probe_indices  # noqa: E402
 
 
 def main() -> int:
     parser = argparse.ArgumentParser(description="List working OpenCV camera indices/backends.")
     parser.add_argument("--max-index", type=int, default=5, help="Max index to probe (default: 5)")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3.0,
+        help="Seconds to wait for each index/backend attempt (default: 3.0)",
+    )
+    parser.add_argument(
+        "--write-cache",
+        action="store_true",
+        help="Store the working devices in the discovery cache used by the app",
+    )
+    parser.add_argument(
+        "--cache-path",
+        type=Path,
+        default=PROJECT_ROOT / ".camera_cache.json",
+        help="Discovery cache file (default: .camera_cache.json in the project root)",
+    )
     args = parser.parse_args()
 
     backends = backend_candidates()
     print("Backends:", ", ".join(name for name, _ in backends))
 
-    found_any = False
-    for index in range(max(0, args.max_index) + 1):
-        ok = False
-        for name, backend in backends:
-            cap = None
-            try:
-                cap = cv2.VideoCapture(index, backend)
-                if cap is None or not cap.isOpened():
-                    continue
-                ret, frame = cap.read()
-                shape = getattr(frame, "shape", None) if ret else None
-                print(f"OK: index={index} backend={name} frame_shape={shape}")
-                ok = True
-                found_any = True
-                break
-            except Exception as e:
-                print(f"ERR: index={index} backend={name} error={e}")
-            finally:
-                try:
-                    if cap is not None:
-                        cap.release()
-                except Exception:
-                    pass
-        if not ok:
+    indices = list(range(max(0, args.max_index) + 1))
+    found = probe_indices(indices, backends, args.timeout, read_frame=True)
+    cache = DiscoveryCache(args.cache_path) if args.write_cache else None
+
+    for index in indices:
+        if index not in found:
             print(f"NO: index={index}")
+            continue
+        result, cap = found[index]
+        try:
+            ret, frame = cap.read()
+            shape = getattr(frame, "shape", None) if ret else None
+        finally:
+            cap.release()
+        print(f"OK: index={index} backend={result.backend_name} frame_shape={shape}")
+        if cache is not None:
+            cache.put(str(index), result)
 
-    if not found_any:
+    if cache is not None and found:
+        print(f"\nDiscovery cache written to {cache.path}")
+
+    if not found:
         print("\nNo camera could be opened. If you're on Windows, check:")
         print("- Settings > Privacy & security > Camera (desktop apps allowed)")
         print("- Another app isn't using the camera (Teams/Zoom/etc)")
@@ -71,4 +66,3 @@ def main() -> int:
 
 if __name__ == "__main__":
     raise SystemExit(main())
-
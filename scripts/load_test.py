@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from threading import Event, Thread
+from typing import Optional
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+PROFILES = ("fast", "throttled", "stalled")
+
+
+class MultipartReader:
+    # Incremental parser for a multipart/x-mixed-replace response: HTTP
+    # headers, then parts of "--boundary", part headers and a JPEG body.
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._boundary: Optional[bytes] = None
+        self._part_length: Optional[int] = None
+        self._in_body = False
+        self.status: Optional[int] = None
+        self.frame_sizes: list[int] = []
+
+    def feed(self, data: bytes) -> int:
+        self._buffer += data
+        if self.status is None and not self._read_response_headers():
+            return 0
+        frames = 0
+        while self._next_part():
+            frames += 1
+        return frames
+
+    def _read_response_headers(self) -> bool:
+        end = self._buffer.find(b"\r\n\r\n")
+        if end < 0:
+            return False
+        lines = bytes(self._buffer[:end]).decode("latin-1").split("\r\n")
+        del self._buffer[: end + 4]
+        self.status = int(lines[0].split()[1])
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-type" and "boundary=" in value:
+                self._boundary = b"--" + value.split("boundary=", 1)[1].strip().strip('"').encode()
+        if self.status != 200 or self._boundary is None:
+            raise ValueError(f"Not an MJPEG stream (HTTP {self.status})")
+        return True
+
+    def _next_part(self) -> bool:
+        buf = self._buffer
+        if not self._in_body:
+            start = buf.find(self._boundary)
+            if start < 0:
+                return False
+            end = buf.find(b"\r\n\r\n", start)
+            if end < 0:
+                return False
+            self._part_length = None
+            for line in bytes(buf[start:end]).decode("latin-1").split("\r\n")[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    self._part_length = int(value)
+            del buf[: end + 4]
+            self._in_body = True
+        if self._part_length is not None:
+            if len(buf) < self._part_length:
+                return False
+            size = self._part_length
+        else:
+            # No Content-Length (this app does not send one): the body is a
+            # JPEG, which ends at the EOI marker.
+            eoi = buf.find(b"\xff\xd9")
+            if eoi < 0:
+                return False
+            size = eoi + 2
+        self.frame_sizes.append(size)
+        del buf[:size]
+        self._in_body = False
+        return True
+
+
+def run_client(client_id: int, profile: str, args, stop: Event, results: list) -> None:
+    started = time.perf_counter()
+    arrivals: list[float] = []
+    received = 0
+    error = None
+    reader = MultipartReader()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if profile != "fast":
+            # A small receive buffer makes the server feel a slow reader
+            # instead of the kernel soaking up megabytes.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, args.recv_buffer)
+        sock.settimeout(args.timeout)
+        sock.connect((args.host, args.port))
+        # HTTP/1.0 keeps the response close-delimited (no chunked encoding).
+        sock.sendall(f"GET {args.path} HTTP/1.0\r\nHost: {args.host}:{args.port}\r\n\r\n".encode())
+        stall_from = started + args.stall_after
+        stall_until = stall_from + (args.stall_for if args.stall_for > 0 else float("inf"))
+        while not stop.is_set():
+            now = time.perf_counter()
+            if profile == "stalled" and stall_from <= now < stall_until:
+                stop.wait(min(0.1, stall_until - now))
+                continue
+            data = sock.recv(65536)
+            if not data:
+                error = "closed by server"
+                break
+            received += len(data)
+            done = reader.feed(data)
+            if done:
+                arrivals.extend([time.perf_counter()] * done)
+            if profile == "throttled":
+                delay = started + received / (args.throttle_kbps * 125.0) - time.perf_counter()
+                if delay > 0:
+                    stop.wait(delay)
+    except (OSError, ValueError) as exc:
+        error = str(exc) or type(exc).__name__
+    finally:
+        sock.close()
+    ended = time.perf_counter()
+    results.append(client_report(client_id, profile, started, ended, arrivals, received, reader, error, args.warmup))
+
+
+def client_report(client_id, profile, started, ended, arrivals, received, reader, error, warmup) -> dict:
+    # fps and jitter are measured after the warmup window; fps over the whole
+    # rest of the connection, so a client that stops getting frames shows it.
+    measured = [t for t in arrivals if t >= started + warmup]
+    intervals = np.diff(measured) if len(measured) > 1 else np.empty(0)
+    window = ended - (started + warmup)
+    return {
+        "id": client_id,
+        "profile": profile,
+        "frames": len(arrivals),
+        "bytes": received,
+        "fps": len(measured) / window if window > 0 else 0.0,
+        "mean_frame_kb": float(np.mean(reader.frame_sizes) / 1024) if reader.frame_sizes else 0.0,
+        "first_frame_ms": (arrivals[0] - started) * 1000.0 if arrivals else None,
+        "interval_mean_ms": float(intervals.mean() * 1000.0) if len(intervals) else None,
+        "jitter_ms": float(intervals.std() * 1000.0) if len(intervals) else None,
+        "interval_p95_ms": float(np.percentile(intervals, 95) * 1000.0) if len(intervals) else None,
+        "max_gap_ms": float(intervals.max() * 1000.0) if len(intervals) else None,
+        "error": error,
+    }
+
+
+def summarize_profiles(clients: list[dict]) -> dict:
+    summary = {}
+    for profile in PROFILES:
+        group = [c for c in clients if c["profile"] == profile]
+        if not group:
+            continue
+        fps = [c["fps"] for c in group]
+        jitter = [c["jitter_ms"] for c in group if c["jitter_ms"] is not None]
+        summary[profile] = {
+            "clients": len(group),
+            "fps_mean": float(np.mean(fps)),
+            "fps_min": float(np.min(fps)),
+            "jitter_mean_ms": float(np.mean(jitter)) if jitter else None,
+            "errors": sum(1 for c in group if c["error"]),
+        }
+    return summary
+
+
+class ProcessSampler:
+    # CPU and RSS of the server and its child processes, read from /proc
+    # (Linux); elsewhere the report leaves them empty.
+    def __init__(self, pid: int, interval: float) -> None:
+        self._pid = pid
+        self._interval = interval
+        self._stop = Event()
+        self._cpu: list[float] = []
+        self._rss: list[float] = []
+        self._thread = Thread(target=self._run, name="load-test-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        return {
+            "samples": len(self._rss),
+            "cpu_percent_mean": float(np.mean(self._cpu)) if self._cpu else None,
+            "cpu_percent_max": float(np.max(self._cpu)) if self._cpu else None,
+            "rss_mb_mean": float(np.mean(self._rss)) if self._rss else None,
+            "rss_mb_max": float(np.max(self._rss)) if self._rss else None,
+        }
+
+    def _run(self) -> None:
+        if not Path("/proc/self/stat").exists():
+            return
+        ticks = os.sysconf("SC_CLK_TCK")
+        page = os.sysconf("SC_PAGE_SIZE")
+        last = None
+        while not self._stop.wait(self._interval):
+            cpu, rss = 0, 0
+            for pid in _process_tree(self._pid):
+                try:
+                    fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+                    statm = Path(f"/proc/{pid}/statm").read_text().split()
+                except OSError:
+                    continue
+                cpu += int(fields[11]) + int(fields[12])
+                rss += int(statm[1]) * page
+            now = time.perf_counter()
+            if last is not None:
+                self._cpu.append((cpu - last[1]) / ticks / (now - last[0]) * 100.0)
+            last = (now, cpu)
+            self._rss.append(rss / (1024 * 1024))
+
+
+def _process_tree(root: int) -> list[int]:
+    parents: dict[int, int] = {}
+    for entry in Path("/proc").iterdir():
+        if entry.name.isdigit():
+            try:
+                parents[int(entry.name)] = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree = [root]
+    for pid in tree:
+        tree.extend(child for child, parent in parents.items() if parent == pid)
+    return tree
+
+
+def start_server(args) -> subprocess.Popen:
+    env = os.environ.copy()
+    env["CAMERA_SOURCE"] = args.source
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    if args.mode == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "--factory", "app.asgi:create_asgi_app"]
+        command += ["--host", args.host, "--port", str(args.port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "run:app", "run"]
+        command += ["--host", args.host, "--port", str(args.port), "--no-reload", "--with-threads"]
+    log = open(args.server_log, "wb") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://{args.host}:{args.port}/readyz", timeout=1.0):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+def parse_clients(spec: str) -> list[str]:
+    # "fast=20,throttled=4,stalled=1"
+    profiles = []
+    for item in spec.split(","):
+        name, _, count = item.strip().partition("=")
+        if name not in PROFILES:
+            raise ValueError(f"Unknown client profile: {name!r}")
+        profiles.extend([name] * int(count or 1))
+    return profiles
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Simulate many /video_feed viewers and report what each one gets.")
+    parser.add_argument("--clients", default="fast=10", help="Profiles and counts, e.g. fast=20,throttled=4,stalled=1")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to keep the clients connected")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds ignored for fps and jitter")
+    parser.add_argument("--ramp", type=float, default=0.0, help="Seconds over which the clients connect")
+    parser.add_argument("--mode", choices=("threaded", "asgi"), default="threaded", help="How the app is served")
+    parser.add_argument("--source", default="synthetic", help="CAMERA_SOURCE for the app (synthetic[:WxH@fps], file:clip.mp4, raw:...)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for the app")
+    parser.add_argument("--url", help="Test an already running app at this base URL instead of starting one")
+    parser.add_argument("--pid", type=int, help="With --url: server process to sample for CPU and RSS")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--query", default="", help="Query string for /video_feed, e.g. size=half&quality=60")
+    parser.add_argument("--throttle-kbps", type=float, default=2000.0, help="Read rate of throttled clients (kbit/s)")
+    parser.add_argument("--stall-after", type=float, default=3.0, help="Seconds stalled clients read before stopping")
+    parser.add_argument("--stall-for", type=float, default=0.0, help="Seconds stalled clients stop reading (0: until the end)")
+    parser.add_argument("--recv-buffer", type=int, default=64 * 1024, help="Socket receive buffer of slow clients")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Socket timeout of each client")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--server-log", type=Path, help="Write the app's output to this file")
+    parser.add_argument("--output", type=Path, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        profiles = parse_clients(args.clients)
+    except ValueError as exc:
+        parser.error(str(exc))
+    args.host = "127.0.0.1"
+    if args.url:
+        base = urllib.parse.urlparse(args.url)
+        args.host, args.port = base.hostname, base.port or 80
+    args.path = "/video_feed" + (f"?{args.query}" if args.query else "")
+
+    server = None if args.url else start_server(args)
+    pid = server.pid if server is not None else args.pid
+    sampler = ProcessSampler(pid, args.sample_interval) if pid else None
+    stop = Event()
+    results: list[dict] = []
+    try:
+        if sampler is not None:
+            sampler.start()
+        threads = []
+        for client_id, profile in enumerate(profiles, start=1):
+            thread = Thread(target=run_client, args=(client_id, profile, args, stop, results), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if args.ramp > 0:
+                time.sleep(args.ramp / len(profiles))
+        stop.wait(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=args.timeout + 1.0)
+        server_stats = sampler.stop() if sampler is not None else {}
+    finally:
+        stop.set()
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=10.0)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    clients = sorted(results, key=lambda c: c["id"])
+    report = {
+        "config": {
+            "mode": "external" if args.url else args.mode,
+            "source": None if args.url else args.source,
+            "env": args.env,
+            "clients": args.clients,
+            "query": args.query,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "throttle_kbps": args.throttle_kbps,
+            "stall_after": args.stall_after,
+            "stall_for": args.stall_for,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "server": server_stats,
+        "profiles": summarize_profiles(clients),
+        "clients": clients,
+    }
+
+    for name, profile in report["profiles"].items():
+        jitter = profile["jitter_mean_ms"]
+        print(
+            f"{name:10s} clients={profile['clients']:3d} fps mean={profile['fps_mean']:6.1f} "
+            f"min={profile['fps_min']:6.1f} jitter={jitter if jitter is not None else float('nan'):6.1f}ms "
+            f"errors={profile['errors']}"
+        )
+    if server_stats.get("samples"):
+        print(
+            f"server     cpu mean={server_stats['cpu_percent_mean'] or 0.0:.0f}% "
+            f"max={server_stats['cpu_percent_max'] or 0.0:.0f}% rss max={server_stats['rss_mb_max']:.0f}MB"
+        )
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.rawcapture import RawVideo, index_path, transcode  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compress raw captures (.raw + .idx) to AVI/MP4.")
+    parser.add_argument("raw", type=Path, nargs="+", help="Raw capture file(s)")
+    parser.add_argument("--format", choices=("avi", "mp4"), default="avi", help="Output container (default: avi)")
+    parser.add_argument("--fourcc", default=None, help="Codec FOURCC (default: XVID for avi, mp4v for mp4)")
+    parser.add_argument("--fps", type=float, default=None, help="Output fps (default: measured from the capture)")
+    parser.add_argument("--delete-raw", action="store_true", help="Remove the raw files after a successful transcode")
+    args = parser.parse_args()
+
+    failed = 0
+    for raw_path in args.raw:
+        try:
+            video = RawVideo(raw_path)
+            output = transcode(raw_path, raw_path.with_suffix(f".{args.format}"), fourcc=args.fourcc, fps=args.fps)
+        except Exception as exc:
+            print(f"FAILED: {raw_path}: {exc}")
+            failed += 1
+            continue
+        print(f"OK: {raw_path} -> {output} frames={len(video)} fps={args.fps or video.fps:.1f}")
+        if args.delete_raw:
+            raw_path.unlink(missing_ok=True)
+            index_path(raw_path).unlink(missing_ok=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())